@@ -1,5 +1,4 @@
 import React, { useState, useRef, useEffect } from "react";
-import axios from "axios";
 
 const Chatbot = () => {
   const [messages, setMessages] = useState([
@@ -64,13 +63,54 @@ const Chatbot = () => {
       formData.append("message", textInput);
       if (imageToSend) formData.append("image", imageToSend);
 
-      const response = await axios.post("http://localhost:5000/api/analyze", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
+      // Stream the reply: tokens arrive as server-sent events and are appended
+      // to a bot message as they come in; the final "result" event carries the
+      // same JSON as /api/analyze. A "degraded" event (slow upstreams) carries
+      // a quick local estimate that is shown until the first token replaces it.
+      const response = await fetch("http://localhost:5000/api/analyze/stream", {
+        method: "POST",
+        body: formData,
       });
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
 
-      const botReply = response.data.chatbot_response || "No response from server.";
-
-      setMessages((prev) => [...prev, { sender: "bot", text: botReply }]);
+      setMessages((prev) => [...prev, { sender: "bot", text: "" }]);
+      setIsLoading(false);
+      const setBotText = (update) =>
+        setMessages((prev) => {
+          const next = [...prev];
+          const last = next[next.length - 1];
+          next[next.length - 1] = { ...last, text: update(last.text) };
+          return next;
+        });
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let estimateShown = false;
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(rawEvent.match(/^data: (.*)$/m)?.[1] || "{}");
+          if (event === "token") {
+            const replace = estimateShown;
+            estimateShown = false;
+            setBotText((text) => (replace ? "" : text) + data.text);
+          } else if (event === "degraded") {
+            estimateShown = true;
+            setBotText(() => data.chatbot_response);
+          } else if (event === "result") {
+            setBotText(() => data.chatbot_response || "No response from server.");
+          } else if (event === "error") {
+            setBotText(() => "⚠️ Error connecting to server.");
+          }
+        }
+      }
     } catch (error) {
       console.error("API error:", error);
       setMessages((prev) => [...prev, { sender: "bot", text: "⚠️ Error connecting to server." }]);
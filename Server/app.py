@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context, g
 from dotenv import load_dotenv
 load_dotenv()
 from flask_cors import CORS
@@ -6,10 +6,28 @@ from clarifai.client.model import Model
 from clarifai.client.input import Inputs
 from clarifai_grpc.grpc.api.status import status_code_pb2
 from groq import Groq
-import base64
+import groq
+import httpx
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
 import traceback
+import uuid
 import requests
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from datetime import datetime, timezone
+from prediction_cache import PredictionCache
+from history_store import HistoryStore, HISTORY_FIELDS, DEFAULT_USER, decode_data_url
+from embedding_index import EmbeddingIndex, fetch_embedding, same_picture
+from metrics import Registry, Timings, CONTENT_TYPE as METRICS_CONTENT_TYPE, cache_lookup_counts
+from profiler import SamplingProfiler
+from upload_pipeline import ImageTooLarge, prepare_image
+from upload_store import UploadStore
+from upstream import CircuitBreaker, CircuitOpen, UpstreamError, call_with_retries, make_session, post_json
 app = Flask(__name__)
 CORS(app)
 
@@ -18,73 +36,337 @@ CLARIFAI_API_KEY = os.getenv("CLARIFAI_API_KEY")
 SPOONACULAR_API_KEY = os.getenv("SPOONACULAR_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# Upstream call policy (see upstream.py)
+UPSTREAM_CONNECT_TIMEOUT_S = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_S", "3"))
+CLARIFAI_READ_TIMEOUT_S = float(os.getenv("CLARIFAI_READ_TIMEOUT_S", "15"))
+GROQ_READ_TIMEOUT_S = float(os.getenv("GROQ_READ_TIMEOUT_S", "60"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_S = float(os.getenv("UPSTREAM_BACKOFF_S", "0.2"))
+UPSTREAM_DEADLINE_S = float(os.getenv("UPSTREAM_DEADLINE_S", "90"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
 # clarifai_model = Model("clarifai/main/models/food-item-recognition/versions/dfebc169854e429086aceb8368662641", api_key=CLARIFAI_API_KEY)
-groq_client = Groq(api_key=GROQ_API_KEY)
+# The SDK's own retries are off; call_with_retries applies the shared policy
+groq_client = Groq(api_key=GROQ_API_KEY, max_retries=0,
+                   timeout=httpx.Timeout(GROQ_READ_TIMEOUT_S, connect=UPSTREAM_CONNECT_TIMEOUT_S))
+http_session = make_session()
+clarifai_breaker = CircuitBreaker("clarifai", BREAKER_FAILURES, BREAKER_RESET_S)
+groq_breaker = CircuitBreaker("groq", BREAKER_FAILURES, BREAKER_RESET_S)
+# Clarifai and Groq are dispatched side by side on this pool
+upstream_pool = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_WORKERS", "32")), thread_name_prefix="upstream")
 
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Images sent to Clarifai/Groq are downscaled to this long edge (0 sends the original)
+UPSTREAM_IMAGE_MAX_EDGE = int(os.getenv("UPSTREAM_IMAGE_MAX_EDGE", "1024"))
+UPSTREAM_JPEG_QUALITY = int(os.getenv("UPSTREAM_JPEG_QUALITY", "85"))
+# Larger uploads are refused with 413 before they are decoded, stored or sent upstream
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+# Uploads are stored by content hash with thumb/display variants under an LRU
+# size budget, UPLOAD_MAX_MB (see upload_store.py): an upload URL answers 404
+# once its original has been evicted. Analyzed originals are kept too unless
+# PERSIST_UPLOADS=0
+PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "1") == "1"
+upload_store = UploadStore(UPLOAD_FOLDER, max_bytes=int(float(os.getenv("UPLOAD_MAX_MB", "2048")) * 1024 * 1024))
+IMMUTABLE_MAX_AGE = 31536000
+
+# Cache of /api/analyze replies keyed by image bytes + message, so re-uploads
+# of the same photo skip the paid Clarifai/Groq round trips
+CACHE_DIR = os.getenv("CACHE_DIR") or None
+analyze_cache = PredictionCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+    ttl_s=float(os.getenv("CACHE_TTL_S", "3600")),
+    disk_dir=os.path.join(CACHE_DIR, "analyze") if CACHE_DIR else None,
+    disk_max_entries=int(os.getenv("CACHE_DISK_MAX_ENTRIES", "100000")),
+    disk_max_bytes=int(float(os.getenv("CACHE_DISK_MAX_MB", "512")) * 1024 * 1024),
+)
+
+# Meal history: SQLite index + content-addressed image blobs (see history_store.py)
+history_store = HistoryStore(os.getenv("HISTORY_DB", "history.db"), os.getenv("HISTORY_BLOB_DIR", "history_blobs"))
+HISTORY_MAX_LIMIT = 5000
+
+# Embeddings of saved meals (float16, memory-mapped; see embedding_index.py) for
+# /api/history/similar and for answering near-duplicate uploads from history.
+# Embeddings come from app2's /embed; leaving EMBEDDING_SERVICE_URL unset turns both off
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")   # e.g. http://localhost:7000
+EMBEDDING_TIMEOUT_S = float(os.getenv("EMBEDDING_TIMEOUT_S", "2"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.97"))   # cosine similarity
+NEAR_DUPLICATE_PIXEL_TOLERANCE = float(os.getenv("NEAR_DUPLICATE_PIXEL_TOLERANCE", "0.05"))   # see same_picture
+# The index is shared by all users; this many nearest meals are checked for one of the requester's own
+NEAR_DUPLICATE_CANDIDATES = int(os.getenv("NEAR_DUPLICATE_CANDIDATES", "8"))
+meal_index = EmbeddingIndex(os.getenv("EMBEDDING_INDEX", "history_embeddings"))
+# Analyses of recent uploads by image bytes, so /api/save can store the reply
+# (and its embedding) with the meal
+recent_analyses = PredictionCache(max_entries=256, ttl_s=float(os.getenv("CACHE_TTL_S", "3600")))
+
+# Hedge against slow upstreams: with HEDGE_BUDGET_S > 0 the local classifier
+# (app2's /predict at LOCAL_MODEL_URL) runs alongside Clarifai/Groq, and if
+# they haven't both answered within the budget the reply is the local
+# prediction marked "degraded". The budget is a hard cap on the wait: the
+# local model gets the same budget, and if it hasn't answered either the
+# request carries on waiting for the upstreams as if there were no hedge.
+# The upstream calls keep going; their reply is cached as usual and can be
+# fetched from /api/analyze/result/<follow_up>. /api/analyze/stream sends the
+# local prediction as a `degraded` event when no token arrived within the
+# budget, then carries on streaming.
+LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL") or EMBEDDING_SERVICE_URL
+HEDGE_BUDGET_S = float(os.getenv("HEDGE_BUDGET_S", "0"))   # 0 = off
+FOLLOW_UP_TTL_S = float(os.getenv("FOLLOW_UP_TTL_S", "600"))
+follow_ups = {}   # token -> {"expires_at", "result", "error"}
+follow_ups_lock = threading.Lock()
+
+# Metrics (exposed on /metrics, per-request stages in Server-Timing)
+metrics = Registry()
+request_seconds = metrics.histogram("food_api_request_seconds", "HTTP request latency", ("endpoint", "status"))
+requests_in_flight = metrics.gauge("food_api_requests_in_flight", "HTTP requests being handled")
+stage_seconds = metrics.histogram("food_api_stage_seconds", "Time spent per /api/analyze stage", ("stage",))
+upstream_errors = metrics.counter("food_api_upstream_errors_total", "Failed upstream attempts", ("provider", "kind"))
+metrics.counter("food_api_cache_lookups_total", "Analyze cache lookups", ("result",), fn=cache_lookup_counts(analyze_cache))
+degraded_replies = metrics.counter("food_api_degraded_total", "Analyses answered by the local model after the hedge budget")
+near_duplicate_hits = metrics.counter("food_api_near_duplicate_hits_total", "Analyses answered from a similar saved meal")
+metrics.gauge("food_api_meal_index_size", "Meals in the embedding index", fn=lambda: len(meal_index))
+metrics.gauge("food_api_upload_store_bytes", "Bytes of stored uploads and variants",
+              fn=lambda: upload_store.stats()["bytes"])
+metrics.counter("food_api_upload_evictions_total", "Uploads/variants evicted by the size budget",
+                fn=lambda: upload_store.evicted)
+metrics.gauge("food_api_upstream_queue_depth", "Upstream calls waiting for a pool thread",
+              fn=lambda: upstream_pool._work_queue.qsize())
+metrics.gauge("food_api_circuit_open", "1 while a provider's circuit breaker is open", ("provider",),
+              fn=lambda: {(b.name,): int(b.state == "open") for b in (clarifai_breaker, groq_breaker)})
+
+# Sampling profiler (PROFILER_ENABLED=1), see /debug/profile
+profiler = SamplingProfiler(float(os.getenv("PROFILER_INTERVAL_MS", "5"))) if os.getenv("PROFILER_ENABLED", "0") == "1" else None
+
+CLARIFAI_API_URL = os.getenv("CLARIFAI_API_URL", "https://api.clarifai.com")
+GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+def count_upstream_error(provider):
+    def on_error(e):
+        kind = "circuit_open" if isinstance(e, CircuitOpen) else "retryable" if e.retryable else "fatal"
+        upstream_errors.inc(provider=provider, kind=kind)
+    return on_error
+
+def clarifai_detect(image_b64, deadline=None):
+    """Run Clarifai's food model on a base64 image; returns the raw result or None on failure."""
+    url = f"{CLARIFAI_API_URL}/v2/models/food-item-recognition/outputs"
+    headers = {
+        "Authorization": f"Key {CLARIFAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "user_app_id": {"user_id": "clarifai", "app_id": "main"},
+        "inputs": [{"data": {"image": {"base64": image_b64}}}]
+    }
+
+    result = call_with_retries(
+        lambda: post_json(http_session, url, data, headers=headers,
+                          timeout=(UPSTREAM_CONNECT_TIMEOUT_S, CLARIFAI_READ_TIMEOUT_S)),
+        clarifai_breaker, UPSTREAM_RETRIES, UPSTREAM_BACKOFF_S, deadline=deadline,
+        on_error=count_upstream_error("clarifai"),
+    )
 
-@app.route("/upload", methods=["POST"])
-def upload_file():
-    file = request.files['file']
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(filepath)
-    return {"url": f"http://localhost:5000/uploads/{file.filename}"}
+    if "outputs" not in result or not result["outputs"]:
+        return None
+    return result
 
-@app.route("/uploads/<filename>")
-def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
-
-@app.route("/api/analyze", methods=["POST"])
-def analyze_food():
+def _groq_create(kwargs):
     try:
-        
-        file = request.files["image"]
-        user_text = request.form.get("message", "")
-
-        # Save uploaded file locally
-        filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(filepath)
-
-        # Create a public URL for Groq
-        image_url_from_upload = f"http://localhost:5000/uploads/{file.filename}"
-
-        # -------- Clarifai REST API --------
-        with open(filepath, "rb") as f:
-            image_b64 = base64.b64encode(f.read()).decode("utf-8")
-
-    
-
-
-        # -------- Clarifai REST API --------
-        url = "https://api.clarifai.com/v2/models/food-item-recognition/outputs"
-        headers = {
-            "Authorization": f"Key {CLARIFAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "user_app_id": {"user_id": "clarifai", "app_id": "main"},
-            "inputs": [{"data": {"image": {"base64": image_b64}}}]
-        }
-
-        response = requests.post(url, headers=headers, json=data)
-        result = response.json()
+        return groq_client.chat.completions.create(**kwargs)
+    except groq.APIConnectionError as e:   # includes timeouts
+        raise UpstreamError(f"Groq: {e}", retryable=True) from e
+    except groq.APIStatusError as e:
+        raise UpstreamError(f"Groq: {e}", retryable=e.status_code == 429 or e.status_code >= 500) from e
+    except groq.APIError as e:   # e.g. a response that doesn't validate
+        raise UpstreamError(f"Groq: {e}") from e
+
+def groq_complete(prompt, image_b64, stream=False, deadline=None, mime="image/jpeg"):
+    """Groq chat completion (or stream) with retries and the Groq circuit breaker.
+
+    For streams only opening the stream is retried, never a half-read reply.
+    """
+    kwargs = groq_request(prompt, image_b64, stream=stream, mime=mime)
+    return call_with_retries(lambda: _groq_create(kwargs), groq_breaker, UPSTREAM_RETRIES,
+                             UPSTREAM_BACKOFF_S, deadline=deadline, on_error=count_upstream_error("groq"))
+
+def remaining(deadline):
+    return max(deadline - time.monotonic(), 0.0)
+
+def upstream_error_response(e, provider):
+    if isinstance(e, CircuitOpen):
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(BREAKER_RESET_S))}
+    if isinstance(e, FutureTimeout):
+        upstream_errors.inc(provider=provider, kind="deadline")
+        return jsonify({"error": "Upstream deadline exceeded"}), 504
+    return jsonify({"error": str(e)}), 502
+
+def embed(image_bytes):
+    """Classifier embedding of an image from app2, or None if the service is off or failing."""
+    if not EMBEDDING_SERVICE_URL:
+        return None
+    try:
+        return fetch_embedding(http_session, EMBEDDING_SERVICE_URL, image_bytes, timeout=EMBEDDING_TIMEOUT_S)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        upstream_errors.inc(provider="embedding", kind="fatal")
+        print(f"Embedding service failed: {e}")
+        return None
+
+def near_duplicate_lookup(image_bytes, image_data, user_text, user):
+    """(embedding, near-duplicate analysis or None) of an upload; runs alongside the upstream calls."""
+    embedding = embed(image_data)
+    if embedding is None:
+        return None, None
+    return embedding, find_near_duplicate(image_bytes, embedding, user_text, user)
+
+def lookup_result(lookup):
+    """near_duplicate_lookup's result if it has finished, else (None, None); never blocks."""
+    if not lookup.done() or lookup.cancelled() or lookup.exception() is not None:
+        return None, None
+    return lookup.result()
+
+def wait_for_duplicate(lookup, clarifai_future, groq_future, until):
+    """The near-duplicate analysis if the lookup finds one before both upstreams answer (and before `until`)."""
+    while True:
+        if lookup_result(lookup)[1] is not None:
+            return lookup_result(lookup)[1]
+        pending = [f for f in (lookup, clarifai_future, groq_future) if not f.done()]
+        if lookup not in pending or len(pending) < 2 or remaining(until) <= 0:
+            # No hit, both upstreams answered, or out of time
+            return None
+        wait(pending, timeout=remaining(until), return_when=FIRST_COMPLETED)
+
+def find_near_duplicate(image_bytes, embedding, user_text, user=None):
+    """The stored analysis of one of `user`'s saved meals showing the same picture (asked with the same message), or None."""
+    user = user or DEFAULT_USER
+    hits = [hit for hit in meal_index.search(embedding, k=NEAR_DUPLICATE_CANDIDATES)
+            if hit[1] >= NEAR_DUPLICATE_THRESHOLD]
+    meals = history_store.meals([meal_id for meal_id, _ in hits], fields=("id", "user", "image", "extra"))
+    for meal_id, similarity in hits:
+        meal = meals.get(meal_id)
+        if meal is None or meal["user"] != user:
+            continue
+        analysis = meal["extra"].get("analysis")
+        if not analysis or analysis.get("message", "") != user_text:
+            continue
+        # The embedding only shortlists; the pictures themselves must match
+        try:
+            with open(history_store.image_path(meal["image"]), "rb") as f:
+                if not same_picture(image_bytes, f.read(), NEAR_DUPLICATE_PIXEL_TOLERANCE):
+                    continue
+        except (OSError, ValueError):
+            continue
+        near_duplicate_hits.inc()
+        return {**analysis["result"], "near_duplicate_of": meal_id, "similarity": round(similarity, 4)}
+    return None
+
+def remember_analysis(image_bytes, user_text, result, embedding):
+    recent_analyses.put(recent_analyses.make_key("analysis", image_bytes),
+                        {"message": user_text, "result": result,
+                         "embedding": embedding.tolist() if embedding is not None else None})
+
+def remember_after_lookup(lookup, image_bytes, user_text, result):
+    """remember_analysis once the near-duplicate lookup has the embedding (now, if it already has)."""
+    lookup.add_done_callback(lambda f: remember_analysis(image_bytes, user_text, result, lookup_result(f)[0]))
+
+def index_meal(meal_id, image_bytes, embedding=None):
+    if embedding is None:
+        embedding = embed(image_bytes)
+    if embedding is not None:
+        meal_index.add([meal_id], [embedding])
+
+def local_predict(image_bytes, until):
+    """app2's /predict reply for an image if it arrives before `until`, else None (or if the local model is failing)."""
+    budget = remaining(until)
+    if budget <= 0:
+        return None
+    try:
+        r = http_session.post(LOCAL_MODEL_URL.rstrip("/") + "/predict", files={"file": ("image", image_bytes)},
+                              headers={"X-Request-Timeout-Ms": str(int(budget * 1000))}, timeout=budget)
+        r.raise_for_status()
+        return r.json()
+    except (requests.RequestException, ValueError) as e:
+        upstream_errors.inc(provider="local", kind="fatal")
+        print(f"Local model failed: {e}")
+        return None
+
+def hedging():
+    return HEDGE_BUDGET_S > 0 and bool(LOCAL_MODEL_URL)
+
+def hedge(clarifai_future, groq_future, local_future, hedge_at):
+    """The local prediction if Clarifai/Groq miss the hedge budget and the local model answered, else None.
+
+    Waits until `hedge_at` (request arrival + HEDGE_BUDGET_S) at most: a local
+    prediction that isn't ready by then is not waited for.
+    """
+    done, _ = wait([clarifai_future, groq_future], timeout=remaining(hedge_at))
+    if len(done) == 2:
+        return None
+    return local_ready(local_future)
+
+def local_ready(local_future):
+    """The local prediction if it has already arrived, else None (never blocks)."""
+    if not local_future.done():
+        return None
+    return local_future.result()   # local_predict returns None rather than raising
+
+def degraded_reply(local, follow_up=None):
+    food = local["food"].replace("_", " ")
+    return {
+        "detected_food": [local["food"]],
+        "chatbot_response": (f"Quick estimate while the full analysis is delayed: this looks like {food}, "
+                             f"about {local['calories']:.0f} kcal for {local['portion_used_g']:.0f} g "
+                             f"({local['protein_g']:g} g protein, {local['carbs_g']:g} g carbs, "
+                             f"{local['fat_g']:g} g fat)."),
+        "degraded": True,
+        "local_prediction": local,
+        **({"follow_up": follow_up} if follow_up is not None else {}),
+    }
+
+def finish_in_background(clarifai_future, groq_future, deadline, on_result):
+    """Token for /api/analyze/result; the upstream reply is collected there (and passed to on_result)."""
+    token = uuid.uuid4().hex
+    entry = {"expires_at": time.monotonic() + FOLLOW_UP_TTL_S, "result": None, "error": None}
+    with follow_ups_lock:
+        now = time.monotonic()
+        for expired in [t for t, e in follow_ups.items() if e["expires_at"] < now]:
+            del follow_ups[expired]
+        follow_ups[token] = entry
+
+    def finish():
+        try:
+            if not clarifai_future.result(timeout=remaining(deadline)):
+                raise UpstreamError("Clarifai prediction failed", retryable=False)
+            groq_response = groq_future.result(timeout=remaining(deadline))
+            result = {"detected_food": [], "chatbot_response": groq_response.choices[0].message.content}
+            on_result(result)
+            entry["result"] = result
+        except FutureTimeout:
+            entry["error"] = "Upstream deadline exceeded"
+        except Exception as e:
+            entry["error"] = str(e)
 
-        if "outputs" not in result or not result["outputs"]:
-            return jsonify({"error": "Clarifai prediction failed"}), 500
+    upstream_pool.submit(finish)
+    return token
 
-        # Extract food labels
-        food_labels = []
-        # for concept in result["outputs"][0]["data"]["concepts"]:
-        #     food_labels.append(f"{concept['name']} ({round(concept['value']*100,2)}%)")
+def pump_groq_stream(prompt, image, deadline, out, stop):
+    """Feed Groq's streamed tokens into `out` as ("token", text), then ("done", None) or ("error", exc)."""
+    try:
+        stream = groq_complete(prompt, image.b64, stream=True, deadline=deadline, mime=image.mime)
+        try:
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    out.put(("token", delta))
+        finally:
+            stream.close()
+        out.put(("done", None))
+    except Exception as e:
+        out.put(("error", e))
 
-        # -------- Groq Chatbot --------
-    
-        # -------- Groq Chatbot with Food Context + Image --------
-        
-        # The user uploaded a food image. Clarifai detected these items:
-        # {', '.join(food_labels)}.
-        prompt = f"""
+def build_prompt(user_text):
+    return f"""
         I am uploading an image of a meal or food item. Please act as a food calorie estimator and intelligent nutrition advisor. Your task is to analyze the image and identify all visible food components, including main ingredients, side items, sauces, garnishes, and beverages if present. Use visual cues such as portion size, cooking method (e.g., fried, grilled, baked, steamed), and ingredient composition to estimate the total calorie content of the meal. Provide a detailed breakdown of calories per item and include macronutrient estimates—carbohydrates, proteins, and fats—where possible.
         Once the calorie estimation is complete, tailor your dietary suggestions to one of the following goals: weight loss, muscle gain, or specific dietary restrictions. If the goal is not specified, ask for clarification. For dietary restrictions, consider common categories such as vegetarian, vegan, gluten-free, diabetic-friendly, low-sodium, or lactose-intolerant. Your suggestions should be practical, health-conscious, and specific to the food shown in the image.
         For weight loss, recommend lighter alternatives to calorie-dense items, portion control strategies, and foods that promote satiety without excess calories. Suggest nutrient-dense options that are low in added sugars and unhealthy fats. Include tips on hydration, meal timing, and how to balance energy intake with physical activity. If the uploaded meal is high in calories, provide actionable adjustments or substitutions to reduce the overall intake while preserving flavor and satisfaction.
@@ -101,23 +383,321 @@ def analyze_food():
         And the important it should be within 3 lines as the response and take this input also {user_text}
         
         """
-        # I detected: {', '.join(food_labels)}. Estimate calories.
-        groq_response = groq_client.chat.completions.create(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
+
+def groq_request(prompt, image_b64, stream=False, mime="image/jpeg"):
+    """Keyword arguments for groq_client.chat.completions.create."""
+    return dict(
+        model=GROQ_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful food nutrition assistant. Always respond in plain text without Markdown, lists, or asterisks."},
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}"}}
                 ]
             }
         ],
         temperature=0.6,
-        max_tokens=500
+        max_tokens=500,
+        stream=stream,
     )
 
+def send_immutable(path, etag):
+    """Serve a content-addressed file: strong ETag, Range/conditional requests, cached for a year.
+
+    The bytes behind a name never change, so long-lived caching is safe; the
+    name itself may stop resolving once the upload store evicts it (404).
+    """
+    # Store paths are relative to the working directory, not Flask's root_path
+    response = send_file(os.path.abspath(path), conditional=True, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+    response.headers["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return response
+
+def send_stored_image(digest, path, size=None):
+    """An original, or with `size` its thumb/display variant (generated now if it isn't ready yet)."""
+    try:
+        if size:
+            path = upload_store.variant(digest, size, source_path=path)
+        else:
+            upload_store.touch(path)
+        return send_immutable(path, etag=f"{digest}-{size}" if size else digest)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError:
+        return jsonify({"error": "Not found"}), 404
+
+@app.route("/upload", methods=["POST"])
+def upload_file():
+    file = request.files['file']
+    name = upload_store.put(file.read(), background=False)
+    base = request.host_url + "uploads/" + name
+    return {"url": base, "thumbnail_url": base + "?size=thumb", "display_url": base + "?size=display"}
+
+@app.route("/uploads/<filename>")
+def uploaded_file(filename):
+    if not upload_store.is_stored_name(filename):
+        # Files saved under client file names before uploads were content-addressed
+        return send_from_directory(UPLOAD_FOLDER, filename)
+    return send_stored_image(filename.split(".")[0], upload_store.path(filename), request.args.get("size"))
+
+@app.route("/api/save", methods=["POST"])
+def save_meal():
+    record = request.get_json(silent=True)
+    if not isinstance(record, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    record.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+    if not isinstance(record["timestamp"], str):
+        return jsonify({"error": "timestamp must be an ISO 8601 string"}), 400
+    if record.get("calories") is not None and not isinstance(record["calories"], (int, float)):
+        return jsonify({"error": "calories must be a number"}), 400
+    try:
+        decoded = decode_data_url(record.get("image")) if isinstance(record.get("image"), str) else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    recent = recent_analyses.get(recent_analyses.make_key("analysis", decoded[0])) if decoded else None
+    if recent is not None:
+        # Kept with the meal so a near-duplicate upload can be answered from history
+        record["analysis"] = {"message": recent["message"], "result": recent["result"]}
+    meal_id = history_store.save(record, user=request.args.get("user"))
+    if meal_id is not None and decoded is not None:
+        # History views load thumbnails; make them now rather than on first view
+        digest = hashlib.sha256(decoded[0]).hexdigest()
+        upload_store.prepare_variants(digest, history_store.image_path(digest + decoded[1]))
+    if meal_id is not None and decoded is not None and EMBEDDING_SERVICE_URL:
+        embedding = recent["embedding"] if recent is not None else None
+        upstream_pool.submit(index_meal, meal_id, decoded[0],
+                             np.asarray(embedding, dtype=np.float32) if embedding is not None else None)
+    return jsonify({"id": meal_id}), 201
+
+@app.route("/api/history")
+def get_history():
+    # ?fields=timestamp,calories keeps chart payloads small; images are
+    # referenced by image_url instead of inlined
+    fields = request.args.get("fields")
+    fields = tuple(f.strip() for f in fields.split(",")) if fields else HISTORY_FIELDS
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+    try:
+        limit = min(int(request.args.get("limit", 500)), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    try:
+        rows, next_cursor = history_store.history(
+            user=request.args.get("user"),
+            since=request.args.get("from"),
+            until=request.args.get("to"),
+            after=request.args.get("cursor"),
+            limit=limit,
+            fields=fields,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify(rows)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@app.route("/api/history/summary")
+def history_summary():
+    """Calories, meal count and macro totals per day/week from the incrementally kept rollups.
+
+    ?bucket=day|week&from=&to=&user=; the ETag changes only when a meal lands
+    in one of the returned buckets, so an unchanged dashboard gets a 304.
+    """
+    bucket = request.args.get("bucket", "day")
+    user, since, until = request.args.get("user"), request.args.get("from"), request.args.get("to")
+    try:
+        rows, version = history_store.summary(user=user, since=since, until=until, bucket=bucket)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    etag = hashlib.sha1(json.dumps([user, since, until, bucket, version, len(rows)]).encode("utf-8")).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(rows)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@app.route("/api/history/images/<name>")
+def history_image(name):
+    try:
+        path = history_store.image_path(name)
+    except ValueError:
+        return jsonify({"error": "Not found"}), 404
+    # Content-addressed, so the bytes behind a name never change; ?size=thumb|display for variants
+    return send_stored_image(name.split(".")[0], path, request.args.get("size"))
+
+@app.route("/api/history/similar", methods=["GET", "POST"])
+def similar_meals():
+    """Saved meals that look like an uploaded `image` (POST) or like saved meal ?meal=<id> (GET)."""
+    k = max(1, min(request.args.get("k", 5, type=int), 50))
+    user = request.args.get("user")
+    if request.method == "POST":
+        if "image" not in request.files:
+            return jsonify({"error": "Expected an image file"}), 400
+        embedding, exclude = embed(request.files["image"].read()), ()
+        if embedding is None:
+            return jsonify({"error": "Embedding service unavailable"}), 503
+    else:
+        meal = request.args.get("meal", type=int)
+        embedding, exclude = (meal_index.vector(meal) if meal is not None else None), {meal}
+        if embedding is None:
+            return jsonify({"error": "Meal not found in the embedding index"}), 404
+
+    # Over-fetch when filtering by user, since the index is shared by all users
+    hits = meal_index.search(embedding, k=k if user is None else k * 4, exclude=exclude)
+    meals = history_store.meals([meal_id for meal_id, _ in hits])
+    similar = []
+    for meal_id, score in hits:
+        meal = meals.get(meal_id)
+        if meal is None or (user is not None and meal["user"] != user):
+            continue
+        similar.append({**meal, "similarity": round(score, 4)})
+        if len(similar) == k:
+            break
+    return jsonify(similar)
+
+@app.before_request
+def start_timings():
+    g.timings = Timings(stage_seconds)
+    requests_in_flight.inc()
+
+@app.after_request
+def record_timings(response):
+    # For SSE responses this covers the time to the first byte, not the whole stream
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.timings.start, endpoint=endpoint, status=response.status_code)
+    response.headers["Server-Timing"] = g.timings.header()
+    if profiler is not None and not endpoint.startswith(("/debug", "/metrics")):
+        profiler.request_done()
+    return response
+
+@app.teardown_request
+def end_request(exc):
+    requests_in_flight.dec()
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route("/debug/profile", methods=["GET", "POST"])
+def debug_profile():
+    """POST ?requests=N samples hot-path stacks for the next N requests; GET reports them."""
+    if profiler is None:
+        return jsonify({"error": "Profiler disabled (set PROFILER_ENABLED=1)"}), 404
+    if request.method == "POST":
+        try:
+            profiler.arm(request.args.get("requests", 100, type=int))
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+    return jsonify(profiler.status())
+
+@app.route("/debug/profile/collapsed")
+def debug_profile_collapsed():
+    if profiler is None:
+        return jsonify({"error": "Profiler disabled (set PROFILER_ENABLED=1)"}), 404
+    return Response(profiler.collapsed(), content_type="text/plain")
+
+@app.route("/upstream/status")
+def upstream_status():
+    return jsonify({b.name: {"state": b.state, "rejected": b.rejected} for b in (clarifai_breaker, groq_breaker)})
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(analyze_cache.stats())
+
+@app.route("/api/analyze", methods=["POST"])
+def analyze_food():
+    try:
+        # Every wait below (upstream deadline, hedge budget) counts from arrival
+        arrival = time.monotonic()
+        deadline = arrival + UPSTREAM_DEADLINE_S
+        file = request.files["image"]
+        user_text = request.form.get("message", "")
+
+        timings = g.timings
+        with timings.stage("read"):
+            image_bytes = file.read()
+        with timings.stage("cache"):
+            cache_key = analyze_cache.make_key("analyze", image_bytes, message=user_text)
+            cached = analyze_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+
+        # Downscaled copy, base64-encoded once for both providers
+        with timings.stage("prepare"):
+            image = prepare_image(image_bytes, UPSTREAM_IMAGE_MAX_EDGE, UPSTREAM_JPEG_QUALITY, MAX_IMAGE_PIXELS)
+            image_b64 = image.b64
+
+        # Keep the original locally; the write happens off the request path
+        if PERSIST_UPLOADS:
+            upload_store.put(image_bytes)
+
+        # -------- Clarifai + Groq (+ local model), concurrently --------
+        # The Groq prompt doesn't use Clarifai's labels, so both calls start now
+        # and the request takes roughly max(Clarifai, Groq) rather than the sum
+        prompt = build_prompt(user_text)
+        clarifai_future = upstream_pool.submit(timings.timed, "clarifai", clarifai_detect, image_b64, deadline)
+        groq_future = upstream_pool.submit(timings.timed, "groq", groq_complete, prompt, image_b64, False, deadline,
+                                           image.mime)
+        hedge_at = arrival + HEDGE_BUDGET_S
+        local_future = upstream_pool.submit(timings.timed, "local", local_predict, image.data, hedge_at) \
+            if hedging() else None
+
+        # A near-identical photo of a saved meal gets that meal's analysis back
+        # if the lookup beats the upstreams (and the hedge budget)
+        lookup = upstream_pool.submit(timings.timed, "embed", near_duplicate_lookup, image_bytes, image.data,
+                                      user_text, request.args.get("user"))
+        duplicate = wait_for_duplicate(lookup, clarifai_future, groq_future, hedge_at if hedging() else deadline)
+        if duplicate is not None:
+            clarifai_future.cancel()
+            groq_future.cancel()
+            remember_analysis(image_bytes, user_text, duplicate, lookup_result(lookup)[0])
+            return jsonify(duplicate)
+
+        # -------- Local model hedge --------
+        if local_future is not None:
+            local = hedge(clarifai_future, groq_future, local_future, hedge_at)
+            if local is not None:
+                degraded_replies.inc()
+
+                def on_result(result):
+                    analyze_cache.put(cache_key, result)
+                    remember_after_lookup(lookup, image_bytes, user_text, result)
+
+                follow_up = finish_in_background(clarifai_future, groq_future, deadline, on_result)
+                return jsonify(degraded_reply(local, follow_up))
+
+        # -------- Clarifai REST API --------
+        try:
+            clarifai_result = clarifai_future.result(timeout=remaining(deadline))
+        except (UpstreamError, FutureTimeout) as e:
+            groq_future.cancel()
+            return upstream_error_response(e, "clarifai")
+        if not clarifai_result:
+            groq_future.cancel()
+            return jsonify({"error": "Clarifai prediction failed"}), 500
+
+        # Extract food labels
+        food_labels = []
+        # for concept in result["outputs"][0]["data"]["concepts"]:
+        #     food_labels.append(f"{concept['name']} ({round(concept['value']*100,2)}%)")
+
+        # -------- Groq Chatbot --------
+    
+        # -------- Groq Chatbot with Food Context + Image --------
+        
+        # The user uploaded a food image. Clarifai detected these items:
+        # {', '.join(food_labels)}.
+        try:
+            groq_response = groq_future.result(timeout=remaining(deadline))
+        except (UpstreamError, FutureTimeout) as e:
+            return upstream_error_response(e, "groq")
+
 
         try:
             chatbot_reply = groq_response.choices[0].message.content
@@ -128,11 +708,16 @@ def analyze_food():
 
 
         print(chatbot_reply)
-        return jsonify({
+        result = {
             "detected_food": food_labels,
             "chatbot_response": chatbot_reply
-        })
+        }
+        analyze_cache.put(cache_key, result)
+        remember_after_lookup(lookup, image_bytes, user_text, result)
+        return jsonify(result)
 
+    except ImageTooLarge as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         print("ERROR TRACEBACK:")
         traceback.print_exc()   # <-- prints full error details in terminal
@@ -163,5 +748,125 @@ def analyze_food():
     #     return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/analyze/result/<token>")
+def analyze_follow_up(token):
+    """Full reply behind a degraded /api/analyze answer: 202 while the upstreams are still working."""
+    with follow_ups_lock:
+        entry = follow_ups.get(token)
+    if entry is None:
+        return jsonify({"error": "Unknown or expired follow-up"}), 404
+    if entry["error"] is not None:
+        return jsonify({"error": entry["error"]}), 502
+    if entry["result"] is None:
+        return jsonify({"status": "pending"}), 202, {"Retry-After": "1"}
+    return jsonify(entry["result"])
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route("/api/analyze/stream", methods=["POST"])
+def analyze_food_stream():
+    """Streaming /api/analyze: Groq tokens are sent as server-sent events as they arrive.
+
+    Emits `token` events ({"text": ...}) while the reply is generated, then a
+    final `result` event with the same JSON /api/analyze returns (or an
+    `error` event).
+    """
+    arrival = time.monotonic()
+    deadline = arrival + UPSTREAM_DEADLINE_S
+    hedge_at = arrival + HEDGE_BUDGET_S
+    file = request.files["image"]
+    user_text = request.form.get("message", "")
+    user = request.args.get("user")
+
+    image_bytes = file.read()
+    cache_key = analyze_cache.make_key("analyze", image_bytes, message=user_text)
+    cached = analyze_cache.get(cache_key)
+    image = None
+    if cached is None:
+        # Checked before the stream starts so an oversized image still gets a 413
+        try:
+            image = prepare_image(image_bytes, UPSTREAM_IMAGE_MAX_EDGE, UPSTREAM_JPEG_QUALITY, MAX_IMAGE_PIXELS)
+        except ImageTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        if PERSIST_UPLOADS:
+            upload_store.put(image_bytes)
+
+    def generate():
+        if cached is not None:
+            yield sse_event("result", cached)
+            return
+        try:
+            # The prompt doesn't depend on Clarifai, so tokens are forwarded as
+            # soon as Groq sends them while Clarifai runs alongside. A Clarifai
+            # failure ends the stream with an `error` event instead of a result.
+            clarifai_future = upstream_pool.submit(clarifai_detect, image.b64, deadline)
+            tokens, stop = queue.Queue(), threading.Event()
+            upstream_pool.submit(pump_groq_stream, build_prompt(user_text), image, deadline, tokens, stop)
+            local_future = upstream_pool.submit(local_predict, image.data, hedge_at) if hedging() else None
+            # The near-duplicate lookup runs alongside; a hit that lands before
+            # the first token replaces the upstream reply
+            lookup = upstream_pool.submit(near_duplicate_lookup, image_bytes, image.data, user_text, user)
+            lookup.add_done_callback(lambda f: tokens.put(("duplicate", None)))
+            parts = []
+            try:
+                while not (clarifai_future.done() and not clarifai_future.result()):
+                    timeout = remaining(deadline)
+                    if local_future is not None:
+                        timeout = min(timeout, remaining(hedge_at))
+                    try:
+                        kind, value = tokens.get(timeout=timeout)
+                    except queue.Empty:
+                        if local_future is None:
+                            raise FutureTimeout()
+                        # No token within the hedge budget: send the local estimate now
+                        local, local_future = local_ready(local_future), None
+                        if local is not None:
+                            degraded_replies.inc()
+                            yield sse_event("degraded", degraded_reply(local))
+                        continue
+                    if kind == "duplicate":
+                        duplicate = lookup_result(lookup)[1]
+                        if duplicate is not None and not parts:
+                            clarifai_future.cancel()
+                            remember_analysis(image_bytes, user_text, duplicate, lookup_result(lookup)[0])
+                            yield sse_event("result", duplicate)
+                            return
+                        continue
+                    if kind == "error":
+                        raise value
+                    if kind == "done":
+                        break
+                    local_future = None
+                    parts.append(value)
+                    yield sse_event("token", {"text": value})
+            finally:
+                stop.set()
+            if not clarifai_future.result(timeout=remaining(deadline)):
+                yield sse_event("error", {"error": "Clarifai prediction failed"})
+                return
+            food_labels = []
+
+            result = {
+                "detected_food": food_labels,
+                "chatbot_response": "".join(parts)
+            }
+            analyze_cache.put(cache_key, result)
+            remember_after_lookup(lookup, image_bytes, user_text, result)
+            yield sse_event("result", result)
+        except (UpstreamError, FutureTimeout) as e:
+            if isinstance(e, FutureTimeout):
+                upstream_errors.inc(provider="clarifai", kind="deadline")
+            yield sse_event("error", {"error": str(e) or "Upstream deadline exceeded"})
+        except Exception as e:
+            print("ERROR TRACEBACK:")
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -1,42 +1,96 @@
 # final app.py
 import os
+import io
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import zipfile
+from contextlib import ExitStack, asynccontextmanager
+import numpy as np
 import torch
 import torch.nn as nn
 from torchvision import transforms
 from torchvision.models import resnet18
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import BackgroundTasks, FastAPI, File, UploadFile, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from collections.abc import Iterable
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from PIL import Image
-import ngrok
-import uvicorn
-
-import nest_asyncio
-import uvicorn
-
-nest_asyncio.apply() 
+from PIL import Image, UnidentifiedImageError
+from batching import MicroBatcher
+from executor import InferenceExecutor, QueueFull, DeadlineExceeded
+from calorie_table import CalorieTable
+from preprocess import Preprocessor, ImageTooLarge, MEAN, STD
+from prediction_cache import PredictionCache
+from nutrition import NutritionTable
+from multi_item import MultiCropper, merge_detections
+import cascade
+from metrics import Registry, Timings, CONTENT_TYPE as METRICS_CONTENT_TYPE, cache_lookup_counts
+from profiler import SamplingProfiler
+import backends
 
 # ------------------------------
 # Config (can be overridden with env vars)
 # ------------------------------
 CLASSIFIER_STATE = os.getenv("CLASSIFIER_STATE", "./classifier.pth")
 CALORIE_STATE = os.getenv("CALORIE_STATE", "./calorie_model.pth")
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "eager")   # see backends.BACKENDS
+BACKEND_GATE_DIR = os.getenv("BACKEND_GATE_DIR") or None   # sample images for calibration + agreement gate
+BACKEND_MIN_AGREEMENT = float(os.getenv("BACKEND_MIN_AGREEMENT", "0.98"))
 CLASS_NAMES_PATH = os.getenv("CLASS_NAMES_PATH", "./classes.txt")
 NUM_CLASSES = int(os.getenv("NUM_CLASSES", "101"))
-
-# ------------------------------
-# FastAPI + CORS
-# ------------------------------
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],   # replace with your frontend origin(s) for production
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-ngrok.set_auth_token("2a1iGE4Q5SDAF4mhdAVXeNptwJd_2GBcW2ACMaj2JoAJy8Gtt")
-listener = ngrok.forward("127.0.0.1:8000", authtoken_from_env=True, domain="apparent-wolf-obviously.ngrok-free.app")
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+RETRY_AFTER_S = int(os.getenv("RETRY_AFTER_S", "1"))
+CALORIE_BACKEND = os.getenv("CALORIE_BACKEND", "table")   # "table" or "torch"
+CALORIE_TABLE_VERIFY = os.getenv("CALORIE_TABLE_VERIFY", "0") == "1"
+FAST_PREPROCESS = os.getenv("FAST_PREPROCESS", "1") == "1"
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+OVERSIZE_POLICY = os.getenv("OVERSIZE_POLICY", "downscale")   # "downscale" (JPEGs only) or "reject"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "3600"))
+CACHE_DIR = os.getenv("CACHE_DIR") or None   # enables the disk-backed tier
+CACHE_DISK_MAX_ENTRIES = int(os.getenv("CACHE_DISK_MAX_ENTRIES", "100000"))
+CACHE_DISK_MAX_MB = float(os.getenv("CACHE_DISK_MAX_MB", "512"))
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "./model_cache")   # pre-normalized state dicts
+LAZY_LOAD = os.getenv("LAZY_LOAD", "0") == "1"   # load models on first request instead of at startup
+WARMUP = os.getenv("WARMUP", "1") == "1"
+NGROK_ENABLED = os.getenv("NGROK_ENABLED", "1") == "1"
+NGROK_AUTHTOKEN = os.getenv("NGROK_AUTHTOKEN", "2a1iGE4Q5SDAF4mhdAVXeNptwJd_2GBcW2ACMaj2JoAJy8Gtt")
+NGROK_ADDR = os.getenv("NGROK_ADDR", "127.0.0.1:8000")
+NGROK_DOMAIN = os.getenv("NGROK_DOMAIN", "apparent-wolf-obviously.ngrok-free.app")
+PORT = int(os.getenv("PORT", "7000"))
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"   # exposes /debug/profile
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+NUTRITION_STRICT = os.getenv("NUTRITION_STRICT", "0") == "1"   # refuse to start on nutrition table problems
+NUTRITION_MODE = os.getenv("NUTRITION_MODE", "top1")   # "top1" or "expected" (probability-weighted)
+# /predict/items: crop scales (fractions of the image side), tile overlap and merge settings
+MULTI_SCALES = tuple(float(s) for s in os.getenv("MULTI_SCALES", "1.0,0.6").split(","))
+MULTI_OVERLAP = float(os.getenv("MULTI_OVERLAP", "0.25"))
+MULTI_MIN_CONFIDENCE = float(os.getenv("MULTI_MIN_CONFIDENCE", "0.3"))
+MULTI_MAX_ITEMS = int(os.getenv("MULTI_MAX_ITEMS", "5"))
+MULTI_CROP_SIZE = int(os.getenv("MULTI_CROP_SIZE", "224"))   # smaller crops cut forward cost ~quadratically
+# Cascade (see cascade.py): a low-res pass first, the full pass only for images it is unsure about.
+# Thresholds come from calibrate_cascade.py; CASCADE_TTA adds views to the full pass, e.g. "flip,zoom"
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_SIZE = int(os.getenv("CASCADE_SIZE", "128"))
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.9"))
+CASCADE_MIN_MARGIN = float(os.getenv("CASCADE_MIN_MARGIN", "0.5"))
+CASCADE_TTA = cascade.check_views([v.strip() for v in os.getenv("CASCADE_TTA", "").split(",") if v.strip()])
+# /predict/batch: images per request, images per forward pass, size limit per image.
+# Repeated `files` parts are capped separately (BATCH_MAX_FILES): the multipart
+# parser keeps up to 1 MB of every part in memory before spilling it to disk,
+# so larger batches should come as one zip archive.
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "5000"))
+BATCH_MAX_FILES = min(int(os.getenv("BATCH_MAX_FILES", "100")), BATCH_MAX_IMAGES)
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "32"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
 
 # ------------------------------
 # Device
@@ -60,285 +114,916 @@ if len(class_names) != NUM_CLASSES:
 class FoodClassifier(nn.Module):
     def __init__(self, num_classes):
         super(FoodClassifier, self).__init__()
-        self.model = resnet18(pretrained=False)
+        self.model = resnet18(weights=None)
         self.model.fc = nn.Linear(self.model.fc.in_features, num_classes)
     def forward(self, x):
         return self.model(x)
+    def embed(self, x):
+        # Penultimate-layer (pooled, pre-fc) features, used for similarity search
+        m = self.model
+        x = m.maxpool(m.relu(m.bn1(m.conv1(x))))
+        x = m.layer4(m.layer3(m.layer2(m.layer1(x))))
+        return torch.flatten(m.avgpool(x), 1)
 
-classifier = FoodClassifier(NUM_CLASSES).to(device)
-if not os.path.exists(CLASSIFIER_STATE):
-    raise FileNotFoundError(f"Classifier state file not found: {CLASSIFIER_STATE}")
+# Populated by load_models() at startup (or on first request with LAZY_LOAD=1).
+# `classifier` is always the eager fp32 module; `classifier_runner` is the
+# selected inference backend and is what serves requests.
+classifier = None
+classifier_runner = None
+calorie_model = None
+calorie_table = None
+nutrition = None
 
-state_dict_cls = torch.load(CLASSIFIER_STATE, map_location="cpu")
+def load_state_dict_mmap(path):
+    # Memory-map the checkpoint so tensors are paged in on demand rather than
+    # read and copied up front; legacy (non-zip) checkpoints can't be mapped
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, TypeError, ValueError):
+        return torch.load(path, map_location="cpu")
+
+def normalized_cache_path(path, tag, ext=".pt"):
+    st = os.stat(path)
+    stamp = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{NUM_CLASSES}"
+    digest = hashlib.sha1(stamp.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(MODEL_CACHE_DIR, f"{tag}-{digest}{ext}")
+
+def normalize_classifier_state(state_dict_cls):
+    # Prefix normalization: if keys don't start with 'model.' add it (wrapper uses self.model)
+    first_key = list(state_dict_cls.keys())[0]
+    if not first_key.startswith("model."):
+        state_dict_cls = {"model." + k: v for k, v in state_dict_cls.items()}
 
-# Prefix normalization: if keys don't start with 'model.' add it (wrapper uses self.model)
-first_key = list(state_dict_cls.keys())[0]
-if not first_key.startswith("model."):
-    state_dict_cls = {"model." + k: v for k, v in state_dict_cls.items()}
+    # If final fc has different out_features, skip loading it (we'll keep randomly-initialized final layer)
+    ck_fc_w = state_dict_cls.get("model.fc.weight")
+    if ck_fc_w is not None and ck_fc_w.shape[0] != NUM_CLASSES:
+        print(f"Classifier checkpoint fc out_features {ck_fc_w.shape[0]} != target {NUM_CLASSES}. Skipping fc params.")
+        state_dict_cls.pop("model.fc.weight", None)
+        state_dict_cls.pop("model.fc.bias", None)
+    return state_dict_cls
 
-# If final fc has different out_features, skip loading it (we'll keep randomly-initialized final layer)
-ck_fc_w = state_dict_cls.get("model.fc.weight")
-if ck_fc_w is not None and ck_fc_w.shape[0] != classifier.model.fc.weight.shape[0]:
-    print(f"Classifier checkpoint fc out_features {ck_fc_w.shape[0]} != target {classifier.model.fc.weight.shape[0]}. Skipping fc params.")
-    state_dict_cls.pop("model.fc.weight", None)
-    state_dict_cls.pop("model.fc.bias", None)
+def load_classifier():
+    if not os.path.exists(CLASSIFIER_STATE):
+        raise FileNotFoundError(f"Classifier state file not found: {CLASSIFIER_STATE}")
 
-state_dict_cls = {k: v.to(device) for k, v in state_dict_cls.items()}
-classifier.load_state_dict(state_dict_cls, strict=False)
-classifier.eval()
-print("Classifier loaded.")
+    # Later starts load the already-normalized state dict straight from the cache
+    cache_path = normalized_cache_path(CLASSIFIER_STATE, "classifier") if MODEL_CACHE_DIR else None
+    if cache_path and os.path.exists(cache_path):
+        state_dict_cls = load_state_dict_mmap(cache_path)
+    else:
+        state_dict_cls = normalize_classifier_state(dict(load_state_dict_mmap(CLASSIFIER_STATE)))
+        if cache_path:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            torch.save(state_dict_cls, cache_path)
+
+    # When the checkpoint covers every parameter, build the network on the meta
+    # device (no random init) and adopt the mapped tensors without copying
+    with torch.device("meta"):
+        model = FoodClassifier(NUM_CLASSES)
+    if set(model.state_dict().keys()) <= set(state_dict_cls.keys()):
+        model.load_state_dict(state_dict_cls, strict=False, assign=True)
+    else:
+        model = FoodClassifier(NUM_CLASSES)
+        model.load_state_dict(state_dict_cls, strict=False)
+    if device.type != "cpu":
+        model = model.to(device)
+    model.eval()
+    print("Classifier loaded.")
+    return model
 
 # ------------------------------
 # Calorie model auto-loader (handles Sequential-style checkpoints)
 # ------------------------------
-if not os.path.exists(CALORIE_STATE):
-    raise FileNotFoundError(f"Calorie state file not found: {CALORIE_STATE}")
-
-state_dict_cal_raw = torch.load(CALORIE_STATE, map_location="cpu")
-
-# normalize prefix
-if list(state_dict_cal_raw.keys())[0].startswith("model."):
-    normalized = {k.replace("model.", ""): v for k, v in state_dict_cal_raw.items()}
-else:
-    normalized = dict(state_dict_cal_raw)
-
-# If looks like Sequential with keys '0','2','4' build matching Sequential
-if all(k in normalized for k in ("0.weight", "2.weight", "4.weight")):
-    w0_shape = normalized["0.weight"].shape   # (out0, in0)
-    w2_shape = normalized["2.weight"].shape
-    w4_shape = normalized["4.weight"].shape
-
-    input_dim_ck = w0_shape[1]
-    calorie_model = nn.Sequential(
-        nn.Linear(input_dim_ck, w0_shape[0]),
-        nn.ReLU(),
-        nn.Linear(w2_shape[1], w2_shape[0]),
-        nn.ReLU(),
-        nn.Linear(w4_shape[1], w4_shape[0])
-    ).to(device)
-
-    state_dict_for_load = {k: v.to(device) for k, v in normalized.items() if k in calorie_model.state_dict()}
-    calorie_model.load_state_dict(state_dict_for_load, strict=False)
-    calorie_model.eval()
-    print("Calorie Sequential model built and loaded.")
-else:
+def load_calorie_model():
+    if not os.path.exists(CALORIE_STATE):
+        raise FileNotFoundError(f"Calorie state file not found: {CALORIE_STATE}")
+
+    state_dict_cal_raw = load_state_dict_mmap(CALORIE_STATE)
+
+    # normalize prefix
+    if list(state_dict_cal_raw.keys())[0].startswith("model."):
+        normalized = {k.replace("model.", ""): v for k, v in state_dict_cal_raw.items()}
+    else:
+        normalized = dict(state_dict_cal_raw)
+
+    # If looks like Sequential with keys '0','2','4' build matching Sequential
+    if all(k in normalized for k in ("0.weight", "2.weight", "4.weight")):
+        w0_shape = normalized["0.weight"].shape   # (out0, in0)
+        w2_shape = normalized["2.weight"].shape
+        w4_shape = normalized["4.weight"].shape
+
+        input_dim_ck = w0_shape[1]
+        model = nn.Sequential(
+            nn.Linear(input_dim_ck, w0_shape[0]),
+            nn.ReLU(),
+            nn.Linear(w2_shape[1], w2_shape[0]),
+            nn.ReLU(),
+            nn.Linear(w4_shape[1], w4_shape[0])
+        ).to(device)
+
+        state_dict_for_load = {k: v.to(device) for k, v in normalized.items() if k in model.state_dict()}
+        model.load_state_dict(state_dict_for_load, strict=False)
+        model.eval()
+        print("Calorie Sequential model built and loaded.")
+        return model
+
     # fallback: try loading the full model object (if saved with torch.save(model))
     try:
-        calorie_model = torch.load(CALORIE_STATE, map_location=device)
-        calorie_model.to(device)
-        calorie_model.eval()
+        model = torch.load(CALORIE_STATE, map_location=device, weights_only=False)
+        model.to(device)
+        model.eval()
         print("Calorie full model loaded.")
+        return model
     except Exception as e:
         print("Calorie checkpoint format not recognized. Available keys (sample):", list(normalized.keys())[:20])
         raise RuntimeError("Could not load calorie_model checkpoint automatically. Inspect keys above.") from e
 
+# ------------------------------
+# Compile the calorie MLP into an exact per-class piecewise-linear table
+# ------------------------------
+def compile_calorie_table(model):
+    if CALORIE_BACKEND != "table":
+        return None
+    cache_path = normalized_cache_path(CALORIE_STATE, "calorie-table", ".npz") if MODEL_CACHE_DIR else None
+    try:
+        if cache_path and os.path.exists(cache_path):
+            table = CalorieTable.load(cache_path)
+            print("Calorie table loaded from cache.")
+        else:
+            table = CalorieTable.compile(model, NUM_CLASSES)
+            print(f"Calorie table compiled ({table.max_breakpoints} max breakpoints per class).")
+            if cache_path:
+                os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+                table.save(cache_path)
+        if CALORIE_TABLE_VERIFY:
+            max_err = table.verify(model)
+            print(f"Calorie table verified against model (max abs error {max_err:.2e}).")
+        return table
+    except ValueError as e:
+        print(f"Calorie table unavailable, falling back to torch: {e}")
+        return None
+
+# ------------------------------
+# Nutrition table (per-class macros, indexed like the classifier output)
+# ------------------------------
+def load_nutrition():
+    table = NutritionTable(class_names, strict=NUTRITION_STRICT)
+    for problem in table.problems:
+        print(f"Nutrition table: {problem}")
+    if table.unused:
+        print(f"Nutrition table: entries without a class: {', '.join(table.unused)}")
+    return table
+
 # ------------------------------
 # Transforms + helpers
 # ------------------------------
 transform = transforms.Compose([
     transforms.Resize((224, 224)),
     transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406],
-                         [0.229, 0.224, 0.225])
+    transforms.Normalize(list(MEAN), list(STD))
 ])
 
+# Fast path: reduced-scale JPEG decode + fused resize + normalization into a
+# reusable batch buffer (see preprocess.py). `transform` stays as the reference.
+preprocessor = Preprocessor(max_pixels=MAX_IMAGE_PIXELS, oversize=OVERSIZE_POLICY, max_batch=BATCH_MAX_SIZE)
+# Multi-item mode: crops at MULTI_SCALES, all classified in one forward pass
+cropper = MultiCropper(size=MULTI_CROP_SIZE, scales=MULTI_SCALES, overlap=MULTI_OVERLAP,
+                       max_pixels=MAX_IMAGE_PIXELS, oversize=OVERSIZE_POLICY)
+crop_preprocessor = preprocessor if MULTI_CROP_SIZE == preprocessor.size else \
+    Preprocessor(size=MULTI_CROP_SIZE, max_pixels=MAX_IMAGE_PIXELS, oversize=OVERSIZE_POLICY)
+
+def decode_image(data):
+    if FAST_PREPROCESS:
+        return preprocessor.decode(data)
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    return transform(image)
+
+def collate_images(images):
+    if FAST_PREPROCESS:
+        return preprocessor.to_batch(images)
+    return torch.stack(images)
+
 def get_dummy_portion_value():
     return 100.0
 
 def portion_tensor_from_value(value_grams):
     return torch.tensor([[float(value_grams)]]).to(device)
 
+# ------------------------------
+# Metrics (exposed on /metrics, per-request stages in Server-Timing)
+# ------------------------------
+metrics = Registry()
+request_seconds = metrics.histogram("food_request_seconds", "HTTP request latency", ("path", "status"))
+requests_in_flight = metrics.gauge("food_requests_in_flight", "HTTP requests being handled")
+stage_seconds = metrics.histogram("food_stage_seconds", "Time spent per /predict stage (batched stages once per batch)", ("stage",))
+batch_size_hist = metrics.histogram("food_batch_size", "Images per classifier forward pass",
+                                    buckets=(1, 2, 4, 8, 16, 32, 64))
+rejected_total = metrics.counter("food_rejected_total", "Requests refused before inference", ("reason",))
+cascade_total = metrics.counter("food_cascade_total", "Images answered per cascade stage", ("stage",))
+
 # ------------------------------
 # Predict endpoint (accepts optional 'portion' form field)
 # ------------------------------
-# Example food_nutrition dictionary
-# Each tuple: (protein_g per 100g, carbs_g per 100g, fat_g per 100g, glycemic_index)
-food_nutrition = {
-    "grilled_cheese_sandwich": (12.0, 26.0, 11.0, 45 , 0),
-    "apple_pie": (237, 2.1, 35.0, 12.0, 65),
-    "baby_back_ribs": (302, 28.0, 0.0, 20.0, 0),
-    "baklava": (420, 4.0, 45.0, 18.0, 75),
-    "beef_carpaccio": (175, 30.0, 0.0, 5.0, 0),
-    "beef_tartare": (189, 27.0, 0.0, 10.0, 0),
-    "beet_salad": (107, 3.5, 15.0, 5.0, 42),
-    "beignets": (300, 3.0, 35.0, 16.0, 70),
-    "bibimbap": (294, 15.0, 42.0, 8.0, 60),
-    "bread_pudding": (307, 10.0, 45.0, 10.0, 64),
-    "breakfast_burrito": (400, 20.0, 35.0, 20.0, 55),
-    "bruschetta": (220, 5.0, 25.0, 12.0, 60),
-    "caesar_salad": (400, 10.0, 5.0, 35.0, 15),
-    "cannoli": (450, 7.0, 40.0, 28.0, 70),
-    "caprese_salad": (200, 10.0, 5.0, 15.0, 15),
-    "carrot_cake": (350, 4.0, 45.0, 18.0, 65),
-    "ceviche": (120, 20.0, 5.0, 2.0, 20),
-    "cheese_plate": (500, 25.0, 10.0, 40.0, 20),
-    "cheesecake": (320, 8.0, 30.0, 18.0, 55),
-    "chicken_curry": (250, 25.0, 15.0, 10.0, 50),
-    "chicken_wings": (200, 20.0, 5.0, 12.0, 0),
-    "chocolate_cake": (380, 5.0, 50.0, 20.0, 68),
-    "chocolate_mousse": (250, 5.0, 25.0, 15.0, 50),
-    "churros": (300, 4.0, 40.0, 15.0, 80),
-    "clam_chowder": (280, 15.0, 25.0, 12.0, 60),
-    "club_sandwich": (500, 30.0, 40.0, 25.0, 60),
-    "crab_cakes": (250, 15.0, 20.0, 12.0, 55),
-    "creme_brulee": (350, 5.0, 30.0, 25.0, 60),
-    "croque_madame": (450, 25.0, 35.0, 25.0, 65),
-    "cup_cakes": (250, 3.0, 35.0, 12.0, 70),
-    "deviled_eggs": (150, 10.0, 1.0, 12.0, 0),
-    "donuts": (250, 3.0, 30.0, 15.0, 75),
-    "dumplings": (200, 8.0, 25.0, 8.0, 55),
-    "edamame": (120, 11.0, 9.0, 5.0, 15),
-    "eggs_benedict": (350, 15.0, 25.0, 20.0, 60),
-    "escargots": (100, 15.0, 1.0, 5.0, 0),
-    "falafel": (333, 13.0, 32.0, 18.0, 60),
-    "filet_mignon": (200, 28.0, 0.0, 10.0, 0),
-    "fish_and_chips": (500, 25.0, 50.0, 25.0, 70),
-    "foie_gras": (462, 5.0, 2.0, 50.0, 0),
-    "french_fries": (312, 3.0, 41.0, 15.0, 75),
-    "french_onion_soup": (200, 10.0, 15.0, 10.0, 30),
-    "french_toast": (250, 8.0, 35.0, 10.0, 70),
-    "fried_calamari": (300, 15.0, 20.0, 15.0, 55),
-    "fried_rice": (250, 10.0, 40.0, 5.0, 60),
-    "frozen_yogurt": (150, 5.0, 25.0, 3.0, 45),
-    "garlic_bread": (350, 8.0, 40.0, 18.0, 68),
-    "gnocchi": (250, 5.0, 45.0, 5.0, 65),
-    "greek_salad": (150, 5.0, 10.0, 10.0, 15),
-    "grilled_cheese_sandwich": (400, 20.0, 30.0, 25.0, 60),
-    "grilled_salmon": (200, 25.0, 0.0, 12.0, 0),
-    "guacamole": (150, 2.0, 8.0, 12.0, 15),
-    "gyoza": (200, 8.0, 25.0, 8.0, 55),
-    "hamburger": (500, 25.0, 35.0, 30.0, 65),
-    "hot_dog": (300, 10.0, 25.0, 20.0, 70),
-    "hot_and_sour_soup": (100, 5.0, 15.0, 2.0, 35),
-    "huevos_rancheros": (300, 15.0, 25.0, 15.0, 55),
-    "hummus": (166, 8.0, 15.0, 10.0, 25),
-    "ice_cream": (250, 4.0, 30.0, 15.0, 60),
-    "lasagna": (350, 20.0, 30.0, 18.0, 55),
-    "lobster_bisque": (200, 10.0, 15.0, 10.0, 30),
-    "lobster_roll_sandwich": (450, 20.0, 30.0, 25.0, 60),
-    "macaroni_and_cheese": (350, 15.0, 35.0, 15.0, 65),
-    "miso_soup": (50, 3.0, 5.0, 2.0, 20),
-    "mussels": (100, 15.0, 5.0, 2.0, 25),
-    "nachos": (450, 15.0, 40.0, 25.0, 65),
-    "oysters": (50, 5.0, 5.0, 1.0, 15),
-    "pad_thai": (400, 15.0, 50.0, 15.0, 65),
-    "paella": (350, 20.0, 40.0, 10.0, 60),
-    "pancakes": (200, 5.0, 30.0, 8.0, 60),
-    "panna_cotta": (300, 5.0, 20.0, 20.0, 55),
-    "peking_duck": (400, 30.0, 10.0, 25.0, 20),
-    "pho": (250, 20.0, 30.0, 5.0, 50),
-    "pizza": (250, 10.0, 30.0, 10.0, 60),
-    "pork_chop": (250, 25.0, 0.0, 15.0, 0),
-    "poutine": (450, 10.0, 45.0, 25.0, 70),
-    "prime_rib": (350, 25.0, 0.0, 25.0, 0),
-    "pulled_pork_sandwich": (400, 25.0, 35.0, 20.0, 60),
-    "ramen": (400, 15.0, 50.0, 15.0, 65),
-    "ravioli": (250, 10.0, 30.0, 10.0, 55),
-    "red_velvet_cake": (400, 4.0, 50.0, 20.0, 68),
-    "risotto": (300, 10.0, 40.0, 12.0, 65),
-    "samosa": (250, 5.0, 30.0, 12.0, 60),
-    "sashimi": (150, 20.0, 1.0, 5.0, 0),
-    "scallops": (100, 15.0, 5.0, 2.0, 25),
-    "shrimp_and_grits": (350, 20.0, 30.0, 15.0, 60),
-    "spaghetti_bolognese": (300, 20.0, 35.0, 10.0, 55),
-    "spaghetti_carbonara": (450, 25.0, 40.0, 20.0, 60),
-    "spring_rolls": (250, 5.0, 30.0, 12.0, 60),
-    "steak": (300, 30.0, 0.0, 20.0, 0),
-    "strawberry_shortcake": (300, 5.0, 40.0, 15.0, 65),
-    "sushi": (200, 10.0, 30.0, 5.0, 50),
-    "tacos": (250, 15.0, 20.0, 12.0, 55),
-    "takoyaki": (180, 8.0, 25.0, 5.0, 60),
-    "tiramisu": (300, 5.0, 25.0, 20.0, 60),
-    "tuna_tartare": (150, 20.0, 1.0, 8.0, 0),
-    "waffles": (250, 5.0, 35.0, 10.0, 75),
-    "wonton_soup": (150, 10.0, 20.0, 5.0, 40)
-}
+def build_response(pred_idx, cal_pred, portion_val, macros, topk_indices, topk_probs):
+    """/predict JSON for one item; `macros` holds this item's values from the nutrition table."""
+    pred_name = class_names[pred_idx] if 0 <= pred_idx < len(class_names) else str(pred_idx)
+    gly_index = float(macros["glycemic_index"])
+
+    topk_list = [
+        {"class": class_names[i] if 0 <= i < len(class_names) else str(i), "prob": round(float(p), 4)}
+        for i, p in zip(topk_indices, topk_probs)
+    ]
+
+    return {
+        "food": pred_name,
+        "calories": round(cal_pred, 2),
+        "portion_used_g": round(float(portion_val), 2),
+        "protein_g": float(macros["protein_g"]),
+        "carbs_g": float(macros["carbs_g"]),
+        "fat_g": float(macros["fat_g"]),
+        "glycemic_index": int(gly_index) if gly_index.is_integer() else gly_index,
+        "approx_sugar_rise": float(macros["approx_sugar_rise"]),
+        "top_predictions": topk_list
+    }
+
+def classify_batch(images, timings=None, collate=None):
+    """Classifier forward pass for a batch of decoded images -> (n, C) softmax probs on CPU."""
+    timings = timings or Timings()
+    with timings.stage("preprocess"):
+        img_batch = (collate or collate_images)(images).to(device)
+    with timings.stage("forward"), torch.no_grad():
+        logits = classifier_runner(img_batch)
+        return torch.softmax(logits, dim=1).cpu()
+
+def full_probs(batch, views=CASCADE_TTA):
+    """Softmax of the full-size pass over a collated batch, averaged over TTA views."""
+    with torch.no_grad():
+        probs = torch.softmax(classifier_runner(cascade.tta_views(batch, views)), dim=1)
+    return cascade.average_views(probs, batch.shape[0]).cpu()
+
+def cheap_probs(batch, size=CASCADE_SIZE):
+    """Softmax of the cascade's first stage (the classifier on a downscaled batch)."""
+    with torch.no_grad():
+        return torch.softmax(classifier_runner(cascade.downscale(batch, size)), dim=1).cpu()
+
+def classify_cascade(images, timings=None, collate=None):
+    """classify_batch through the cascade: the full pass only runs for images the cheap pass is unsure of."""
+    timings = timings or Timings()
+    with timings.stage("preprocess"):
+        batch = (collate or collate_images)(images).to(device)
+    with timings.stage("cheap"):
+        probs = cheap_probs(batch)
+    uncertain = (~cascade.confident(probs, CASCADE_MIN_CONFIDENCE, CASCADE_MIN_MARGIN)).nonzero().flatten()
+    if len(uncertain):
+        with timings.stage("forward"):
+            probs[uncertain] = full_probs(batch[uncertain])
+    if timings.histogram is not None:   # unrecorded runs (warmup, offline tools) stay out of the metrics
+        cascade_total.inc(len(images) - len(uncertain), stage="cheap")
+        cascade_total.inc(len(uncertain), stage="full")
+    return probs
+
+def classify(images, timings=None, collate=None):
+    return (classify_cascade if CASCADE_ENABLED else classify_batch)(images, timings, collate)
+
+def responses_from_probs(probs, portions, timings=None, nutrition_mode=None):
+    """Calorie, macro and top-3 step for a batch of classifier outputs.
+
+    `probs` may be a tensor or the nested lists kept in the prediction cache.
+    nutrition_mode "top1" scales the predicted class's macros; "expected"
+    weights every class's macros by its probability.
+    """
+    timings = timings or Timings()
+    probs = torch.as_tensor(probs, dtype=torch.float32)
+    portions = [float(p) for p in portions]
+    n = probs.shape[0]
+    pred_idxs = torch.argmax(probs, dim=1)
+
+    with timings.stage("calories"), torch.no_grad():
+        # ------------------------------
+        # Calories prediction (one-hot + portion)
+        # ------------------------------
+        if calorie_table is not None:
+            cal_preds = calorie_table.evaluate(pred_idxs.numpy(), portions).tolist()
+        else:
+            one_hot = torch.zeros(n, NUM_CLASSES, device=device)
+            one_hot[torch.arange(n, device=device), pred_idxs.to(device)] = 1.0
+            portion_t = torch.tensor(portions, device=device).unsqueeze(1)
+            x_cal = torch.cat([one_hot, portion_t], dim=1)
+            cal_preds = calorie_model(x_cal).reshape(n, -1)[:, 0].cpu().tolist()
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...), portion: float = Form(None)):
     # ------------------------------
-    # Image preprocessing
+    # Macronutrients + glycemic index for the whole batch
     # ------------------------------
-    image = Image.open(file.file).convert("RGB")
-    img_tensor = transform(image).unsqueeze(0).to(device)
+    with timings.stage("macros"):
+        if (nutrition_mode or NUTRITION_MODE) == "expected":
+            macros = nutrition.expected_macros(probs.numpy(), portions)
+        else:
+            macros = nutrition.macros(pred_idxs.numpy(), portions)
 
     # ------------------------------
-    # Classifier prediction
+    # Top-3 predictions
     # ------------------------------
+    with timings.stage("topk"):
+        topk = torch.topk(probs, k=min(3, probs.shape[1]), dim=1)
+        topk_indices = topk.indices.tolist()
+        topk_probs = topk.values.tolist()
+
+        pred_idxs = pred_idxs.tolist()
+        return [
+            build_response(pred_idxs[i], cal_preds[i], portions[i], {k: v[i] for k, v in macros.items()},
+                           topk_indices[i], topk_probs[i])
+            for i in range(n)
+        ]
+
+def predict_batch(items, record=True):
+    """Run a batch of (decoded image, portion_g) pairs through both models.
+
+    One stacked forward pass for the classifier and one for the calorie step;
+    returns a (probs, /predict response dict, batch stage timings) triple per item.
+    With record=False (warmup) nothing is observed into the metrics.
+    """
+    timings = Timings(stage_seconds if record else None)
+    if record:
+        batch_size_hist.observe(len(items))
+    probs = classify([img for img, _ in items], timings)
+    responses = responses_from_probs(probs, [p for _, p in items], timings)
+    stages = timings.as_dict()
+    return [(p, r, stages) for p, r in zip(probs, responses)]
+
+def embed_image(data, timings=None):
+    """Penultimate-layer embedding of one image (always from the eager fp32 classifier)."""
+    timings = timings or Timings()
+    with timings.stage("decode"):
+        image = decode_image(data)
+    with timings.stage("preprocess"):
+        batch = collate_images([image]).to(device)
+    with timings.stage("embed"), torch.no_grad():
+        return classifier.embed(batch)[0].cpu()
+
+def predict_items(data, portion_total=None, timings=None, nutrition_mode=None):
+    """Multi-item prediction for one image: every crop in a single batched forward pass.
+
+    Returns the /predict/items response. `portion_total` is the whole
+    plate's weight, split between items by their share of the plate; without
+    it each item is assumed to weigh the default portion.
+    """
+    timings = timings or Timings()
+    with timings.stage("crops"):
+        crops = cropper(data)
+        if FAST_PREPROCESS:
+            images, collate = [np.array(c) for c in crops], crop_preprocessor.to_batch
+        else:
+            images, collate = [transform(c) for c in crops], None
+    batch_size_hist.observe(len(images))
+    probs = classify(images, timings, collate)
+    with timings.stage("merge"):
+        items = merge_detections(cropper.boxes, cropper.levels, probs.numpy(), MULTI_MIN_CONFIDENCE,
+                                 max_items=MULTI_MAX_ITEMS)
+    if portion_total is None:
+        portion_total = get_dummy_portion_value() * len(items)
+    portions = [portion_total * item.share for item in items]
+    responses = responses_from_probs(np.stack([item.probs for item in items]), portions, timings, nutrition_mode)
+
+    for item, response in zip(items, responses):
+        response["confidence"] = round(item.confidence, 4)
+        response["box"] = [round(float(v), 4) for v in item.box]
+        response["crops"] = item.crops
+    totals = {key: round(sum(r[key] for r in responses), 2)
+              for key in ("calories", "portion_used_g", "protein_g", "carbs_g", "fat_g", "approx_sugar_rise")}
+    return {"items": responses, "total": totals, "crops": len(crops)}
+
+# ------------------------------
+# Multi-image batches (/predict/batch)
+# Items are (name, read, portion) with `read` returning the image bytes, so
+# uploaded files and zip members stay spooled on disk until their chunk is
+# decoded; only ~two chunks of decoded images are in memory at a time.
+# ------------------------------
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif")
+
+def read_limited(fileobj, limit=BATCH_MAX_FILE_BYTES):
+    data = fileobj.read(limit + 1)
+    if len(data) > limit:
+        raise ImageTooLarge(f"Image is larger than {limit} bytes")
+    return data
+
+def batch_items_from_files(files, portions):
+    """Items for multipart uploads; `portions` is empty, one value for all, or one per file."""
+    if len(portions) not in (0, 1, len(files)):
+        raise ValueError(f"Got {len(portions)} portions for {len(files)} files; send one per file or a single one")
+    return [(f.filename or str(i), lambda f=f: read_limited(f.file),
+             portions[i if len(portions) > 1 else 0] if portions else None)
+            for i, f in enumerate(files)]
+
+def batch_items_from_zip(fileobj, portions):
+    """Items for a zip archive's images; an optional portions.json member maps names to grams."""
+    if len(portions) > 1:
+        raise ValueError("With an archive, send a single portion or a portions.json member")
+    try:
+        archive = zipfile.ZipFile(fileobj)
+        per_name = json.loads(archive.read("portions.json")) if "portions.json" in archive.namelist() else {}
+    except (zipfile.BadZipFile, ValueError) as e:
+        raise ValueError(f"Invalid archive: {e}")
+    if not isinstance(per_name, dict):
+        raise ValueError("portions.json must map image names to grams")
+
+    def read(info):
+        # The header's file_size is whatever the client wrote; the bounded read is the real check
+        with archive.open(info) as member:
+            return read_limited(member)
+
+    infos = [info for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+             and not os.path.basename(info.filename).startswith(".") and not info.filename.startswith("__MACOSX/")]
+    return [(info.filename, lambda info=info: read(info), per_name.get(info.filename, portions[0] if portions else None))
+            for info in infos]
+
+def load_batch_item(read):
+    """(cache key, cached probs, None) or (cache key, None, decoded image) for one batch item."""
+    data = read()
+    key = prediction_cache.make_key(cache_namespace, data)
+    cached = prediction_cache.get(key)
+    if cached is not None:
+        return key, cached, None
+    return key, None, decode_image(data)
+
+def predict_chunk(loaded, portions, nutrition_mode=None):
+    """/predict responses for one chunk of loaded items; the uncached ones share a forward pass."""
+    timings = Timings(stage_seconds)
+    probs = [torch.as_tensor(cached) if cached is not None else None for _, cached, _ in loaded]
+    todo = [i for i, p in enumerate(probs) if p is None]
+    if todo:
+        batch_size_hist.observe(len(todo))
+        for i, p in zip(todo, classify([loaded[i][2] for i in todo], timings)):
+            probs[i] = p
+            prediction_cache.put(loaded[i][0], p.tolist())
+    return responses_from_probs(torch.stack(probs), portions, timings, nutrition_mode)
+
+# ------------------------------
+# Classifier backend selection (CLASSIFIER_BACKEND) with an accuracy gate
+# ------------------------------
+def load_image_batches(paths, batch_size=BATCH_MAX_SIZE):
+    batches = []
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                images.append(preprocessor.decode(f.read()))
+        batches.append(preprocessor.to_batch(images).clone().to(device))
+    return batches
+
+def select_backend(model):
+    if CLASSIFIER_BACKEND == "eager":
+        return model
+
+    gate_batches = []
+    if BACKEND_GATE_DIR:
+        gate_batches = load_image_batches([path for path, _ in backends.list_images(BACKEND_GATE_DIR)])
+    if not gate_batches and CLASSIFIER_BACKEND in backends.LOSSY_BACKENDS:
+        print(f"Classifier backend {CLASSIFIER_BACKEND!r} refused: lossy backends need BACKEND_GATE_DIR "
+              f"(sample images for calibration and the accuracy gate). Using eager.")
+        return model
+    example = gate_batches[0] if gate_batches else torch.zeros(BATCH_MAX_SIZE, 3, 224, 224, device=device)
+
+    try:
+        runner = backends.build_backend(CLASSIFIER_BACKEND, model, example, gate_batches)
+        with torch.no_grad():
+            runner(example)   # surfaces tracing/compile failures now rather than on a request
+    except Exception as e:
+        print(f"Classifier backend {CLASSIFIER_BACKEND!r} failed to build, using eager: {e}")
+        return model
+
+    if not gate_batches:
+        print(f"Classifier backend {CLASSIFIER_BACKEND!r} selected without an accuracy gate (lossless; BACKEND_GATE_DIR unset).")
+        return runner
+
     with torch.no_grad():
-        logits = classifier(img_tensor)
-        probs = torch.softmax(logits, dim=1)
-        pred_idx = int(torch.argmax(probs, dim=1).item())
-        pred_name = class_names[pred_idx] if 0 <= pred_idx < len(class_names) else str(pred_idx)
+        baseline = torch.cat([model(b) for b in gate_batches])
+        candidate = torch.cat([runner(b) for b in gate_batches])
+    top1, top3 = backends.agreement(baseline, candidate)
+    if top1 < BACKEND_MIN_AGREEMENT:
+        print(f"Classifier backend {CLASSIFIER_BACKEND!r} refused: top-1 agreement {top1:.3f} "
+              f"< {BACKEND_MIN_AGREEMENT}. Using eager.")
+        return model
+    print(f"Classifier backend {CLASSIFIER_BACKEND!r} selected (top-1 agreement {top1:.3f}, top-3 {top3:.3f}).")
+    return runner
+
+# ------------------------------
+# Lifecycle: tunnel, model loading, warmup, readiness
+# Importing this module has no side effects; the tunnel and models come up
+# when the app starts (models on first request with LAZY_LOAD=1).
+# ------------------------------
+lifecycle = {"state": "starting", "error": None, "load_seconds": None}
+_load_lock = threading.Lock()
+_load_future = None
+
+def warmup():
+    # Dummy batches so the first real requests don't pay for allocator/kernel setup
+    if FAST_PREPROCESS:
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+    else:
+        dummy = torch.zeros(3, 224, 224)
+    for n in sorted({1, BATCH_MAX_SIZE}):
+        predict_batch([(dummy, get_dummy_portion_value())] * n, record=False)
+
+def model_fingerprint():
+    """Short hash of everything that changes the classifier's probabilities for a given image."""
+    st = os.stat(CLASSIFIER_STATE)
+    backend = CLASSIFIER_BACKEND if classifier_runner is not classifier else "eager"
+    parts = [st.st_size, st.st_mtime_ns, NUM_CLASSES, backend, FAST_PREPROCESS]
+    if CASCADE_ENABLED:
+        parts += [CASCADE_SIZE, CASCADE_MIN_CONFIDENCE, CASCADE_MIN_MARGIN, ",".join(CASCADE_TTA)]
+    return hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).hexdigest()[:16]
+
+def load_models():
+    """Load both models, compile the calorie table and warm up. Safe to call more than once."""
+    global classifier, classifier_runner, calorie_model, calorie_table, nutrition, cache_namespace
+    with _load_lock:
+        if lifecycle["state"] == "ready":
+            return
+        lifecycle["state"] = "loading"
+        try:
+            t0 = time.perf_counter()
+            nutrition = load_nutrition()
+            classifier = load_classifier()
+            classifier_runner = select_backend(classifier)
+            cache_namespace = "classifier:" + model_fingerprint()
+            calorie_model = load_calorie_model()
+            calorie_table = compile_calorie_table(calorie_model)
+            if WARMUP:
+                lifecycle["state"] = "warming_up"
+                warmup()
+            lifecycle["load_seconds"] = round(time.perf_counter() - t0, 3)
+            lifecycle["state"] = "ready"
+            lifecycle["error"] = None
+            print(f"Models ready in {lifecycle['load_seconds']}s.")
+        except Exception as e:
+            lifecycle["state"] = "failed"
+            lifecycle["error"] = str(e)
+            raise
+
+async def ensure_models_loaded():
+    global _load_future
+    if lifecycle["state"] == "ready":
+        return
+    # A failed load is retried by the next caller
+    if _load_future is None or (_load_future.done() and _load_future.exception() is not None):
+        _load_future = asyncio.get_running_loop().run_in_executor(None, load_models)
+    await asyncio.shield(_load_future)
+
+async def _load_in_background():
+    try:
+        await ensure_models_loaded()
+    except Exception as e:
+        print(f"Model loading failed: {e}")
+
+def start_tunnel():
+    import ngrok
+    ngrok.set_auth_token(NGROK_AUTHTOKEN)
+    return ngrok.forward(NGROK_ADDR, authtoken_from_env=True, domain=NGROK_DOMAIN)
+
+@asynccontextmanager
+async def lifespan(app):
+    if NGROK_ENABLED:
+        listener = await asyncio.get_running_loop().run_in_executor(None, start_tunnel)
+        print(f"Public URL: {listener.url()}")
+    if not LAZY_LOAD:
+        # Load in the background so /healthz answers while weights load; /readyz flips when warm
+        asyncio.get_running_loop().create_task(_load_in_background())
+    yield
+    inference_executor.shutdown(wait=False)
+
+# ------------------------------
+# FastAPI + CORS
+# ------------------------------
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],   # replace with your frontend origin(s) for production
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+profiler = SamplingProfiler(interval_ms=PROFILER_INTERVAL_MS) if PROFILER_ENABLED else None
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    # Per-request stage timings end up in the Server-Timing header
+    request.state.timings = Timings(stage_seconds)
+    with requests_in_flight.track():
+        response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - request.state.timings.start, path=path, status=response.status_code)
+    response.headers["Server-Timing"] = request.state.timings.header()
+    if profiler is not None and not path.startswith(("/debug", "/metrics")):
+        profiler.request_done()
+    return response
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok", "state": lifecycle["state"]}
+
+@app.get("/readyz")
+def readyz():
+    # In lazy mode the app is ready to take traffic before the models are loaded
+    ready = lifecycle["state"] == "ready" or (LAZY_LOAD and lifecycle["state"] != "failed")
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **lifecycle})
+
+# ------------------------------
+# Inference executor + micro-batching scheduler
+# Decoding and forward passes run on a bounded worker pool, never on the event
+# loop; concurrent /predict calls share forward passes.
+# ------------------------------
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE)
+batcher = MicroBatcher(predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                       executor=inference_executor)
+
+# Classifier outputs keyed by image content only: a repeat upload with a
+# different portion just reruns the calorie/macro step
+prediction_cache = PredictionCache(max_entries=CACHE_MAX_ENTRIES, ttl_s=CACHE_TTL_S,
+                                   disk_dir=os.path.join(CACHE_DIR, "predict") if CACHE_DIR else None,
+                                   disk_max_entries=CACHE_DISK_MAX_ENTRIES,
+                                   disk_max_bytes=int(CACHE_DISK_MAX_MB * 1024 * 1024))
+# Cached probabilities are only valid for the model that produced them, so the
+# key namespace carries model_fingerprint() (set by load_models)
+cache_namespace = "classifier"
+
+async def cache_lookup(key):
+    """Cached probs for `key`: the in-memory tier inline, the disk tier (file reads, sweeps) on a thread."""
+    if not prediction_cache.disk_dir:
+        return prediction_cache.get(key)
+    probs = prediction_cache.peek(key)
+    if probs is None:
+        probs = await asyncio.to_thread(prediction_cache.get, key)
+    return probs
+
+def cache_store(key, probs, background_tasks):
+    """Cache probs in memory now; the disk write runs on a thread after the response is sent."""
+    prediction_cache.put(key, probs, disk=False)
+    if prediction_cache.disk_dir:
+        background_tasks.add_task(prediction_cache.write_disk, key, probs)
+
+def request_deadline(timeout_ms=None):
+    # Clients may ask for a tighter deadline than the server default
+    timeout_s = REQUEST_TIMEOUT_S
+    if timeout_ms is not None and timeout_ms > 0:
+        timeout_s = min(timeout_s, timeout_ms / 1000.0)
+    return time.monotonic() + timeout_s
+
+async def run_with_backpressure(coro_fn, deadline):
+    try:
+        with inference_executor.slot():
+            remaining = max(deadline - time.monotonic(), 0.0)
+            return await asyncio.wait_for(coro_fn(), timeout=remaining)
+    except QueueFull:
+        rejected_total.inc(reason="queue_full")
+        raise HTTPException(status_code=503, detail="Server busy, inference queue is full",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        rejected_total.inc(reason="deadline")
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        rejected_total.inc(reason="too_large")
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnidentifiedImageError:
+        rejected_total.inc(reason="bad_image")
+        raise HTTPException(status_code=400, detail="Not a readable image")
+
+@app.post("/predict")
+async def predict(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                  portion: float = Form(None), nutrition_mode: str = Form(None),
+                  x_request_timeout_ms: float = Header(None)):
+    timings = request.state.timings
+    if nutrition_mode not in (None, "top1", "expected"):
+        raise HTTPException(status_code=422, detail="nutrition_mode must be 'top1' or 'expected'")
+    deadline = request_deadline(x_request_timeout_ms)
+    try:
+        await ensure_models_loaded()
+    except Exception:
+        rejected_total.inc(reason="models_unavailable")
+        raise HTTPException(status_code=503, detail="Models unavailable",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    with timings.stage("read"):
+        data = await file.read()
 
     # ------------------------------
     # Portion handling
     # ------------------------------
     portion_val = portion if portion is not None else get_dummy_portion_value()
 
-    # One-hot + portion tensor for calorie model
-    one_hot = torch.zeros(1, NUM_CLASSES).to(device)
-    one_hot[0, pred_idx] = 1.0
-    portion_t = portion_tensor_from_value(portion_val)
-    x_cal = torch.cat([one_hot, portion_t], dim=1)
+    with timings.stage("cache"):
+        cache_key = prediction_cache.make_key(cache_namespace, data)
+        cached_probs = await cache_lookup(cache_key)
+    if cached_probs is not None:
+        return responses_from_probs([cached_probs], [portion_val], timings, nutrition_mode)[0]
 
-    # ------------------------------
-    # Calories prediction
-    # ------------------------------
-    with torch.no_grad():
-        cal_pred = float(calorie_model(x_cal).item())
+    async def run():
+        # Image preprocessing (worker pool), then the batched forward passes
+        image = await inference_executor.run(timings.timed, "decode", decode_image, data, deadline=deadline)
+        start = time.perf_counter()
+        result = await batcher.submit((image, portion_val), deadline=deadline)
+        # The batch's stages were observed once per batch; here they only go in the header
+        for stage, seconds in result[2].items():
+            timings.add(stage, seconds, observe=False)
+        timings.add("queue", max(time.perf_counter() - start - sum(result[2].values()), 0.0))
+        return result
 
-    # ------------------------------
-    # Macronutrients + glycemic index safely
-    # ------------------------------
-    nutr = food_nutrition.get(pred_name, (0, 0, 0, 0, 0))  # 5-value tuple
-    if len(nutr) != 5:
-        prot_100g, carb_100g, fat_100g, gly_index = 0, 0, 0, 0
+    probs, response, _ = await run_with_backpressure(run, deadline)
+    cache_store(cache_key, probs.tolist(), background_tasks)
+    if nutrition_mode and nutrition_mode != NUTRITION_MODE:
+        # Batches use the server default; redo just the macro step for this item
+        response = responses_from_probs(probs.unsqueeze(0), [portion_val], timings, nutrition_mode)[0]
+    return response
+
+@app.post("/predict/items")
+async def predict_items_endpoint(request: Request, file: UploadFile = File(...), portion: float = Form(None),
+                                 nutrition_mode: str = Form(None), x_request_timeout_ms: float = Header(None)):
+    """Several foods on one plate: one entry per detected item (see multi_item.py)."""
+    timings = request.state.timings
+    if nutrition_mode not in (None, "top1", "expected"):
+        raise HTTPException(status_code=422, detail="nutrition_mode must be 'top1' or 'expected'")
+    deadline = request_deadline(x_request_timeout_ms)
+    try:
+        await ensure_models_loaded()
+    except Exception:
+        rejected_total.inc(reason="models_unavailable")
+        raise HTTPException(status_code=503, detail="Models unavailable",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    with timings.stage("read"):
+        data = await file.read()
+
+    async def run():
+        # Crops are already a batch, so they skip the micro-batcher
+        return await inference_executor.run(predict_items, data, portion, timings, nutrition_mode, deadline=deadline)
+
+    return await run_with_backpressure(run, deadline)
+
+def batch_error_line(index, name, e):
+    if isinstance(e, DeadlineExceeded):
+        rejected_total.inc(reason="deadline")
+        message = "Request deadline exceeded"
     else:
-        # Ignore first value (calories), use protein, carbs, fat, GI
-        _, prot_100g, carb_100g, fat_100g, gly_index = nutr
+        message = f"{type(e).__name__}: {e}"
+    return json.dumps({"index": index, "name": name, "error": message}) + "\n"
 
-    # Scale nutrients to portion
-    factor = portion_val / 100.0
-    prot = round(prot_100g * factor, 2)
-    carb = round(carb_100g * factor, 2)
-    fat = round(fat_100g * factor, 2)
+async def stream_batch(items, nutrition_mode, timeout_ms, slot):
+    """NDJSON lines for `items`, one chunk at a time; the next chunk decodes while this one is classified."""
+    async def load(start):
+        # Each image of the chunk is read and decoded as its own task on the pool
+        deadline = request_deadline(timeout_ms)
+        chunk = items[start:start + BATCH_CHUNK_SIZE]
+        loaded = await asyncio.gather(*(inference_executor.run(load_batch_item, read, deadline=deadline)
+                                        for _, read, _ in chunk), return_exceptions=True)
+        return chunk, loaded
 
-    # Approximate sugar rise (simplified)
-    sugar_impact = round(carb * (gly_index / 100), 2)
+    pending = asyncio.ensure_future(load(0))
+    try:
+        for start in range(0, len(items), BATCH_CHUNK_SIZE):
+            chunk, loaded = await pending
+            if start + BATCH_CHUNK_SIZE < len(items):
+                pending = asyncio.ensure_future(load(start + BATCH_CHUNK_SIZE))
+            ok = [i for i, item in enumerate(loaded) if not isinstance(item, BaseException)]
+            responses = {}
+            if ok:
+                try:
+                    results = await inference_executor.run(
+                        predict_chunk, [loaded[i] for i in ok],
+                        [chunk[i][2] if chunk[i][2] is not None else get_dummy_portion_value() for i in ok],
+                        nutrition_mode, deadline=request_deadline(timeout_ms))
+                    responses = dict(zip(ok, results))
+                except Exception as e:
+                    loaded = [e if i in ok else item for i, item in enumerate(loaded)]
+            lines = []
+            for i, (name, _, _) in enumerate(chunk):
+                if i in responses:
+                    lines.append(json.dumps({"index": start + i, "name": name, **responses[i]}) + "\n")
+                else:
+                    lines.append(batch_error_line(start + i, name, loaded[i]))
+            yield "".join(lines)
+    finally:
+        pending.cancel()
+        slot.close()
 
-    # ------------------------------
-    # Top-3 predictions
-    # ------------------------------
-    topk = torch.topk(probs, k=min(3, probs.shape[1]), dim=1)
-    topk_indices = topk.indices[0].cpu().tolist()
-    topk_probs = topk.values[0].cpu().tolist()
-    topk_list = [
-        {"class": class_names[i] if 0 <= i < len(class_names) else str(i), "prob": round(float(p), 4)}
-        for i, p in zip(topk_indices, topk_probs)
-    ]
+@app.post("/predict/batch")
+async def predict_batch_endpoint(request: Request, x_request_timeout_ms: float = Header(None)):
+    """Many images in one request, as repeated `files` parts or one zip `archive`.
 
-    # ------------------------------
-    # Return response
-    # ------------------------------
-    return {
-        "food": pred_name,
-        "calories": round(cal_pred, 2),
-        "portion_used_g": round(float(portion_val), 2),
-        "protein_g": prot,
-        "carbs_g": carb,
-        "fat_g": fat,
-        "glycemic_index": gly_index,
-        "approx_sugar_rise": sugar_impact,
-        "top_predictions": topk_list
-    }
+    Form fields: `files` (up to BATCH_MAX_FILES) or `archive`, optional
+    `portion` (repeated) and `nutrition_mode`. The form is parsed here rather
+    than through File()/Form() parameters so the part limits are ours.
 
+    Results stream back as NDJSON, one line per image in input order: the
+    /predict response plus "index" and "name", or "index", "name" and
+    "error" for an image that could not be classified. X-Request-Timeout-Ms
+    applies per chunk of BATCH_CHUNK_SIZE images rather than to the whole
+    batch.
+    """
+    try:
+        form = await request.form(max_files=BATCH_MAX_FILES, max_fields=BATCH_MAX_FILES + 2)
+    except StarletteHTTPException as e:
+        status = 413 if str(e.detail).startswith("Too many") else e.status_code
+        raise HTTPException(status_code=status, detail=e.detail)
+    files = [f for f in form.getlist("files") if isinstance(f, StarletteUploadFile)]
+    archive = form.get("archive") if isinstance(form.get("archive"), StarletteUploadFile) else None
+    nutrition_mode = form.get("nutrition_mode")
+    try:
+        portion = [float(p) for p in form.getlist("portion")]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="portion must be a number")
+    if nutrition_mode not in (None, "top1", "expected"):
+        raise HTTPException(status_code=422, detail="nutrition_mode must be 'top1' or 'expected'")
+    if bool(files) == (archive is not None):
+        raise HTTPException(status_code=422, detail="Send either 'files' or an 'archive', not both")
+    try:
+        items = batch_items_from_files(files, portion or []) if files else batch_items_from_zip(archive.file, portion or [])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=422, detail="No images in the request")
+    if len(items) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+    try:
+        await ensure_models_loaded()
+    except Exception:
+        rejected_total.inc(reason="models_unavailable")
+        raise HTTPException(status_code=503, detail="Models unavailable",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+
+    # The whole batch holds one admission slot until the stream ends
+    slot = ExitStack()
+    try:
+        slot.enter_context(inference_executor.slot())
+    except QueueFull:
+        rejected_total.inc(reason="queue_full")
+        raise HTTPException(status_code=503, detail="Server busy, inference queue is full",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    return StreamingResponse(stream_batch(items, nutrition_mode, x_request_timeout_ms, slot),
+                             media_type="application/x-ndjson")
+
+@app.post("/embed")
+async def embed(request: Request, file: UploadFile = File(...), x_request_timeout_ms: float = Header(None)):
+    """Classifier embedding of an image (for app.py's similar-meal index, see embedding_index.py)."""
+    timings = request.state.timings
+    deadline = request_deadline(x_request_timeout_ms)
+    try:
+        await ensure_models_loaded()
+    except Exception:
+        rejected_total.inc(reason="models_unavailable")
+        raise HTTPException(status_code=503, detail="Models unavailable",
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    data = await file.read()
+
+    async def run():
+        return await inference_executor.run(embed_image, data, timings, deadline=deadline)
+
+    vector = await run_with_backpressure(run, deadline)
+    return {"embedding": [round(v, 5) for v in vector.tolist()], "dim": len(vector)}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return prediction_cache.stats()
 
+metrics.gauge("food_batch_queue_depth", "Images waiting for the next batch", fn=lambda: batcher.queue_depth)
+metrics.gauge("food_inference_in_flight", "Requests holding an inference slot", fn=lambda: inference_executor.in_flight)
+metrics.counter("food_cache_lookups_total", "Prediction cache lookups", ("result",), fn=cache_lookup_counts(prediction_cache))
+metrics.gauge("food_cache_entries", "Entries in the in-memory prediction cache",
+              fn=lambda: prediction_cache.stats()["entries"])
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 # ------------------------------
-# Run the server when invoked as a script
+# Sampling profiler (PROFILER_ENABLED=1): POST /debug/profile?requests=N arms it
+# for the next N requests; GET /debug/profile/collapsed returns flamegraph input
+# ------------------------------
+def require_profiler():
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler disabled (set PROFILER_ENABLED=1)")
+    return profiler
+
+@app.post("/debug/profile")
+def start_profile(requests: int = 100):
+    try:
+        require_profiler().arm(requests)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+@app.get("/debug/profile")
+def profile_status():
+    return require_profiler().status()
+
+@app.get("/debug/profile/collapsed")
+def profile_collapsed():
+    return PlainTextResponse(require_profiler().collapsed())
+
+
+
+
+# ------------------------------
+# Run the server when invoked as a script (multi-worker launcher, see serve.py)
+# ------------------------------
 if __name__ == "__main__":
-    public_url = ngrok.connect(8000)
-    print(f"Public URL: {public_url}")
-    uvicorn.run(app, host="0.0.0.0", port=7000)
\ No newline at end of file
+    import serve
+    serve.main()
@@ -0,0 +1,102 @@
+# backends.py
+# Optimized CPU inference backends for the food classifier.
+#
+#   eager          fp32 module as-is (baseline)
+#   channels_last  NHWC weights/activations + torch.inference_mode
+#   int8_dynamic   dynamic INT8 quantization (Linear layers)
+#   int8_static    static INT8 quantization via FX graph mode, calibrated on sample batches
+#   torchscript    traced + frozen TorchScript graph
+#   compile        torch.compile (inductor)
+#
+# Every backend takes and returns the same tensors as the eager model, so it
+# can be swapped in behind classify_batch. `agreement` measures how closely a
+# backend tracks the fp32 baseline and is used to refuse lossy backends.
+import copy
+import os
+
+import torch
+import torch.nn as nn
+
+BACKENDS = ("eager", "channels_last", "int8_dynamic", "int8_static", "torchscript", "compile")
+# Quantized backends change the numbers; they are only used after passing the agreement gate
+LOSSY_BACKENDS = ("int8_dynamic", "int8_static")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class _ChannelsLast(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        with torch.inference_mode():
+            return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def _int8_static(model, example, calibration_batches):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm"
+    torch.backends.quantized.engine = engine
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(engine), (example,))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def build_backend(name, model, example, calibration_batches=None):
+    """Return a module computing the same logits as `model` with the given backend.
+
+    `example` is a representative input batch (used for tracing/quantization);
+    `calibration_batches` feeds int8_static's observers and must be real
+    images: calibrating on a dummy tensor yields garbage scales.
+    """
+    model = model.eval()
+    if name == "eager":
+        return model
+    if name == "channels_last":
+        return _ChannelsLast(copy.deepcopy(model)).eval()
+    if name == "int8_dynamic":
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    if name == "int8_static":
+        if not calibration_batches:
+            raise ValueError("int8_static needs calibration images")
+        return _int8_static(model, example, calibration_batches)
+    if name == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    if name == "compile":
+        return torch.compile(model)
+    raise ValueError(f"Unknown classifier backend {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def agreement(baseline_logits, logits):
+    """(top-1 agreement, top-3 agreement) of `logits` against the fp32 baseline.
+
+    Top-1: same argmax. Top-3: the baseline's top-1 class is within the
+    backend's top-3.
+    """
+    base_top1 = baseline_logits.argmax(dim=1)
+    top1 = (logits.argmax(dim=1) == base_top1).float().mean().item()
+    k = min(3, logits.shape[1])
+    top3 = (logits.topk(k, dim=1).indices == base_top1.unsqueeze(1)).any(dim=1).float().mean().item()
+    return top1, top3
+
+
+def list_images(folder, class_names=None):
+    """Images under `folder` as (path, label_idx) pairs.
+
+    A folder laid out as <class_name>/<image> is labelled from the directory
+    name; loose images (or unknown directory names) get label None.
+    """
+    index = {name: i for i, name in enumerate(class_names or [])}
+    items = []
+    for root, _, files in os.walk(folder):
+        label = index.get(os.path.basename(root)) if os.path.abspath(root) != os.path.abspath(folder) else None
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((os.path.join(root, name), label))
+    return sorted(items)
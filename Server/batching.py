@@ -0,0 +1,91 @@
+# batching.py
+# Dynamic micro-batching for inference endpoints.
+#
+# Requests are queued as they arrive; a single worker task drains the queue
+# into batches of at most `max_batch_size`, waiting at most `max_wait_ms` for
+# a batch to fill up. The batch function receives the list of queued items
+# and must return one result per item, in the same order.
+#
+# If an `executor` (see executor.py) is given, the batch function runs on its
+# worker pool instead of the event loop.
+import asyncio
+import time
+
+from executor import DeadlineExceeded
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, executor=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.run_batch = run_batch
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self.executor = executor
+        self._pending = []          # list of (item, deadline, future)
+        self._full = None
+        self._worker = None
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    async def submit(self, item, deadline=None):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, deadline, fut))
+        if len(self._pending) >= self.max_batch_size and self._full is not None:
+            self._full.set()
+        if self._worker is None:
+            # The event is created alongside the worker so both belong to the running loop
+            self._full = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        return await fut
+
+    def _next_batch(self):
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+
+        now = time.monotonic()
+        live = []
+        for item, deadline, fut in batch:
+            # Callers that went away (cancelled futures) don't need a forward pass
+            if fut.done():
+                continue
+            if deadline is not None and now > deadline:
+                fut.set_exception(DeadlineExceeded("request deadline passed while queued"))
+                continue
+            live.append((item, fut))
+        return live
+
+    async def _dispatch(self, items):
+        if self.executor is None:
+            return self.run_batch(items)
+        return await self.executor.run(self.run_batch, items)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                    self._full.clear()
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.max_wait)
+                    except asyncio.TimeoutError:
+                        pass
+
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                try:
+                    results = await self._dispatch([item for item, _ in batch])
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+
+                for (_, fut), result in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(result)
+        finally:
+            self._worker = None
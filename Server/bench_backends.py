@@ -0,0 +1,111 @@
+# bench_backends.py
+# Compare classifier inference backends on a folder of images.
+#
+#   python bench_backends.py --dir uploads
+#   python bench_backends.py --dir labelled/ --backends eager,channels_last,int8_static --min-agreement 0.99
+#
+# A labelled folder is laid out as <class_name>/<image> (names from classes.txt);
+# loose images are used for latency and agreement only. Each backend reports
+# per-batch latency, throughput and top-1/top-3 agreement with the fp32 eager
+# baseline; backends below --min-agreement are marked REFUSED and the script
+# exits non-zero.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+os.environ.setdefault("NGROK_ENABLED", "0")
+import app2
+import backends
+
+
+def time_backend(runner, batches, repeats):
+    with torch.no_grad():
+        for batch in batches:   # warm-up (also triggers lazy compilation)
+            runner(batch)
+        latencies = []
+        for _ in range(repeats):
+            for batch in batches:
+                start = time.perf_counter()
+                runner(batch)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark classifier inference backends")
+    parser.add_argument("--dir", default="uploads")
+    parser.add_argument("--backends", default=",".join(backends.BACKENDS))
+    parser.add_argument("--batch-size", type=int, default=app2.BATCH_MAX_SIZE)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-agreement", type=float, default=app2.BACKEND_MIN_AGREEMENT)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    items = backends.list_images(args.dir, app2.class_names)
+    if not items:
+        raise SystemExit(f"No images found in {args.dir}")
+    batches = app2.load_image_batches([path for path, _ in items], args.batch_size)
+    labels = torch.tensor([-1 if label is None else label for _, label in items])
+    labelled = labels >= 0
+
+    model = app2.load_classifier()
+    with torch.no_grad():
+        baseline = torch.cat([model(b) for b in batches])
+
+    results = []
+    for name in args.backends.split(","):
+        name = name.strip()
+        try:
+            runner = backends.build_backend(name, model, batches[0], batches)
+            latencies = time_backend(runner, batches, args.repeats)
+            with torch.no_grad():
+                logits = torch.cat([runner(b) for b in batches])
+        except Exception as e:
+            print(f"{name:14s} FAILED: {e}")
+            results.append({"backend": name, "error": str(e)})
+            continue
+
+        top1, top3 = backends.agreement(baseline, logits)
+        accuracy = None
+        if labelled.any():
+            accuracy = (logits.argmax(dim=1)[labelled] == labels[labelled]).float().mean().item()
+        images_timed = len(items) * args.repeats
+        result = {
+            "backend": name,
+            "batch_ms_mean": round(statistics.mean(latencies), 3),
+            "batch_ms_p50": round(statistics.median(latencies), 3),
+            "images_per_s": round(images_timed / (sum(latencies) / 1000.0), 2),
+            "top1_agreement": round(top1, 4),
+            "top3_agreement": round(top3, 4),
+            "accuracy": None if accuracy is None else round(accuracy, 4),
+            "refused": top1 < args.min_agreement,
+        }
+        results.append(result)
+
+    print(f"\n{len(items)} images, batch size {args.batch_size}, {args.repeats} repeats")
+    print(f"{'backend':14s} {'batch ms':>9s} {'p50 ms':>8s} {'img/s':>8s} {'top1':>6s} {'top3':>6s} {'acc':>6s}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:14s} error: {r['error']}")
+            continue
+        acc = "-" if r["accuracy"] is None else f"{r['accuracy']:.3f}"
+        status = "  REFUSED" if r["refused"] else ""
+        print(f"{r['backend']:14s} {r['batch_ms_mean']:9.2f} {r['batch_ms_p50']:8.2f} {r['images_per_s']:8.1f} "
+              f"{r['top1_agreement']:6.3f} {r['top3_agreement']:6.3f} {acc:>6s}{status}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"dir": args.dir, "images": len(items), "batch_size": args.batch_size,
+                       "min_agreement": args.min_agreement, "results": results}, f, indent=2)
+
+    if any(r.get("refused") for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
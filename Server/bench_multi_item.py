@@ -0,0 +1,97 @@
+# bench_multi_item.py
+# Cost of /predict/items against crop count, relative to a single /predict.
+#
+#   python bench_multi_item.py
+#   python bench_multi_item.py --configs "1.0;1.0,0.6;1.0,0.6,0.4" --repeats 10 --json multi.json
+#   python bench_multi_item.py --crop-size 160     # smaller crops (MULTI_CROP_SIZE)
+#
+# For each scale configuration it times the full multi-item path (decode
+# once, crop, one batched forward pass, merge, calories/macros) on the
+# sample images and reports it against N x the single-image path, which is
+# what classifying each crop separately would cost.
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+import torch
+
+os.environ.setdefault("NGROK_ENABLED", "0")
+import app2
+from multi_item import MultiCropper
+from preprocess import Preprocessor
+
+DEFAULT_CONFIGS = "1.0;1.0,0.6;1.0,0.6,0.4;1.0,0.75,0.5,0.35"
+
+
+def time_ms(fn, repeats):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def single_prediction(data):
+    return app2.predict_batch([(app2.decode_image(data), app2.get_dummy_portion_value())])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-item inference cost vs crop count")
+    parser.add_argument("--dir", default="uploads")
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="';'-separated lists of crop scales")
+    parser.add_argument("--overlap", type=float, default=app2.MULTI_OVERLAP)
+    parser.add_argument("--crop-size", type=int, default=app2.MULTI_CROP_SIZE)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    paths = sorted(p for p in glob.glob(os.path.join(args.dir, "*")) if p.lower().endswith((".jpg", ".jpeg", ".png")))
+    if not paths:
+        raise SystemExit(f"No images found in {args.dir}")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    app2.load_models()
+    app2.crop_preprocessor = Preprocessor(size=args.crop_size)
+    single_ms = statistics.mean(time_ms(lambda: single_prediction(data), args.repeats) for data in images)
+    print(f"single /predict path: {single_ms:.1f} ms/image ({len(images)} images, "
+          f"{torch.get_num_threads()} threads)\n")
+    print(f"{'scales':22s} {'crops':>5s} {'ms':>8s} {'x single':>9s} {'N x single':>11s} {'vs N x':>7s} {'items':>6s}")
+
+    results = []
+    for config in args.configs.split(";"):
+        scales = tuple(float(s) for s in config.split(","))
+        app2.cropper = MultiCropper(size=args.crop_size, scales=scales, overlap=args.overlap)
+        crops = len(app2.cropper)
+        ms = statistics.mean(time_ms(lambda: app2.predict_items(data), args.repeats) for data in images)
+        items = statistics.mean(len(app2.predict_items(data)["items"]) for data in images)
+        result = {
+            "scales": list(scales),
+            "crops": crops,
+            "ms": round(ms, 2),
+            "relative_to_single": round(ms / single_ms, 2),
+            "relative_to_n_singles": round(ms / (crops * single_ms), 3),
+            "mean_items": round(items, 2),
+        }
+        results.append(result)
+        print(f"{config:22s} {crops:5d} {ms:8.1f} {result['relative_to_single']:9.2f} "
+              f"{crops * single_ms:11.1f} {result['relative_to_n_singles']:7.2f} {items:6.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"single_ms": round(single_ms, 2), "crop_size": args.crop_size, "threads": torch.get_num_threads(),
+                       "images": len(images), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
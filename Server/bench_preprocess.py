@@ -0,0 +1,89 @@
+# bench_preprocess.py
+# Micro-benchmark: reference torchvision `transform` vs the fast Preprocessor
+# path on the sample images in uploads/.
+#
+#   python bench_preprocess.py                 # timing + numeric difference
+#   python bench_preprocess.py --check-top1    # also compare classifier top-1 (loads app2 models)
+import argparse
+import glob
+import io
+import os
+import time
+
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocess import Preprocessor, MEAN, STD
+
+reference_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(list(MEAN), list(STD))
+])
+
+
+def reference_path(data):
+    return reference_transform(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def time_it(fn, data, repeats):
+    fn(data)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(data)
+    return (time.perf_counter() - start) / repeats * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dir", default="uploads")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--check-top1", action="store_true")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.dir, "*")) if os.path.isfile(p))
+    if not paths:
+        raise SystemExit(f"No images found in {args.dir}")
+
+    preprocessor = Preprocessor()
+    classifier = None
+    if args.check_top1:
+        import app2
+        app2.load_models()
+        classifier = app2.classifier
+
+    print(f"{'image':45s} {'size':>9s} {'ref ms':>8s} {'fast ms':>8s} {'speedup':>8s} {'max|d|':>8s} {'top1':>6s}")
+    total_ref = total_fast = 0.0
+    agree = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        ref_ms = time_it(reference_path, data, args.repeats)
+        fast_ms = time_it(preprocessor, data, args.repeats)
+        total_ref += ref_ms
+        total_fast += fast_ms
+
+        ref = reference_path(data)
+        fast = preprocessor(data)
+        max_diff = float((ref - fast).abs().max())
+
+        top1 = "-"
+        if classifier is not None:
+            with torch.no_grad():
+                preds = classifier(torch.stack([ref, fast])).argmax(dim=1).tolist()
+            top1 = "same" if preds[0] == preds[1] else "DIFF"
+            agree += preds[0] == preds[1]
+
+        w, h = Image.open(path).size
+        print(f"{os.path.basename(path)[:45]:45s} {f'{w}x{h}':>9s} {ref_ms:8.2f} {fast_ms:8.2f} "
+              f"{ref_ms / fast_ms:7.2f}x {max_diff:8.4f} {top1:>6s}")
+
+    print(f"\nmean per image: reference {total_ref / len(paths):.2f} ms, fast {total_fast / len(paths):.2f} ms "
+          f"({total_ref / total_fast:.2f}x)")
+    if classifier is not None:
+        print(f"top-1 agreement: {agree}/{len(paths)}")
+
+
+if __name__ == "__main__":
+    main()
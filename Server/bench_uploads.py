@@ -0,0 +1,104 @@
+# bench_uploads.py
+# Upload pipeline benchmark: what /api/analyze sends upstream before and after
+# the in-memory pipeline, on the sample images in uploads/.
+#
+#   old: file.save -> reopen -> base64 the full-resolution file
+#   new: bytes in memory -> prepare_image (downscale to --max-edge) -> base64 once
+#
+#   python bench_uploads.py
+#   python bench_uploads.py --max-edge 768 --bandwidth-mbps 10 --post
+#
+# --post also times a real POST of each payload to a local fakes.FakeUpstreams
+# Clarifai endpoint over a pooled session.
+import argparse
+import base64
+import glob
+import os
+import statistics
+import tempfile
+import time
+
+from upload_pipeline import prepare_image
+from upstream import make_session, post_json
+
+
+def old_path(data, folder):
+    path = os.path.join(folder, "upload.jpg")
+    with open(path, "wb") as f:
+        f.write(data)
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def new_path(data, max_edge, quality):
+    return prepare_image(data, max_edge, quality).b64
+
+
+def time_ms(fn, repeats):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /api/analyze upload pipeline")
+    parser.add_argument("--dir", default="uploads")
+    parser.add_argument("--max-edge", type=int, default=1024)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0,
+                        help="uplink used to estimate transfer time (each request sends the payload to two providers)")
+    parser.add_argument("--post", action="store_true", help="also time POSTs to a local fake upstream")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.dir, "*"))
+                   if p.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+    if not paths:
+        raise SystemExit(f"No images found in {args.dir}")
+
+    fake = session = None
+    if args.post:
+        from fakes import FakeUpstreams
+        fake = FakeUpstreams().start()
+        session = make_session()
+
+    def transfer_ms(b64):
+        return 2 * len(b64) * 8 / (args.bandwidth_mbps * 1e6) * 1000.0
+
+    totals = {"old_bytes": 0, "new_bytes": 0, "old_ms": 0.0, "new_ms": 0.0}
+    print(f"{'image':40s} {'old KB':>8s} {'new KB':>8s} {'old ms':>8s} {'new ms':>8s} "
+          f"{'old xfer':>9s} {'new xfer':>9s}" + ("  post old/new ms" if args.post else ""))
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            old_ms, old_b64 = time_ms(lambda: old_path(data, tmp), args.repeats)
+            new_ms, new_b64 = time_ms(lambda: new_path(data, args.max_edge, args.quality), args.repeats)
+            line = (f"{os.path.basename(path)[:40]:40s} {len(old_b64) / 1024:8.1f} {len(new_b64) / 1024:8.1f} "
+                    f"{old_ms:8.2f} {new_ms:8.2f} {transfer_ms(old_b64):9.1f} {transfer_ms(new_b64):9.1f}")
+            if args.post:
+                url = f"{fake.url}/v2/models/food-item-recognition/outputs"
+                post = lambda b64: post_json(session, url, {"inputs": [{"data": {"image": {"base64": b64}}}]})
+                post_old, _ = time_ms(lambda: post(old_b64), args.repeats)
+                post_new, _ = time_ms(lambda: post(new_b64), args.repeats)
+                line += f"  {post_old:7.2f}/{post_new:.2f}"
+            print(line)
+            totals["old_bytes"] += len(old_b64)
+            totals["new_bytes"] += len(new_b64)
+            totals["old_ms"] += old_ms + transfer_ms(old_b64)
+            totals["new_ms"] += new_ms + transfer_ms(new_b64)
+
+    if fake is not None:
+        fake.stop()
+    print(f"\n{len(paths)} images, max edge {args.max_edge}, {args.bandwidth_mbps:g} Mbit/s uplink")
+    print(f"payload: {totals['old_bytes'] / 1024:.1f} KB -> {totals['new_bytes'] / 1024:.1f} KB "
+          f"({100.0 * (1 - totals['new_bytes'] / totals['old_bytes']):.1f}% smaller)")
+    print(f"prepare + transfer: {totals['old_ms']:.1f} ms -> {totals['new_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
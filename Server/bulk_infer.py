@@ -0,0 +1,172 @@
+# bulk_infer.py
+# Offline batch inference over a directory of images, with app2's models.
+#
+#   python bulk_infer.py uploads --out predictions.jsonl
+#   python bulk_infer.py /data/archive --recursive --batch-size 128 --workers 8
+#   python bulk_infer.py uploads --out predictions.jsonl --parquet predictions.parquet
+#
+# Images are decoded on a thread pool a few batches ahead of the model
+# (--prefetch), classified in large batched forward passes, and each result
+# is appended to the JSONL file as one line in the /predict response schema
+# plus "path" (relative to the input directory). Undecodable images get an
+# "error" line instead.
+#
+# Classification goes through app2.classify, so CASCADE_ENABLED and its
+# thresholds apply here as they do in the server.
+#
+# Re-running with the same --out resumes: images that already have a line
+# are skipped (a half-written last line from an interruption is dropped).
+# --retry-errors re-attempts images that failed before (the newer line wins).
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+os.environ.setdefault("NGROK_ENABLED", "0")
+import app2
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif")
+
+
+def list_images(root, recursive=False):
+    """Image paths under `root`, relative to it and sorted, so runs see a stable order."""
+    if not recursive:
+        names = (n for n in os.listdir(root) if os.path.isfile(os.path.join(root, n)))
+    else:
+        names = (os.path.relpath(os.path.join(d, n), root) for d, _, files in os.walk(root) for n in files)
+    return sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def load_done(out_path, retry_errors=False):
+    """Paths already in `out_path`; truncates a partial last line left by an interrupted run."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if retry_errors and "error" in record:
+            continue
+        done.add(record["path"])
+    return done
+
+
+def read_and_decode(root, name):
+    with open(os.path.join(root, name), "rb") as f:
+        return app2.decode_image(f.read())
+
+
+def decode_batch(pool, root, names):
+    """Futures for one batch; decoding runs on the pool while earlier batches are classified."""
+    return [(name, pool.submit(read_and_decode, root, name)) for name in names]
+
+
+def run(root, names, out, batch_size, workers, prefetch, portion, nutrition_mode, report_every_s=5.0):
+    batches = [names[i:i + batch_size] for i in range(0, len(names), batch_size)]
+    done = errors = 0
+    start = last_report = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        pending = [decode_batch(pool, root, batch) for batch in batches[:prefetch + 1]]
+        for index in range(len(batches)):
+            if index + prefetch + 1 < len(batches):
+                pending.append(decode_batch(pool, root, batches[index + prefetch + 1]))
+            images, ok, lines = [], [], []
+            for name, future in pending.pop(0):
+                try:
+                    images.append(future.result())
+                    ok.append(name)
+                except Exception as e:
+                    lines.append({"path": name, "error": f"{type(e).__name__}: {e}"})
+            if images:
+                probs = app2.classify(images)   # through the cascade when CASCADE_ENABLED=1
+                responses = app2.responses_from_probs(probs, [portion] * len(images), nutrition_mode=nutrition_mode)
+                lines += [{"path": name, **response} for name, response in zip(ok, responses)]
+            out.write("".join(json.dumps(line) + "\n" for line in lines))
+            out.flush()
+            done += len(lines)
+            errors += len(lines) - len(images)
+
+            now = time.perf_counter()
+            if now - last_report >= report_every_s or index == len(batches) - 1:
+                last_report = now
+                rate = done / (now - start)
+                eta = (len(names) - done) / rate if rate > 0 else 0.0
+                print(f"{done}/{len(names)} images, {rate:.1f} img/s, {errors} errors, eta {eta:.0f}s", flush=True)
+    return done, errors, time.perf_counter() - start
+
+
+def latest_records(jsonl_path):
+    """One record per path: the last line wins (--retry-errors appends after the old error line)."""
+    records = {}
+    with open(jsonl_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records.pop(record["path"], None)
+            records[record["path"]] = record
+    return list(records.values())
+
+
+def to_parquet(jsonl_path, parquet_path):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise SystemExit("--parquet needs pandas and pyarrow (pip install pandas pyarrow)")
+    frame = pd.DataFrame(latest_records(jsonl_path))
+    frame.to_parquet(parquet_path, index=False)
+    print(f"Wrote {len(frame)} rows to {parquet_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify every image in a directory with app2's models")
+    parser.add_argument("dir", nargs="?", default="uploads")
+    parser.add_argument("--out", default="predictions.jsonl")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of the model")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--portion", type=float, default=app2.get_dummy_portion_value())
+    parser.add_argument("--nutrition-mode", choices=("top1", "expected"), default=None)
+    parser.add_argument("--retry-errors", action="store_true", help="re-attempt images that failed before")
+    parser.add_argument("--parquet", help="also convert the finished JSONL to this Parquet file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    names = list_images(args.dir, args.recursive)
+    done = load_done(args.out, args.retry_errors)
+    todo = [n for n in names if n not in done]
+    print(f"{len(names)} images in {args.dir}, {len(names) - len(todo)} already in {args.out}, {len(todo)} to do")
+
+    if todo:
+        app2.WARMUP = False   # the first batch warms up well enough
+        app2.load_models()
+        with open(args.out, "a") as out:
+            try:
+                count, errors, seconds = run(args.dir, todo, out, args.batch_size, max(args.workers, 1),
+                                             max(args.prefetch, 0), args.portion, args.nutrition_mode)
+            except KeyboardInterrupt:
+                print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+                raise SystemExit(130)
+        print(f"Done: {count} images in {seconds:.1f}s ({count / seconds:.1f} img/s), {errors} errors")
+
+    if args.parquet:
+        to_parquet(args.out, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
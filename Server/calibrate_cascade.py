@@ -0,0 +1,128 @@
+# calibrate_cascade.py
+# Pick the cascade's thresholds (CASCADE_MIN_CONFIDENCE / CASCADE_MIN_MARGIN)
+# on a labelled folder so it reaches a target accuracy at the least compute.
+#
+#   python calibrate_cascade.py --dir labelled/
+#   python calibrate_cascade.py --dir labelled/ --target-accuracy 0.80 --size 112 --tta flip,zoom --json cascade.json
+#
+# A labelled folder is laid out as <class_name>/<image> (names from
+# classes.txt). Without labels the full model's own predictions are the
+# reference, so "accuracy" becomes agreement with always escalating.
+#
+# Every image goes through both stages once; each (min_confidence,
+# min_margin) pair on a grid is then scored offline. Compute is reported in
+# units of one full 224 px forward pass (stage 1 always runs; escalated
+# images add 1 + number of TTA views) and as measured ms per image on this
+# machine.
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+os.environ.setdefault("NGROK_ENABLED", "0")
+import app2
+import backends
+import cascade
+
+CONFIDENCES = [i / 100 for i in range(101)] + [1.01]   # 1.01 = always escalate
+MARGINS = [i / 50 for i in range(51)]
+
+
+def run_stage(fn, batches):
+    """(probs for every batch, ms per image) of one cascade stage."""
+    fn(batches[0])   # warm-up
+    start = time.perf_counter()
+    probs = torch.cat([fn(b) for b in batches])
+    return probs, (time.perf_counter() - start) * 1000.0 / len(probs)
+
+
+def pareto(results):
+    """Entries no other entry beats on both accuracy and compute, cheapest first.
+
+    Ties keep the entry cascade.pick would choose, so the recommendation is always one of these rows.
+    """
+    front, best = [], -1.0
+    for r in sorted(results, key=cascade.preference):
+        if r["accuracy"] > best:
+            front.append(r)
+            best = r["accuracy"]
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the cascade's confidence/margin thresholds")
+    parser.add_argument("--dir", default="uploads")
+    parser.add_argument("--size", type=int, default=app2.CASCADE_SIZE, help="stage-1 input size")
+    parser.add_argument("--tta", default=",".join(app2.CASCADE_TTA), help=f"full-pass views: {','.join(cascade.VIEWS)}")
+    parser.add_argument("--target-accuracy", type=float, default=None,
+                        help="default: the always-escalate accuracy minus --max-drop")
+    parser.add_argument("--max-drop", type=float, default=0.01)
+    parser.add_argument("--batch-size", type=int, default=app2.BATCH_MAX_SIZE)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    views = cascade.check_views([v.strip() for v in args.tta.split(",") if v.strip()])
+    items = backends.list_images(args.dir, app2.class_names)
+    if not items:
+        raise SystemExit(f"No images found in {args.dir}")
+    labelled = [label is not None for _, label in items]
+    if any(labelled):
+        items = [item for item, ok in zip(items, labelled) if ok]
+    else:
+        print(f"No labelled images in {args.dir}; using the full model's predictions as the reference.")
+
+    app2.WARMUP = False
+    app2.load_models()
+    batches = app2.load_image_batches([path for path, _ in items], args.batch_size)
+    cheap, cheap_ms = run_stage(lambda b: app2.cheap_probs(b, args.size), batches)
+    full, full_ms = run_stage(lambda b: app2.full_probs(b, views), batches)
+    labels = torch.tensor([label for _, label in items]) if any(labelled) else full.argmax(dim=1)
+
+    cheap_cost, full_cost = cascade.relative_cost(args.size, views=views)
+    full_accuracy = (full.argmax(dim=1) == labels).float().mean().item()
+    cheap_accuracy = (cheap.argmax(dim=1) == labels).float().mean().item()
+    target = args.target_accuracy if args.target_accuracy is not None else full_accuracy - args.max_drop
+    results = cascade.sweep(cheap, full, labels, CONFIDENCES, MARGINS)
+    chosen = cascade.pick(results, target, cheap_cost, full_cost)
+    for r in results:
+        r["ms_per_image"] = cheap_ms + r["escalation_rate"] * full_ms
+
+    print(f"\n{len(items)} images, stage 1 at {args.size}px ({cheap_cost:.2f} of a full pass, {cheap_ms:.2f} ms/img), "
+          f"full pass{' + ' + ','.join(views) if views else ''} ({full_cost:.0f} pass(es), {full_ms:.2f} ms/img)")
+    print(f"full model only:   accuracy {full_accuracy:.3f}, compute {full_cost:.2f}, {full_ms:.2f} ms/img")
+    print(f"stage 1 only:      accuracy {cheap_accuracy:.3f}, compute {cheap_cost:.2f}, {cheap_ms:.2f} ms/img")
+    # Up to 12 Pareto rows, centred on the recommended one (marked *)
+    front = pareto(results)
+    at = front.index(chosen) if chosen is not None else len(front)
+    first = max(0, min(at - 6, len(front) - 12))
+    print(f"\n  {'min conf':>8s} {'margin':>7s} {'acc':>6s} {'escalated':>9s} {'compute':>8s} {'ms/img':>7s}")
+    for r in front[first:first + 12]:
+        print(f"{'*' if r is chosen else ' '} {r['min_confidence']:8.2f} {r['min_margin']:7.2f} {r['accuracy']:6.3f} "
+              f"{r['escalation_rate']:9.1%} {r['compute']:8.2f} {r['ms_per_image']:7.2f}")
+
+    if chosen is None:
+        print(f"\nTarget accuracy {target:.3f} is out of reach (full model: {full_accuracy:.3f}).")
+    else:
+        print(f"\nTarget accuracy {target:.3f}: accuracy {chosen['accuracy']:.3f}, "
+              f"{chosen['escalation_rate']:.1%} escalated, average compute {chosen['compute']:.2f} of a full pass "
+              f"({chosen['ms_per_image']:.2f} vs {full_ms:.2f} ms/img)")
+        print(f"  CASCADE_ENABLED=1 CASCADE_SIZE={args.size} CASCADE_MIN_CONFIDENCE={chosen['min_confidence']} "
+              f"CASCADE_MIN_MARGIN={chosen['min_margin']}" + (f" CASCADE_TTA={','.join(views)}" if views else ""))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"dir": args.dir, "images": len(items), "labelled": any(labelled), "size": args.size,
+                       "tta": list(views), "target_accuracy": round(target, 4),
+                       "full_accuracy": round(full_accuracy, 4), "cheap_accuracy": round(cheap_accuracy, 4),
+                       "cheap_ms": round(cheap_ms, 3), "full_ms": round(full_ms, 3), "chosen": chosen,
+                       "pareto": front}, f, indent=2)
+
+    if chosen is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# calorie_table.py
+# Exact, torch-free evaluator for the calorie MLP.
+#
+# The calorie model is a stack of Linear/ReLU layers whose input is always
+# one_hot(class) || portion. With the class fixed, the network is a
+# continuous piecewise-linear function of the portion alone, so it can be
+# compiled once into per-class breakpoints plus a slope/intercept per segment.
+# Evaluating it is then a binary search and one multiply-add.
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def _layers_from_module(module):
+    """Return the module as a list of ("linear", W, b) / ("relu",) steps in float64."""
+    if not isinstance(module, nn.Sequential):
+        raise ValueError(f"Expected nn.Sequential of Linear/ReLU layers, got {type(module).__name__}")
+    layers = []
+    for layer in module:
+        if isinstance(layer, nn.Linear):
+            w = layer.weight.detach().cpu().double().numpy()
+            b = layer.bias.detach().cpu().double().numpy() if layer.bias is not None else np.zeros(w.shape[0])
+            layers.append(("linear", w, b))
+        elif isinstance(layer, nn.ReLU):
+            layers.append(("relu",))
+        else:
+            raise ValueError(f"Unsupported layer in calorie model: {type(layer).__name__}")
+    if not layers or layers[-1][0] != "linear" or layers[-1][1].shape[0] != 1:
+        raise ValueError("Calorie model must end with a Linear layer with a single output")
+    return layers
+
+
+def _probe_point(lo, hi):
+    # Any point strictly inside (lo, hi); intervals may be unbounded
+    if np.isfinite(lo) and np.isfinite(hi):
+        return 0.5 * (lo + hi)
+    if np.isfinite(lo):
+        return lo + 1.0
+    if np.isfinite(hi):
+        return hi - 1.0
+    return 0.0
+
+
+def _compile_class(layers, cls, num_classes):
+    # Each piece is (lo, hi, a, b): on lo < p < hi the current activations are a + b * p
+    in_dim = layers[0][1].shape[1]
+    a = np.zeros(in_dim)
+    a[cls] = 1.0
+    b = np.zeros(in_dim)
+    b[num_classes] = 1.0
+    pieces = [(-np.inf, np.inf, a, b)]
+
+    for step in layers:
+        if step[0] == "linear":
+            _, w, bias = step
+            pieces = [(lo, hi, w @ a + bias, w @ b) for lo, hi, a, b in pieces]
+            continue
+
+        split = []
+        for lo, hi, a, b in pieces:
+            # Units change sign where a + b * p == 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                roots = -a / b
+            roots = np.unique(roots[np.isfinite(roots) & (roots > lo) & (roots < hi)])
+            edges = np.concatenate(([lo], roots, [hi]))
+            for sub_lo, sub_hi in zip(edges[:-1], edges[1:]):
+                active = (a + b * _probe_point(sub_lo, sub_hi)) > 0
+                split.append((sub_lo, sub_hi, a * active, b * active))
+        pieces = split
+
+    # Merge neighbouring segments that ended up with the same affine function
+    bps, intercepts, slopes = [], [pieces[0][2][0]], [pieces[0][3][0]]
+    for lo, _, a, b in pieces[1:]:
+        if np.isclose(a[0], intercepts[-1], rtol=1e-12, atol=1e-12) and \
+                np.isclose(b[0], slopes[-1], rtol=1e-12, atol=1e-12):
+            continue
+        bps.append(lo)
+        intercepts.append(a[0])
+        slopes.append(b[0])
+    return np.array(bps), np.array(intercepts), np.array(slopes)
+
+
+class CalorieTable:
+    """Per-class breakpoints/slopes/intercepts compiled from the calorie MLP.
+
+    `breakpoints` is (num_classes, K) padded with +inf; segment i of a class
+    covers breakpoints[i-1] <= p < breakpoints[i] and evaluates to
+    intercepts[i] + slopes[i] * p.
+    """
+
+    def __init__(self, breakpoints, intercepts, slopes):
+        self.breakpoints = breakpoints
+        self.intercepts = intercepts
+        self.slopes = slopes
+        self.num_classes, self.max_breakpoints = breakpoints.shape
+
+    @classmethod
+    def compile(cls, module, num_classes):
+        layers = _layers_from_module(module)
+        if layers[0][1].shape[1] != num_classes + 1:
+            raise ValueError(f"Calorie model input dim {layers[0][1].shape[1]} != num_classes + 1 ({num_classes + 1})")
+        compiled = [_compile_class(layers, c, num_classes) for c in range(num_classes)]
+
+        k = max(len(bp) for bp, _, _ in compiled)
+        breakpoints = np.full((num_classes, k), np.inf)
+        intercepts = np.zeros((num_classes, k + 1))
+        slopes = np.zeros((num_classes, k + 1))
+        for c, (bp, icpt, slope) in enumerate(compiled):
+            n = len(bp)
+            breakpoints[c, :n] = bp
+            # Padding segments are never selected (their breakpoints are +inf)
+            intercepts[c, :n + 1] = icpt
+            intercepts[c, n + 1:] = icpt[-1]
+            slopes[c, :n + 1] = slope
+            slopes[c, n + 1:] = slope[-1]
+        return cls(breakpoints, intercepts, slopes)
+
+    def save(self, path):
+        np.savez(path, breakpoints=self.breakpoints, intercepts=self.intercepts, slopes=self.slopes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["breakpoints"], data["intercepts"], data["slopes"])
+
+    def segment_index(self, classes, portions):
+        """Vectorized binary search: number of breakpoints <= portion for each pair."""
+        k = self.max_breakpoints
+        idx = np.zeros(len(classes), dtype=np.int64)
+        if k == 0:
+            return idx
+        flat = self.breakpoints.ravel()
+        base = classes * k
+        step = 1 << (k.bit_length() - 1)
+        while step:
+            cand = idx + step
+            probe = flat[base + np.minimum(cand, k) - 1]
+            idx = np.where((cand <= k) & (probe <= portions), cand, idx)
+            step >>= 1
+        return idx
+
+    def evaluate(self, classes, portions):
+        """Calories for many (class, portion) pairs at once."""
+        classes = np.asarray(classes, dtype=np.int64).ravel()
+        portions = np.asarray(portions, dtype=np.float64).ravel()
+        seg = self.segment_index(classes, portions)
+        return self.intercepts[classes, seg] + self.slopes[classes, seg] * portions
+
+    def __call__(self, cls, portion):
+        return float(self.evaluate([cls], [portion])[0])
+
+    def verify(self, module, portions=None, atol=1e-2, rtol=1e-4):
+        """Compare the table with the original module over a sweep of portions.
+
+        Returns the max absolute error; raises ValueError if any value is
+        outside tolerance.
+        """
+        if portions is None:
+            portions = np.linspace(0.0, 1000.0, 2001)
+        portions = np.asarray(portions, dtype=np.float64)
+        classes = np.repeat(np.arange(self.num_classes), len(portions))
+        sweep = np.tile(portions, self.num_classes)
+
+        param = next(module.parameters())
+        x = torch.zeros(len(classes), self.num_classes + 1, dtype=param.dtype, device=param.device)
+        x[torch.arange(len(classes)), torch.from_numpy(classes)] = 1.0
+        x[:, self.num_classes] = torch.from_numpy(sweep).to(param.dtype)
+        with torch.no_grad():
+            expected = module(x).reshape(-1).double().cpu().numpy()
+
+        got = self.evaluate(classes, sweep)
+        err = np.abs(got - expected)
+        bad = err > atol + rtol * np.abs(expected)
+        if bad.any():
+            i = int(np.argmax(err))
+            raise ValueError(f"Calorie table mismatch: class {classes[i]} portion {sweep[i]}: "
+                             f"table {got[i]:.6f} vs model {expected[i]:.6f}")
+        return float(err.max())
@@ -0,0 +1,107 @@
+# cascade.py
+# Confidence-gated cascade for the food classifier.
+#
+# Stage 1 runs the classifier on a downscaled copy of the batch (ResNet-18
+# pools adaptively, so any input size works; 128 px is ~1/3 of the 224 px
+# FLOPs). Images whose stage-1 softmax is confident enough -- top-1
+# probability >= min_confidence AND top-1 minus top-2 >= min_margin -- are
+# answered from it. The rest go through the full 224 px pass, optionally
+# with test-time augmentation: extra views (flip, center zoom) stacked into
+# the same forward pass and their softmaxes averaged.
+#
+# Thresholds are picked per model on labelled images by calibrate_cascade.py.
+import torch
+import torch.nn.functional as F
+
+VIEWS = ("flip", "zoom")
+ZOOM = 0.8   # side of the center crop used by the "zoom" view
+
+
+def check_views(views):
+    unknown = [v for v in views if v not in VIEWS]
+    if unknown:
+        raise ValueError(f"Unknown TTA view(s) {', '.join(unknown)}; expected some of {', '.join(VIEWS)}")
+    return tuple(views)
+
+
+def downscale(batch, size):
+    """(n, 3, s, s) normalized batch resized to size x size (antialiased)."""
+    if batch.shape[-1] == size:
+        return batch
+    return F.interpolate(batch, size=(size, size), mode="bilinear", align_corners=False, antialias=True)
+
+
+def tta_views(batch, views=()):
+    """The batch followed by each augmented view of it, concatenated for one forward pass."""
+    out = [batch]
+    for view in check_views(views):
+        if view == "flip":
+            out.append(batch.flip(3))
+        else:
+            size = batch.shape[-1]
+            crop = round(size * ZOOM)
+            offset = (size - crop) // 2
+            out.append(F.interpolate(batch[..., offset:offset + crop, offset:offset + crop], size=(size, size),
+                                     mode="bilinear", align_corners=False))
+    return torch.cat(out) if len(out) > 1 else batch
+
+
+def average_views(probs, n):
+    """Mean softmax over the views of tta_views, back to (n, C)."""
+    return probs.reshape(-1, n, probs.shape[1]).mean(dim=0)
+
+
+def confident(probs, min_confidence, min_margin):
+    """Boolean mask of rows whose top-1 probability and top-1/top-2 margin both clear the thresholds."""
+    probs = torch.as_tensor(probs)
+    top = probs.topk(min(2, probs.shape[1]), dim=1).values
+    second = top[:, 1] if top.shape[1] > 1 else torch.zeros_like(top[:, 0])
+    return (top[:, 0] >= min_confidence) & (top[:, 0] - second >= min_margin)
+
+
+def relative_cost(size, full_size=224, views=()):
+    """(stage-1 cost, escalation cost) in units of one full-size forward pass (FLOPs scale with pixels)."""
+    return (size / full_size) ** 2, 1.0 + len(views)
+
+
+def sweep(cheap_probs, full_probs, labels, confidences, margins):
+    """Accuracy and escalation rate of the cascade for every (min_confidence, min_margin) pair.
+
+    `labels` are the reference classes (ground truth, or the full model's
+    predictions for unlabelled images). Returns a list of dicts.
+    """
+    cheap_probs, full_probs = torch.as_tensor(cheap_probs), torch.as_tensor(full_probs)
+    labels = torch.as_tensor(labels)
+    cheap_right = cheap_probs.argmax(dim=1) == labels
+    full_right = full_probs.argmax(dim=1) == labels
+    results = []
+    for min_confidence in confidences:
+        for min_margin in margins:
+            accept = confident(cheap_probs, min_confidence, min_margin)
+            right = torch.where(accept, cheap_right, full_right)
+            results.append({
+                "min_confidence": round(float(min_confidence), 4),
+                "min_margin": round(float(min_margin), 4),
+                "accuracy": right.float().mean().item(),
+                "escalation_rate": 1.0 - accept.float().mean().item(),
+            })
+    return results
+
+
+def preference(r):
+    """Sort key over scored sweep entries: cheapest, then most accurate, then the strictest thresholds.
+
+    Many threshold pairs score identically; pick() and the calibration
+    report both break ties with this key so they name the same pair.
+    """
+    return round(r["compute"], 6), -r["accuracy"], -r["min_confidence"], -r["min_margin"]
+
+
+def pick(results, target_accuracy, cheap_cost, full_cost):
+    """Cheapest sweep entry reaching target_accuracy (most accurate first on ties), or None."""
+    for r in results:
+        r["compute"] = cheap_cost + r["escalation_rate"] * full_cost
+    ok = [r for r in results if r["accuracy"] >= target_accuracy]
+    if not ok:
+        return None
+    return min(ok, key=preference)
@@ -0,0 +1,103 @@
+# conftest.py
+# Shared pytest fixtures: app.py wired to fakes.FakeUpstreams in a scratch
+# directory, and app2.py serving a tiny stub classifier.
+import glob
+import importlib
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from fakes import FakeUpstreams
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="session")
+def upstreams():
+    with FakeUpstreams() as fake:
+        yield fake
+
+
+@pytest.fixture(scope="session")
+def app_module(upstreams, tmp_path_factory):
+    """app.py imported once, talking to the fakes and writing only under a temp directory."""
+    scratch = tmp_path_factory.mktemp("app")
+    os.environ.update(
+        GROQ_BASE_URL=upstreams.url, CLARIFAI_API_URL=upstreams.url, GROQ_API_KEY="test", CLARIFAI_API_KEY="test",
+        PERSIST_UPLOADS="0", HISTORY_DB=str(scratch / "history.db"), HISTORY_BLOB_DIR=str(scratch / "blobs"),
+        EMBEDDING_INDEX=str(scratch / "embeddings" / "meals"), EMBEDDING_SERVICE_URL="",
+        UPSTREAM_RETRIES="1", UPSTREAM_BACKOFF_S="0.01", UPSTREAM_DEADLINE_S="10", BREAKER_FAILURES="1000",
+        HEDGE_BUDGET_S="0", LOCAL_MODEL_URL=upstreams.url,
+    )
+    cwd = os.getcwd()
+    os.chdir(scratch)   # app.py creates uploads/ in the working directory
+    try:
+        yield importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+
+
+class StubClassifier(nn.Module):
+    """Stand-in for FoodClassifier: per-channel means through one Linear layer (deterministic, fast)."""
+
+    def __init__(self, num_classes):
+        super().__init__()
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(3, num_classes)
+        with torch.no_grad():
+            generator = torch.Generator().manual_seed(0)
+            self.fc.weight.copy_(torch.randn(num_classes, 3, generator=generator) * 4)
+            self.fc.bias.copy_(torch.randn(num_classes, generator=generator))
+        self.eval()
+
+    def forward(self, x):
+        return self.fc(self.embed(x))
+
+    def embed(self, x):
+        return torch.flatten(self.pool(x), 1)
+
+
+@pytest.fixture(scope="session")
+def app2_module(tmp_path_factory):
+    """app2.py with the real calorie model and nutrition table but a StubClassifier, marked ready."""
+    scratch = tmp_path_factory.mktemp("app2")
+    os.environ.update(
+        CLASS_NAMES_PATH=os.path.join(SERVER_DIR, "classes.txt"),
+        CALORIE_STATE=os.path.join(SERVER_DIR, "calorie_model.pth"),
+        CLASSIFIER_STATE=str(scratch / "classifier.pth"), MODEL_CACHE_DIR=str(scratch / "model_cache"),
+        NGROK_ENABLED="0", LAZY_LOAD="1", WARMUP="0", BATCH_MAX_WAIT_MS="1",
+    )
+    app2 = importlib.import_module("app2")
+    app2.nutrition = app2.load_nutrition()
+    app2.calorie_model = app2.load_calorie_model()
+    app2.calorie_table = app2.compile_calorie_table(app2.calorie_model)
+    app2.classifier = app2.classifier_runner = StubClassifier(app2.NUM_CLASSES)
+    app2.lifecycle["state"] = "ready"
+    return app2
+
+
+@pytest.fixture
+def client2(app2_module):
+    """TestClient for app2 (no lifespan: no tunnel, and the executor isn't shut down between tests)."""
+    from fastapi.testclient import TestClient
+    return TestClient(app2_module.app)
+
+
+@pytest.fixture
+def client(app_module, upstreams):
+    """Flask test client with the fakes reset to fast, healthy defaults."""
+    upstreams.clarifai_latency_ms = upstreams.groq_latency_ms = upstreams.token_interval_ms = 0.0
+    upstreams.local_latency_ms = 0.0
+    upstreams.fail_next = {"clarifai": 0, "groq": 0, "local": 0}
+    upstreams.fail_status = 503
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def image_bytes():
+    """A sample photo made unique per call (trailing bytes, ignored by decoders) so caches don't answer."""
+    with open(sorted(glob.glob(os.path.join(SERVER_DIR, "uploads", "*.jp*g")))[0], "rb") as f:
+        data = f.read()
+    return lambda: data + os.urandom(16)
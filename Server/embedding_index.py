@@ -0,0 +1,177 @@
+# embedding_index.py
+# Append-only float16 embedding index over saved meals.
+#
+# Each saved meal's classifier embedding (ResNet-18 penultimate layer, 512-d,
+# served by app2's /embed) is L2-normalized and appended as one float16 row
+# to `<path>.f16`, with the meal id appended to `<path>.ids` (int64). Both
+# files are memory-mapped for search, so a 100k-meal index is ~100 MB of
+# pages the OS can share and evict rather than a Python list of vectors.
+#
+# Search is a brute-force cosine scan (one matrix-vector product per chunk
+# of rows), which at this size beats any approximate index on simplicity and
+# is still only a few milliseconds.
+#
+# Pooled ReLU features are all non-negative, so even unrelated photos score a
+# high cosine; a near-duplicate candidate is confirmed with a tiny grayscale
+# thumbnail comparison (fingerprint / same_picture) before it is trusted.
+#
+# Backfill embeddings for meals saved before the index existed:
+#   python embedding_index.py backfill --service http://localhost:7000
+import argparse
+import io
+import os
+import threading
+
+import numpy as np
+import requests
+from PIL import Image, ImageOps
+
+DEFAULT_DIM = 512
+SEARCH_CHUNK_ROWS = 65536   # rows converted to float32 at a time
+
+
+class EmbeddingIndex:
+    def __init__(self, path, dim=DEFAULT_DIM):
+        self.dim = int(dim)
+        self.vectors_path = path + ".f16"
+        self.ids_path = path + ".ids"
+        self._lock = threading.Lock()
+        self._vectors = None   # memmaps, reopened when the files grow
+        self._ids = None
+        self._known = set()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        for p in (self.vectors_path, self.ids_path):
+            open(p, "ab").close()
+        self._repair()
+        self._remap()
+        self._known = set(self._ids.tolist()) if self._ids is not None else set()
+
+    def __len__(self):
+        return 0 if self._ids is None else len(self._ids)
+
+    def __contains__(self, meal_id):
+        return int(meal_id) in self._known
+
+    def _repair(self):
+        # A crash between the two appends leaves one file a row ahead; drop the extra row
+        row_bytes = self.dim * 2
+        rows = min(os.path.getsize(self.vectors_path) // row_bytes, os.path.getsize(self.ids_path) // 8)
+        for p, size in ((self.vectors_path, rows * row_bytes), (self.ids_path, rows * 8)):
+            if os.path.getsize(p) != size:
+                os.truncate(p, size)
+
+    def _remap(self):
+        rows = os.path.getsize(self.ids_path) // 8
+        if rows == 0:
+            self._vectors = self._ids = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(rows, self.dim))
+        self._ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(rows,))
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add(self, meal_ids, vectors):
+        """Append embeddings for `meal_ids`; ids already in the index are skipped."""
+        meal_ids = np.atleast_1d(np.asarray(meal_ids, dtype=np.int64))
+        vectors = self.normalize(vectors)
+        if vectors.shape != (len(meal_ids), self.dim):
+            raise ValueError(f"Expected {len(meal_ids)} x {self.dim} embeddings, got {vectors.shape}")
+        with self._lock:
+            keep = np.array([int(i) not in self._known for i in meal_ids], dtype=bool)
+            if not keep.any():
+                return 0
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors[keep].astype(np.float16).tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(meal_ids[keep].tobytes())
+            self._known.update(meal_ids[keep].tolist())
+            self._remap()
+            return int(keep.sum())
+
+    def vector(self, meal_id):
+        """Stored (normalized) embedding of a meal, or None."""
+        with self._lock:
+            vectors, ids = self._vectors, self._ids
+        if ids is None or int(meal_id) not in self._known:
+            return None
+        row = int(np.flatnonzero(ids == int(meal_id))[0])
+        return vectors[row].astype(np.float32)
+
+    def search(self, query, k=5, exclude=()):
+        """[(meal_id, cosine similarity)] of the `k` nearest meals, best first."""
+        with self._lock:
+            vectors, ids = self._vectors, self._ids
+        if ids is None or k <= 0:
+            return []
+        q = self.normalize(query)[0]
+        scores = np.empty(len(ids), dtype=np.float32)
+        for start in range(0, len(ids), SEARCH_CHUNK_ROWS):
+            chunk = vectors[start:start + SEARCH_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32) @ q
+        if exclude:
+            scores[np.isin(ids, np.fromiter(exclude, dtype=np.int64))] = -np.inf
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def nearest(self, query):
+        """(meal_id, similarity) of the closest meal, or None if the index is empty."""
+        hits = self.search(query, k=1)
+        return hits[0] if hits else None
+
+
+def fingerprint(data, size=16):
+    """size x size grayscale thumbnail of an image, float32 in [0, 1]."""
+    image = Image.open(io.BytesIO(data))
+    image.draft("L", (size * 8, size * 8))
+    image = ImageOps.exif_transpose(image).convert("L").resize((size, size), Image.BILINEAR)
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def same_picture(a, b, tolerance=0.05):
+    """Whether two images are the same picture up to re-encoding/resizing (mean abs thumbnail difference)."""
+    return float(np.abs(fingerprint(a) - fingerprint(b)).mean()) <= tolerance
+
+
+def fetch_embedding(session, service_url, image_bytes, timeout=10.0):
+    """Embedding of one image from app2's /embed (service_url is app2's base URL)."""
+    r = session.post(service_url.rstrip("/") + "/embed", files={"file": ("image", image_bytes)}, timeout=timeout)
+    r.raise_for_status()
+    return np.asarray(r.json()["embedding"], dtype=np.float32)
+
+
+def backfill(store, index, service_url, batch=256):
+    """Embed every stored meal with an image that isn't indexed yet; returns the count added."""
+    session = requests.Session()
+    added = 0
+    for meal_id, image_name in store.meal_images(batch=batch):
+        if meal_id in index:
+            continue
+        with open(store.image_path(image_name), "rb") as f:
+            vector = fetch_embedding(session, service_url, f.read())
+        added += index.add([meal_id], [vector])
+    return added
+
+
+if __name__ == "__main__":
+    from history_store import HistoryStore
+
+    parser = argparse.ArgumentParser(description="Meal embedding index tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill = sub.add_parser("backfill", help="embed saved meals that are not indexed yet")
+    fill.add_argument("--service", default=os.getenv("EMBEDDING_SERVICE_URL", "http://localhost:7000"),
+                      help="base URL of app2 (serves /embed)")
+    fill.add_argument("--db", default=os.getenv("HISTORY_DB", "history.db"))
+    fill.add_argument("--blobs", default=os.getenv("HISTORY_BLOB_DIR", "history_blobs"))
+    fill.add_argument("--index", default=os.getenv("EMBEDDING_INDEX", "history_embeddings"))
+    args = parser.parse_args()
+
+    index = EmbeddingIndex(args.index)
+    added = backfill(HistoryStore(args.db, args.blobs), index, args.service)
+    print(f"Indexed {added} meals ({len(index)} total).")
@@ -0,0 +1,59 @@
+# executor.py
+# Bounded worker pool for blocking inference work (image decoding, torch
+# forward passes) so it never runs on the asyncio event loop.
+#
+# Admission is bounded: at most `max_queue` requests may be in flight at once.
+# Anything beyond that is rejected immediately with QueueFull so the server
+# can answer 503 + Retry-After instead of letting latency grow without bound.
+import asyncio
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class InferenceExecutor:
+    def __init__(self, max_workers=2, max_queue=64):
+        self.max_workers = max(int(max_workers), 1)
+        self.max_queue = max(int(max_queue), 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Reserve a request slot for the duration of the block, or raise QueueFull."""
+        with self._lock:
+            if self._in_flight >= self.max_queue:
+                raise QueueFull(f"{self._in_flight} requests already in flight")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def run(self, fn, *args, deadline=None):
+        """Run fn(*args) on the pool; skip it if `deadline` (monotonic) passed while queued."""
+        def task():
+            if deadline is not None and time.monotonic() > deadline:
+                raise DeadlineExceeded("request deadline passed before work started")
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, task)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,203 @@
+# fakes.py
+# Local stand-ins for the upstream APIs used by app.py, for tests and
+# benchmarks that must not hit (or pay for) the real services.
+#
+#   Clarifai: POST /v2/models/<model>/outputs
+#   Groq:     POST /openai/v1/chat/completions   (OpenAI-compatible, supports stream=true)
+#   local:    POST /predict                       (app2's classifier, for the hedge)
+#
+# Point app.py at it with CLARIFAI_API_URL=http://127.0.0.1:<port> and
+# GROQ_BASE_URL=http://127.0.0.1:<port> (the Groq SDK reads GROQ_BASE_URL), and LOCAL_MODEL_URL=http://127.0.0.1:<port>.
+#
+#   python fakes.py --port 8089 --clarifai-latency-ms 300 --groq-latency-ms 800
+#   python fakes.py --slow-fraction 0.05 --slow-latency-ms 5000    # 5% of calls stall for 5 s more
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = ("This looks like a plate of chicken biryani with raita, roughly 650 kcal. "
+                 "It is high in carbohydrates, so pair it with a salad and keep the rest of the day lighter. "
+                 "Drink water and add a protein-rich snack later if you are training.")
+DEFAULT_PREDICTION = {"food": "chicken_curry", "confidence": 0.81, "portion_used_g": 250.0, "calories": 400.0,
+                      "protein_g": 30.0, "carbs_g": 12.5, "fat_g": 25.0}
+DEFAULT_CONCEPTS = [{"name": "rice", "value": 0.91}, {"name": "chicken", "value": 0.84}, {"name": "curry", "value": 0.52}]
+
+
+class FakeUpstreams:
+    def __init__(self, host="127.0.0.1", port=0, clarifai_latency_ms=0.0, groq_latency_ms=0.0,
+                 token_interval_ms=0.0, reply=DEFAULT_REPLY, concepts=DEFAULT_CONCEPTS,
+                 slow_fraction=0.0, slow_latency_ms=0.0, seed=0, local_latency_ms=0.0,
+                 prediction=DEFAULT_PREDICTION):
+        self.clarifai_latency_ms = clarifai_latency_ms
+        self.groq_latency_ms = groq_latency_ms      # before the first token / full reply
+        self.local_latency_ms = local_latency_ms
+        self.token_interval_ms = token_interval_ms  # between streamed tokens
+        # Tail latency injection: this fraction of calls (either provider) takes slow_latency_ms longer
+        self.slow_fraction = slow_fraction
+        self.slow_latency_ms = slow_latency_ms
+        self._random = random.Random(seed)
+        self.reply = reply
+        self.concepts = concepts
+        self.prediction = prediction
+        # Failure injection: the next N calls to a provider answer with this HTTP status
+        self.fail_next = {"clarifai": 0, "groq": 0, "local": 0}
+        self.fail_status = 503
+        self.calls = {"clarifai": 0, "groq": 0, "local": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _delay(self, latency_ms):
+        with self._lock:
+            slow = self.slow_fraction and self._random.random() < self.slow_fraction
+        time.sleep((latency_ms + (self.slow_latency_ms if slow else 0.0)) / 1000.0)
+
+    def _should_fail(self, provider):
+        with self._lock:
+            self.calls[provider] += 1
+            if self.fail_next[provider] > 0:
+                self.fail_next[provider] -= 1
+                return True
+        return False
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # else small keep-alive requests stall on delayed ACKs
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if self.path.startswith("/v2/models/") and self.path.endswith("/outputs"):
+                    self._clarifai()
+                elif self.path == "/openai/v1/chat/completions":
+                    self._groq(json.loads(body or b"{}"))
+                elif self.path == "/predict":
+                    self._local()
+                else:
+                    self._json(404, {"error": f"no fake for {self.path}"})
+
+            def _clarifai(self):
+                fake._delay(fake.clarifai_latency_ms)
+                if fake._should_fail("clarifai"):
+                    self._json(fake.fail_status, {"status": {"code": 21300, "description": "injected failure"}})
+                    return
+                self._json(200, {
+                    "status": {"code": 10000, "description": "Ok"},
+                    "outputs": [{"data": {"concepts": fake.concepts}}],
+                })
+
+            def _local(self):
+                fake._delay(fake.local_latency_ms)
+                if fake._should_fail("local"):
+                    self._json(fake.fail_status, {"detail": "injected failure"})
+                    return
+                self._json(200, dict(fake.prediction))
+
+            def _groq(self, body):
+                fake._delay(fake.groq_latency_ms)
+                if fake._should_fail("groq"):
+                    self._json(fake.fail_status, {"error": {"message": "injected failure", "type": "server_error"}})
+                    return
+                completion_id = "chatcmpl-" + uuid.uuid4().hex
+                created = int(time.time())
+                model = body.get("model", "fake-model")
+                if not body.get("stream"):
+                    self._json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": fake.reply},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": len(fake.reply.split()),
+                                  "total_tokens": 10 + len(fake.reply.split())},
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                tokens = [w + " " for w in fake.reply.split(" ")]
+                tokens[-1] = tokens[-1].rstrip()
+                try:
+                    for i, token in enumerate(tokens):
+                        if i and fake.token_interval_ms:
+                            time.sleep(fake.token_interval_ms / 1000.0)
+                        delta = {"content": token}
+                        if i == 0:
+                            delta["role"] = "assistant"
+                        self._event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                    self._event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                 "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass   # the client closed the stream early
+
+            def _event(self, payload):
+                self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run fake Clarifai + Groq (+ local model) upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--clarifai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--groq-latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-interval-ms", type=float, default=0.0)
+    parser.add_argument("--local-latency-ms", type=float, default=0.0)
+    parser.add_argument("--slow-fraction", type=float, default=0.0)
+    parser.add_argument("--slow-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeUpstreams(args.host, args.port, args.clarifai_latency_ms, args.groq_latency_ms, args.token_interval_ms,
+                         slow_fraction=args.slow_fraction, slow_latency_ms=args.slow_latency_ms,
+                         local_latency_ms=args.local_latency_ms)
+    print(f"Fake upstreams on {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,357 @@
+# history_store.py
+# Meal history storage: a SQLite index plus a content-addressed blob
+# directory for images.
+#
+# Records used to be appended to history.json with the whole
+# data:image/...;base64 photo inlined, so every save rewrote the file and
+# every /api/history read shipped every image. Here each record is one
+# indexed row, and each distinct image is stored once under its SHA-256.
+#
+# Per-user daily and weekly rollups (calories, meal count, macro totals) are
+# updated in the same transaction as each save, so the dashboard summary
+# reads one row per bucket instead of scanning the history.
+#
+# One-shot migration of an existing history.json:
+#   python history_store.py migrate history.json
+# Rebuild the rollups from the meals table:
+#   python history_store.py rollups
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+DATA_URL_RE = re.compile(r"^data:(?P<mime>[\w/+.-]+);base64,(?P<data>.*)$", re.DOTALL)
+MIME_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+HISTORY_FIELDS = ("id", "user", "timestamp", "calories", "foods", "image_url", "thumbnail_url")
+DEFAULT_USER = "anonymous"
+BLOB_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)?$")
+ROLLUP_BUCKETS = ("day", "week")
+MACRO_FIELDS = ("protein_g", "carbs_g", "fat_g")
+SUMMARY_FIELDS = ("calories", "meals") + MACRO_FIELDS
+
+
+class BlobStore:
+    """Write-once files named by the SHA-256 of their content."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        if not BLOB_NAME_RE.match(name):
+            raise ValueError(f"Invalid blob name: {name!r}")
+        return os.path.join(self.root, name[:2], name)
+
+    def put(self, data, ext=""):
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = self.path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return name
+
+
+def bucket_start(timestamp, bucket):
+    """Start date (YYYY-MM-DD, UTC) of the day or ISO week (Monday) containing an ISO timestamp."""
+    when = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc)
+    day = when.date()
+    if bucket == "week":
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def _number(value):
+    try:
+        return float(value or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def decode_data_url(value):
+    """'data:image/jpeg;base64,...' -> (bytes, extension); None if not a data URL.
+
+    Raises ValueError if it is a data URL but the payload is not valid base64.
+    """
+    match = DATA_URL_RE.match(value or "")
+    if not match:
+        return None
+    try:
+        data = base64.b64decode("".join(match.group("data").split()), validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image data: {e}")
+    return data, MIME_EXTENSIONS.get(match.group("mime"), "")
+
+
+class HistoryStore:
+    def __init__(self, db_path="history.db", blob_dir="history_blobs"):
+        self.blobs = BlobStore(blob_dir)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                calories REAL,
+                foods TEXT,
+                image TEXT,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS meals_user_ts ON meals (user, timestamp, id);
+            CREATE INDEX IF NOT EXISTS meals_ts ON meals (timestamp, id);
+            CREATE TABLE IF NOT EXISTS rollups (
+                user TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                start TEXT NOT NULL,
+                calories REAL NOT NULL DEFAULT 0,
+                meals INTEGER NOT NULL DEFAULT 0,
+                protein_g REAL NOT NULL DEFAULT 0,
+                carbs_g REAL NOT NULL DEFAULT 0,
+                fat_g REAL NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user, bucket, start)
+            );
+        """)
+        self._db.commit()
+        removed = self._dedupe()
+        # Databases from before the rollups table get theirs built once
+        if removed or self._db.execute("SELECT 1 FROM rollups LIMIT 1").fetchone() is None:
+            self.rebuild_rollups()
+
+    def _dedupe(self):
+        """Enforce one meal per (user, timestamp, image), imageless meals included; returns duplicates removed.
+
+        The first version of the unique index was on the bare image column,
+        and SQLite treats NULLs as distinct, so re-running a migration could
+        store imageless meals twice. Those copies are dropped (keeping the
+        first) before the IFNULL index replaces it.
+        """
+        if self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'meals_unique'").fetchone():
+            return 0
+        removed = self._db.execute(
+            "DELETE FROM meals WHERE id NOT IN "
+            "(SELECT MIN(id) FROM meals GROUP BY user, timestamp, IFNULL(image, ''))").rowcount
+        self._db.execute("DROP INDEX IF EXISTS meals_dedup")
+        self._db.execute("CREATE UNIQUE INDEX meals_unique ON meals (user, timestamp, IFNULL(image, ''))")
+        self._db.commit()
+        return removed
+
+    def _add_to_rollups(self, meal_id, user, timestamp, calories, macros):
+        # `version` is the id of the last meal folded in, so it only grows (see summary)
+        try:
+            starts = [(bucket, bucket_start(timestamp, bucket)) for bucket in ROLLUP_BUCKETS]
+        except (TypeError, AttributeError, ValueError):
+            return   # not an ISO timestamp string; the meal is kept but not summarized
+        for bucket, start in starts:
+            self._db.execute(
+                "INSERT INTO rollups (user, bucket, start, calories, meals, protein_g, carbs_g, fat_g, version) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?) "
+                "ON CONFLICT (user, bucket, start) DO UPDATE SET calories = calories + excluded.calories, "
+                "meals = meals + 1, protein_g = protein_g + excluded.protein_g, "
+                "carbs_g = carbs_g + excluded.carbs_g, fat_g = fat_g + excluded.fat_g, version = excluded.version",
+                (user, bucket, start, _number(calories), *(_number(macros.get(f)) for f in MACRO_FIELDS), meal_id),
+            )
+
+    def rebuild_rollups(self):
+        """Recompute every rollup from the meals table; returns the number of meals folded in."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, user, timestamp, calories, extra FROM meals ORDER BY id").fetchall()
+            self._db.execute("DELETE FROM rollups")
+            for row in rows:
+                extra = json.loads(row["extra"]) if row["extra"] else {}
+                self._add_to_rollups(row["id"], row["user"], row["timestamp"], row["calories"], extra)
+            self._db.commit()
+        return len(rows)
+
+    def save(self, record, user=None):
+        """Store one meal record ({foods, calories, image, timestamp, ...}); returns its id.
+
+        Returns None if an identical record (same user, timestamp and image)
+        was already stored.
+        """
+        record = dict(record)
+        record_user = record.pop("user", None)
+        user = user or record_user or DEFAULT_USER
+        image_name = None
+        decoded = decode_data_url(record.pop("image", None))
+        if decoded is not None:
+            image_name = self.blobs.put(*decoded)
+        foods = record.pop("foods", [])
+        calories = record.pop("calories", None)
+        timestamp = record.pop("timestamp")
+
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO meals (user, timestamp, calories, foods, image, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                (user, timestamp, calories, json.dumps(foods), image_name, json.dumps(record) if record else None),
+            )
+            meal_id = cur.lastrowid if cur.rowcount else None
+            if meal_id is not None:
+                # Macros are optional top-level fields of the record (e.g. saved from /predict)
+                self._add_to_rollups(meal_id, user, timestamp, calories, record)
+            self._db.commit()
+            return meal_id
+
+    def history(self, user=None, since=None, until=None, after=None, limit=500, fields=HISTORY_FIELDS,
+                image_url_prefix="/api/history/images/"):
+        """Meals in (timestamp, id) order with only the requested fields.
+
+        `after` is the cursor returned for the previous page; returns
+        (rows, next_cursor), with next_cursor None on the last page.
+        """
+        where, params = [], []
+        if user is not None:
+            where.append("user = ?")
+            params.append(user)
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        if after:
+            ts, _, last_id = after.rpartition(",")
+            try:
+                last_id = int(last_id)
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {after!r}")
+            where.append("(timestamp, id) > (?, ?)")
+            params.extend([ts, last_id])
+        sql = "SELECT id, user, timestamp, calories, foods, image FROM meals"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp, id LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['timestamp']},{rows[-1]['id']}"
+
+        return [_format_row(row, fields, image_url_prefix) for row in rows], next_cursor
+
+    def summary(self, user=None, since=None, until=None, bucket="day"):
+        """Rollup rows ({start, calories, meals, protein_g, carbs_g, fat_g}) for buckets starting
+        in [since, until) (dates or timestamps), plus a version that changes whenever any of them does.
+
+        Without `user` the buckets are summed over all users.
+        """
+        if bucket not in ROLLUP_BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(ROLLUP_BUCKETS)}")
+        where, params = ["bucket = ?"], [bucket]
+        if user is not None:
+            where.append("user = ?")
+            params.append(user)
+        if since:
+            where.append("start >= ?")
+            params.append(bucket_start(since, bucket))
+        if until:
+            where.append("start < ?")
+            params.append(bucket_start(until, "day"))
+        sums = ", ".join(f"SUM({f}) AS {f}" for f in SUMMARY_FIELDS)
+        sql = (f"SELECT start, {sums}, MAX(version) AS version FROM rollups WHERE {' AND '.join(where)} "
+               f"GROUP BY start ORDER BY start")
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        version = max((row["version"] for row in rows), default=0)
+        out = [{"start": row["start"], "calories": round(row["calories"], 2), "meals": row["meals"],
+                **{f: round(row[f], 2) for f in MACRO_FIELDS}} for row in rows]
+        return out, version
+
+    def meals(self, ids, fields=HISTORY_FIELDS, image_url_prefix="/api/history/images/"):
+        """{id: meal} for the given ids (missing ids are left out); 'extra' holds any other saved fields."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        sql = (f"SELECT id, user, timestamp, calories, foods, image, extra FROM meals "
+               f"WHERE id IN ({','.join('?' * len(ids))})")
+        with self._lock:
+            rows = self._db.execute(sql, ids).fetchall()
+        return {row["id"]: _format_row(row, fields, image_url_prefix) for row in rows}
+
+    def meal_images(self, batch=256):
+        """(id, image blob name) of every meal with an image, in id order."""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT id, image FROM meals WHERE image IS NOT NULL AND id > ? "
+                                        "ORDER BY id LIMIT ?", (last, batch)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["id"], row["image"]
+            last = rows[-1]["id"]
+
+    def image_path(self, name):
+        return self.blobs.path(name)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _format_row(row, fields, image_url_prefix):
+    item = {}
+    for field in fields:
+        if field == "foods":
+            item["foods"] = json.loads(row["foods"]) if row["foods"] else []
+        elif field == "image_url":
+            item["image_url"] = image_url_prefix + row["image"] if row["image"] else None
+        elif field == "thumbnail_url":
+            item["thumbnail_url"] = image_url_prefix + row["image"] + "?size=thumb" if row["image"] else None
+        elif field == "extra":
+            item["extra"] = json.loads(row["extra"]) if row["extra"] else {}
+        else:
+            item[field] = row[field]
+    return item
+
+
+def migrate_json(json_path, store):
+    """Import every record of a legacy history.json; returns (imported, skipped)."""
+    with open(json_path, "r") as f:
+        records = json.load(f)
+    imported = skipped = 0
+    for record in records:
+        if store.save(record) is None:
+            skipped += 1
+        else:
+            imported += 1
+    return imported, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Meal history store tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="import a legacy history.json")
+    migrate.add_argument("json_path", nargs="?", default="history.json")
+    migrate.add_argument("--db", default=os.getenv("HISTORY_DB", "history.db"))
+    migrate.add_argument("--blobs", default=os.getenv("HISTORY_BLOB_DIR", "history_blobs"))
+    rollups = sub.add_parser("rollups", help="rebuild the daily/weekly rollups from the meals table")
+    rollups.add_argument("--db", default=os.getenv("HISTORY_DB", "history.db"))
+    rollups.add_argument("--blobs", default=os.getenv("HISTORY_BLOB_DIR", "history_blobs"))
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db, args.blobs)
+    if args.command == "migrate":
+        imported, skipped = migrate_json(args.json_path, store)
+        print(f"Imported {imported} records from {args.json_path} ({skipped} already present).")
+    else:
+        print(f"Rebuilt rollups from {store.rebuild_rollups()} meals.")
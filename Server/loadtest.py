@@ -0,0 +1,316 @@
+# loadtest.py
+# Reproducible load tests for both servers, with no real upstreams involved.
+#
+#   * app2.py (FastAPI, /predict) is served in-process by uvicorn,
+#   * app.py (Flask, /api/analyze) is served in-process by werkzeug,
+#   * Clarifai and Groq are replaced by fakes.FakeUpstreams with configurable latency,
+#   * ngrok is disabled and nothing is written to uploads/ or history.db.
+#
+#   python loadtest.py --targets predict,analyze --concurrency 16 --requests 400
+#   python loadtest.py --targets analyze --groq-latency-ms 800 --json run.json
+#   python loadtest.py --json new.json --baseline run.json --max-regression 0.15
+#   python loadtest.py --targets analyze --slow-fraction 0.05 --slow-latency-ms 5000 --hedge-budget-ms 1500
+#
+# Every request carries a distinct image (random bytes appended after the end
+# of the file, which decoders ignore) so the prediction caches don't turn the
+# run into a cache benchmark; pass --allow-cache-hits to measure warm caches.
+# Results (throughput, p50/p95/p99 latency, status codes) are printed and can
+# be saved as JSON; with --baseline the script exits non-zero when throughput
+# or p95 latency regressed by more than --max-regression.
+#
+# --slow-fraction/--slow-latency-ms make a fraction of upstream calls stall;
+# --hedge-budget-ms turns on app.py's local-model hedge (HEDGE_BUDGET_S) with
+# the in-process app2 as the local model, to compare tail latency with and
+# without it.
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+from fakes import FakeUpstreams
+
+TARGETS = ("predict", "analyze")
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def synthetic_images(count, size, seed=0):
+    """Smooth random-colour JPEGs (noise would compress unrealistically badly)."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images = []
+    for i in range(count):
+        small = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((width, height), Image.BICUBIC)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=85)
+        images.append((f"synthetic_{i}.jpg", out.getvalue()))
+    return images
+
+
+def sample_images(folder):
+    images = []
+    for path in sorted(glob.glob(os.path.join(folder, "*"))):
+        if path.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(path, "rb") as f:
+                images.append((os.path.basename(path), f.read()))
+    return images
+
+
+# ------------------------------
+# In-process servers
+# ------------------------------
+def wait_ready(url, timeout_s=300):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} not ready after {timeout_s}s")
+
+
+def start_app2(port):
+    import uvicorn
+    import app2
+
+    config = uvicorn.Config(app2.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    base = f"http://127.0.0.1:{port}"
+    wait_ready(base + "/readyz")
+    return base, server
+
+
+def start_flask_app(port):
+    import logging
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)   # no per-request access log
+    server = make_server("127.0.0.1", port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}", server
+
+
+# ------------------------------
+# Load generation
+# ------------------------------
+def run_load(send, images, concurrency, total, duration_s, unique):
+    """Closed loop: `concurrency` workers each send a request as soon as the last returns."""
+    local = threading.local()
+    lock = threading.Lock()
+    counter = {"issued": 0}
+    latencies, statuses = [], Counter()
+    deadline = time.monotonic() + duration_s if duration_s else None
+
+    def next_index():
+        with lock:
+            if (total and counter["issued"] >= total) or (deadline and time.monotonic() >= deadline):
+                return None
+            counter["issued"] += 1
+            return counter["issued"] - 1
+
+    def worker():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        while True:
+            i = next_index()
+            if i is None:
+                return
+            name, data = images[i % len(images)]
+            if unique:
+                data = data + os.urandom(16)
+            start = time.perf_counter()
+            try:
+                status = send(local.session, name, data)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with lock:
+                statuses[str(status)] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(worker) for _ in range(concurrency)]:
+            f.result()
+    wall_s = time.perf_counter() - start
+
+    latencies.sort()
+    ok = statuses.get("200", 0)
+    return {
+        "requests": sum(statuses.values()),
+        "ok": ok,
+        "statuses": dict(statuses),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(ok / wall_s, 2) if wall_s else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            **{f"p{q}": None if not latencies else round(percentile(latencies, q), 2) for q in (50, 95, 99)},
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+
+def predict_sender(base):
+    def send(session, name, data):
+        return session.post(f"{base}/predict", files={"file": (name, data)}, timeout=120).status_code
+    return send
+
+
+def analyze_sender(base):
+    def send(session, name, data):
+        return session.post(f"{base}/api/analyze", files={"image": (name, data)},
+                            data={"message": "How many calories is this?"}, timeout=120).status_code
+    return send
+
+
+def compare(results, baseline, max_regression):
+    """Regressions of `results` against a previous run's JSON; returns a list of messages."""
+    problems = []
+    for target, current in results.items():
+        before = baseline.get("results", {}).get(target)
+        if not before:
+            continue
+        if before["throughput_rps"] and current["throughput_rps"] < before["throughput_rps"] * (1 - max_regression):
+            problems.append(f"{target}: throughput {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+        p95_before, p95_now = before["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if p95_before and p95_now and p95_now > p95_before * (1 + max_regression):
+            problems.append(f"{target}: p95 {p95_before} -> {p95_now} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /predict and /api/analyze against fake upstreams")
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="per target (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds per target")
+    parser.add_argument("--images", choices=("samples", "synthetic", "both"), default="both")
+    parser.add_argument("--dir", default="uploads", help="sample images")
+    parser.add_argument("--synthetic-count", type=int, default=16)
+    parser.add_argument("--synthetic-size", default="1280x960")
+    parser.add_argument("--allow-cache-hits", action="store_true")
+    parser.add_argument("--clarifai-latency-ms", type=float, default=300.0)
+    parser.add_argument("--groq-latency-ms", type=float, default=700.0)
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="fraction of upstream calls that stall")
+    parser.add_argument("--slow-latency-ms", type=float, default=0.0, help="extra latency of a stalled call")
+    parser.add_argument("--hedge-budget-ms", type=float, default=0.0,
+                        help="answer /api/analyze from the local model after this long (0 = off)")
+    parser.add_argument("--predict-url", help="use a running app2 server instead of starting one")
+    parser.add_argument("--analyze-url", help="use a running app.py server instead of starting one")
+    parser.add_argument("--port", type=int, default=18700, help="first local port for in-process servers")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    for t in targets:
+        if t not in TARGETS:
+            raise SystemExit(f"Unknown target {t!r}; expected one of {', '.join(TARGETS)}")
+
+    images = []
+    if args.images in ("samples", "both"):
+        images += sample_images(args.dir)
+    if args.images in ("synthetic", "both"):
+        width, height = (int(v) for v in args.synthetic_size.lower().split("x"))
+        images += synthetic_images(args.synthetic_count, (width, height))
+    if not images:
+        raise SystemExit("No images to send")
+
+    fake = FakeUpstreams(clarifai_latency_ms=args.clarifai_latency_ms, groq_latency_ms=args.groq_latency_ms,
+                         slow_fraction=args.slow_fraction, slow_latency_ms=args.slow_latency_ms).start()
+    scratch = tempfile.mkdtemp(prefix="loadtest-")
+    # Must be set before app / app2 are imported
+    os.environ.update(
+        NGROK_ENABLED="0",
+        CLARIFAI_API_URL=fake.url,
+        GROQ_BASE_URL=fake.url,
+        PERSIST_UPLOADS="0",
+        HISTORY_DB=os.path.join(scratch, "history.db"),
+        HISTORY_BLOB_DIR=os.path.join(scratch, "history_blobs"),
+    )
+    os.environ.pop("CACHE_DIR", None)
+    os.environ.setdefault("GROQ_API_KEY", "loadtest")
+    os.environ.setdefault("CLARIFAI_API_KEY", "loadtest")
+
+    senders = {}
+    predict_base = None
+    if "predict" in targets or ("analyze" in targets and args.hedge_budget_ms > 0):
+        predict_base = args.predict_url or start_app2(args.port)[0]
+    if "predict" in targets:
+        senders["predict"] = predict_sender(predict_base)
+    if "analyze" in targets:
+        if args.hedge_budget_ms > 0:
+            os.environ.update(HEDGE_BUDGET_S=str(args.hedge_budget_ms / 1000.0), LOCAL_MODEL_URL=predict_base)
+        base = args.analyze_url or start_flask_app(args.port + 1)[0]
+        senders["analyze"] = analyze_sender(base)
+
+    results = {}
+    for target in targets:
+        print(f"{target}: {args.concurrency} concurrent, "
+              + (f"{args.duration:g}s" if args.duration else f"{args.requests} requests") + " ...")
+        run_load(senders[target], images[:2], 1, 2, 0, True)   # warm-up
+        results[target] = run_load(senders[target], images, args.concurrency,
+                                   0 if args.duration else args.requests, args.duration,
+                                   not args.allow_cache_hits)
+    fake.stop()
+
+    print(f"\n{'target':10s} {'ok/total':>10s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for target, r in results.items():
+        lat = r["latency_ms"]
+        fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9s}"
+        print(f"{target:10s} {str(r['ok']) + '/' + str(r['requests']):>10s} {r['throughput_rps']:8.2f} "
+              f"{fmt(lat['p50'])} {fmt(lat['p95'])} {fmt(lat['p99'])} {fmt(lat['max'])}")
+        errors = {k: v for k, v in r["statuses"].items() if k != "200"}
+        if errors:
+            print(f"{'':10s} non-200: {errors}")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "images": len(images),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        for p in problems:
+            print("REGRESSION", p)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
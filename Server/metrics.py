@@ -0,0 +1,213 @@
+# metrics.py
+# Minimal in-process metrics for both servers: counters, gauges and
+# histograms rendered in the Prometheus text format for a /metrics endpoint,
+# plus per-request stage timings for the Server-Timing response header.
+#
+# Dependency-free on purpose (prometheus_client isn't in requirements.txt) and
+# small enough to keep on the hot path: one lock per metric, no allocation
+# beyond the first observation of a label set.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond table lookups up to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # fn() -> value, or {label values tuple: value}; read at scrape time
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        if self.fn is not None:
+            value = self.fn()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in sorted(items):
+            yield self.name + _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{series} {_format_value(value)}" for series, value in self._samples()]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Increment for the duration of the block (in-flight counts)."""
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.dec(1, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts + the +Inf bucket, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), fn=None):
+        return self._add(Counter(name, help_text, labelnames, fn))
+
+    def gauge(self, name, help_text, labelnames=(), fn=None):
+        return self._add(Gauge(name, help_text, labelnames, fn))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Timings:
+    """Stage durations of one request, also observed into a `stage` histogram.
+
+    Thread-safe, so stages may be timed from worker threads.
+    """
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.start = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, observe=True):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+        if observe and self.histogram is not None:
+            self.histogram.observe(seconds, stage=stage)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._stages)
+
+    def timed(self, name, fn, *args, **kwargs):
+        """fn(*args, **kwargs) timed as stage `name` (handy for executor.submit)."""
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    def header(self):
+        """Server-Timing header value, e.g. 'decode;dur=3.1, forward;dur=22.4, total;dur=27.0'."""
+        with self._lock:
+            parts = [f"{name};dur={seconds * 1000.0:.1f}" for name, seconds in self._stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000.0:.1f}")
+        return ", ".join(parts)
+
+
+def cache_lookup_counts(cache):
+    """Callback for a `result`-labelled counter fed from PredictionCache.stats()."""
+    def read():
+        stats = cache.stats()
+        return {("memory_hit",): stats["hits"] - stats["disk_hits"], ("disk_hit",): stats["disk_hits"],
+                ("miss",): stats["misses"]}
+    return read
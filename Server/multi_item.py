@@ -0,0 +1,144 @@
+# multi_item.py
+# Multi-item meal detection for /predict/items.
+#
+# The classifier only knows "one dish per image", so plates with several
+# items are handled by classifying overlapping crops at a few scales (the
+# whole image plus grids of smaller tiles) in ONE batched forward pass, then
+# merging crops that agree on a class into one item per dish.
+#
+# Cost: the image is decoded once, at just the resolution the smallest tile
+# needs, and every crop is cut and resized straight from that decode
+# (Image.resize with box=), so the per-crop overhead is a small resample
+# plus its share of the batched forward pass.
+import math
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from preprocess import open_image
+
+
+def crop_boxes(scales=(1.0, 0.6), overlap=0.25):
+    """Normalized (x0, y0, x1, y1) boxes: for each scale s, a grid of s x s
+    tiles covering the image with at least `overlap` between neighbours.
+
+    Returns (boxes, levels) where levels[i] is the index of the box's scale.
+    """
+    boxes, levels = [], []
+    for level, s in enumerate(scales):
+        if s >= 1.0:
+            positions = [0.0]
+        else:
+            n = math.ceil((1.0 - s) / (s * (1.0 - overlap))) + 1
+            positions = [i * (1.0 - s) / (n - 1) for i in range(n)]
+        for y in positions:
+            for x in positions:
+                boxes.append((x, y, min(x + s, 1.0), min(y + s, 1.0)))
+                levels.append(level)
+    return np.array(boxes, dtype=np.float64), np.array(levels, dtype=np.int64)
+
+
+class MultiCropper:
+    def __init__(self, size=224, scales=(1.0, 0.6), overlap=0.25, max_pixels=None, oversize="downscale"):
+        self.size = int(size)
+        self.scales = tuple(sorted(scales, reverse=True))
+        self.boxes, self.levels = crop_boxes(self.scales, overlap)
+        self.max_pixels = max_pixels
+        self.oversize = oversize
+        # The smallest tile must still have `size` pixels across
+        self.decode_size = int(math.ceil(self.size / min(self.scales)))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __call__(self, data):
+        """Decode `data` once and return one size x size RGB PIL image per box."""
+        image = open_image(data, (self.decode_size, self.decode_size), self.max_pixels, self.oversize).convert("RGB")
+        width, height = image.size
+        scale = np.array([width, height, width, height], dtype=np.float64)
+        return [image.resize((self.size, self.size), Image.BILINEAR, box=tuple(box * scale))
+                for box in self.boxes]
+
+
+@dataclass
+class Item:
+    class_idx: int
+    confidence: float
+    box: tuple          # normalized (x0, y0, x1, y1)
+    probs: np.ndarray   # softmax of the most confident crop for this item
+    crops: int          # crops merged into this item
+    share: float        # fraction of the plate attributed to this item
+
+
+def _overlap(a, b):
+    """max(IoU, intersection / smaller area) of two boxes."""
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return max(inter / (area_a + area_b - inter), inter / min(area_a, area_b))
+
+
+def _absorb(item, other, merge_overlap):
+    """Merge `other` into `item` (the more confident one) if same class and overlapping."""
+    if item.class_idx != other.class_idx or _overlap(item.box, other.box) <= merge_overlap:
+        return False
+    item.crops += other.crops
+    item.box = (min(item.box[0], other.box[0]), min(item.box[1], other.box[1]),
+                max(item.box[2], other.box[2]), max(item.box[3], other.box[3]))
+    return True
+
+
+def merge_detections(boxes, levels, probs, min_confidence=0.3, merge_overlap=0.0, max_items=5):
+    """Merge per-crop predictions into items.
+
+    Crops whose top class has probability >= min_confidence are detections.
+    Going from most to least confident, a detection that overlaps an
+    already-kept item of the same class by more than `merge_overlap` joins
+    it; the default merges any same-class crops that touch, since one dish
+    usually spans several neighbouring tiles. If nothing is confident enough, the whole-image crop's top-1 is the
+    only item, so the result is never worse than plain /predict.
+
+    Each item's `share` of the plate is its probability mass over the finest
+    tiles, a rough proxy for how much of the plate it covers.
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    top = probs.argmax(axis=1)
+    conf = probs[np.arange(len(probs)), top]
+
+    items = []
+    for i in np.argsort(-conf, kind="stable"):
+        if conf[i] < min_confidence:
+            break
+        candidate = Item(int(top[i]), float(conf[i]), tuple(map(float, boxes[i])), probs[i], 1, 0.0)
+        for item in items:
+            if _absorb(item, candidate, merge_overlap):
+                break
+        else:
+            items.append(candidate)
+    # A grown box can now overlap an item it missed earlier; merge to a fixed point
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(items)):
+            for b in range(a + 1, len(items)):
+                if _absorb(items[a], items[b], merge_overlap):
+                    del items[b]
+                    merged = True
+                    break
+            if merged:
+                break
+    items = items[:max_items]
+    if not items:
+        whole = int(np.argmax(levels == levels.min()))
+        items.append(Item(int(top[whole]), float(conf[whole]), tuple(map(float, boxes[whole])), probs[whole], 1, 1.0))
+        return items
+
+    finest = probs[levels == levels.max()]
+    mass = np.array([finest[:, item.class_idx].sum() for item in items])
+    shares = mass / mass.sum() if mass.sum() > 0 else np.full(len(items), 1.0 / len(items))
+    for item, share in zip(items, shares):
+        item.share = float(share)
+    return items
@@ -0,0 +1,216 @@
+# nutrition.py
+# Per-class nutrition facts as NumPy arrays aligned with the classifier's
+# output indices, so /predict scales macros for a whole batch in one
+# vectorized call instead of a dict lookup + scalar math per response.
+#
+# FOOD_NUTRITION is the source data, per 100 g:
+#   (kcal, protein_g, carbs_g, fat_g, glycemic_index)
+# NutritionTable validates it against classes.txt when it is built.
+import numpy as np
+
+FIELDS = ("kcal", "protein_g", "carbs_g", "fat_g", "glycemic_index")
+# Atwater energy (4 kcal/g protein and carbs, 9 kcal/g fat) may differ from
+# the stated kcal by this fraction before an entry is reported
+ENERGY_TOLERANCE = 0.25
+
+FOOD_NUTRITION = {
+    "apple_pie": (237, 2.1, 35.0, 12.0, 65),
+    "baby_back_ribs": (302, 28.0, 0.0, 20.0, 0),
+    "baklava": (420, 4.0, 45.0, 18.0, 75),
+    "beef_carpaccio": (175, 30.0, 0.0, 5.0, 0),
+    "beef_tartare": (189, 27.0, 0.0, 10.0, 0),
+    "beet_salad": (107, 3.5, 15.0, 5.0, 42),
+    "beignets": (300, 3.0, 35.0, 16.0, 70),
+    "bibimbap": (294, 15.0, 42.0, 8.0, 60),
+    "bread_pudding": (307, 10.0, 45.0, 10.0, 64),
+    "breakfast_burrito": (400, 20.0, 35.0, 20.0, 55),
+    "bruschetta": (220, 5.0, 25.0, 12.0, 60),
+    "caesar_salad": (400, 10.0, 5.0, 35.0, 15),
+    "cannoli": (450, 7.0, 40.0, 28.0, 70),
+    "caprese_salad": (200, 10.0, 5.0, 15.0, 15),
+    "carrot_cake": (350, 4.0, 45.0, 18.0, 65),
+    "ceviche": (120, 20.0, 5.0, 2.0, 20),
+    "cheese_plate": (500, 25.0, 10.0, 40.0, 20),
+    "cheesecake": (320, 8.0, 30.0, 18.0, 55),
+    "chicken_curry": (250, 25.0, 15.0, 10.0, 50),
+    "chicken_quesadilla": (270, 14.0, 22.0, 14.0, 55),
+    "chicken_wings": (200, 20.0, 5.0, 12.0, 0),
+    "chocolate_cake": (380, 5.0, 50.0, 20.0, 68),
+    "chocolate_mousse": (250, 5.0, 25.0, 15.0, 50),
+    "churros": (300, 4.0, 40.0, 15.0, 80),
+    "clam_chowder": (280, 15.0, 25.0, 12.0, 60),
+    "club_sandwich": (500, 30.0, 40.0, 25.0, 60),
+    "crab_cakes": (250, 15.0, 20.0, 12.0, 55),
+    "creme_brulee": (350, 5.0, 30.0, 25.0, 60),
+    "croque_madame": (450, 25.0, 35.0, 25.0, 65),
+    "cup_cakes": (250, 3.0, 35.0, 12.0, 70),
+    "deviled_eggs": (150, 10.0, 1.0, 12.0, 0),
+    "donuts": (250, 3.0, 30.0, 15.0, 75),
+    "dumplings": (200, 8.0, 25.0, 8.0, 55),
+    "edamame": (120, 11.0, 9.0, 5.0, 15),
+    "eggs_benedict": (350, 15.0, 25.0, 20.0, 60),
+    "escargots": (100, 15.0, 1.0, 5.0, 0),
+    "falafel": (333, 13.0, 32.0, 18.0, 60),
+    "filet_mignon": (200, 28.0, 0.0, 10.0, 0),
+    "fish_and_chips": (500, 25.0, 50.0, 25.0, 70),
+    "foie_gras": (462, 5.0, 2.0, 50.0, 0),
+    "french_fries": (312, 3.0, 41.0, 15.0, 75),
+    "french_onion_soup": (200, 10.0, 15.0, 10.0, 30),
+    "french_toast": (250, 8.0, 35.0, 10.0, 70),
+    "fried_calamari": (300, 15.0, 20.0, 15.0, 55),
+    "fried_rice": (250, 10.0, 40.0, 5.0, 60),
+    "frozen_yogurt": (150, 5.0, 25.0, 3.0, 45),
+    "garlic_bread": (350, 8.0, 40.0, 18.0, 68),
+    "gnocchi": (250, 5.0, 45.0, 5.0, 65),
+    "greek_salad": (150, 5.0, 10.0, 10.0, 15),
+    "grilled_cheese_sandwich": (400, 20.0, 30.0, 25.0, 60),
+    "grilled_salmon": (200, 25.0, 0.0, 12.0, 0),
+    "guacamole": (150, 2.0, 8.0, 12.0, 15),
+    "gyoza": (200, 8.0, 25.0, 8.0, 55),
+    "hamburger": (500, 25.0, 35.0, 30.0, 65),
+    "hot_and_sour_soup": (100, 5.0, 15.0, 2.0, 35),
+    "hot_dog": (300, 10.0, 25.0, 20.0, 70),
+    "huevos_rancheros": (300, 15.0, 25.0, 15.0, 55),
+    "hummus": (166, 8.0, 15.0, 10.0, 25),
+    "ice_cream": (250, 4.0, 30.0, 15.0, 60),
+    "lasagna": (350, 20.0, 30.0, 18.0, 55),
+    "lobster_bisque": (200, 10.0, 15.0, 10.0, 30),
+    "lobster_roll_sandwich": (450, 20.0, 30.0, 25.0, 60),
+    "macaroni_and_cheese": (350, 15.0, 35.0, 15.0, 65),
+    "macarons": (400, 7.0, 57.0, 17.0, 65),
+    "miso_soup": (50, 3.0, 5.0, 2.0, 20),
+    "mussels": (100, 15.0, 5.0, 2.0, 25),
+    "nachos": (450, 15.0, 40.0, 25.0, 65),
+    "omelette": (155, 11.0, 1.0, 12.0, 0),
+    "onion_rings": (400, 4.0, 40.0, 25.0, 70),
+    "oysters": (50, 5.0, 5.0, 1.0, 15),
+    "pad_thai": (400, 15.0, 50.0, 15.0, 65),
+    "paella": (350, 20.0, 40.0, 10.0, 60),
+    "pancakes": (200, 5.0, 30.0, 8.0, 60),
+    "panna_cotta": (300, 5.0, 20.0, 20.0, 55),
+    "peking_duck": (400, 30.0, 10.0, 25.0, 20),
+    "pho": (250, 20.0, 30.0, 5.0, 50),
+    "pizza": (250, 10.0, 30.0, 10.0, 60),
+    "pork_chop": (250, 25.0, 0.0, 15.0, 0),
+    "poutine": (450, 10.0, 45.0, 25.0, 70),
+    "prime_rib": (350, 25.0, 0.0, 25.0, 0),
+    "pulled_pork_sandwich": (400, 25.0, 35.0, 20.0, 60),
+    "ramen": (400, 15.0, 50.0, 15.0, 65),
+    "ravioli": (250, 10.0, 30.0, 10.0, 55),
+    "red_velvet_cake": (400, 4.0, 50.0, 20.0, 68),
+    "risotto": (300, 10.0, 40.0, 12.0, 65),
+    "samosa": (250, 5.0, 30.0, 12.0, 60),
+    "sashimi": (150, 20.0, 1.0, 5.0, 0),
+    "scallops": (100, 15.0, 5.0, 2.0, 25),
+    "seaweed_salad": (70, 1.0, 11.0, 3.0, 30),
+    "shrimp_and_grits": (350, 20.0, 30.0, 15.0, 60),
+    "spaghetti_bolognese": (300, 20.0, 35.0, 10.0, 55),
+    "spaghetti_carbonara": (450, 25.0, 40.0, 20.0, 60),
+    "spring_rolls": (250, 5.0, 30.0, 12.0, 60),
+    "steak": (300, 30.0, 0.0, 20.0, 0),
+    "strawberry_shortcake": (300, 5.0, 40.0, 15.0, 65),
+    "sushi": (200, 10.0, 30.0, 5.0, 50),
+    "tacos": (250, 15.0, 20.0, 12.0, 55),
+    "takoyaki": (180, 8.0, 25.0, 5.0, 60),
+    "tiramisu": (300, 5.0, 25.0, 20.0, 60),
+    "tuna_tartare": (150, 20.0, 1.0, 8.0, 0),
+    "waffles": (250, 5.0, 35.0, 10.0, 75),
+    "wonton_soup": (150, 10.0, 20.0, 5.0, 40),
+}
+
+
+class NutritionError(ValueError):
+    pass
+
+
+class NutritionTable:
+    def __init__(self, class_names, table=FOOD_NUTRITION, strict=False):
+        """Build the per-class arrays; problems are listed in `self.problems`.
+
+        With strict=True any problem (a class without an entry, a malformed or
+        implausible entry) raises NutritionError instead. Entries for names
+        that aren't classes are only listed in `self.unused`.
+        """
+        self.class_names = list(class_names)
+        n = len(self.class_names)
+        self.values = np.zeros((n, len(FIELDS)), dtype=np.float64)
+        self.known = np.zeros(n, dtype=bool)
+        self.unused = sorted(set(table) - set(self.class_names))
+        self.problems = self.validate(table)
+        if strict and self.problems:
+            raise NutritionError("Nutrition table problems:\n  " + "\n  ".join(self.problems))
+
+        index = {name: i for i, name in enumerate(self.class_names)}
+        for name, row in table.items():
+            i = index.get(name)
+            if i is not None and _row_ok(row):
+                self.values[i] = row
+                self.known[i] = True
+        self.kcal, self.protein, self.carbs, self.fat, self.gi = self.values.T
+        # Per-100 g sugar rise, so a batch only needs one multiply by the portion factor
+        self.sugar = self.carbs * self.gi / 100.0
+
+    def validate(self, table):
+        problems = []
+        for name in self.class_names:
+            if name not in table:
+                problems.append(f"{name}: no nutrition entry (macros will be 0)")
+        for name, row in table.items():
+            if not _row_ok(row):
+                problems.append(f"{name}: expected {len(FIELDS)} non-negative numbers "
+                                f"with GI <= 100, got {row!r}")
+                continue
+            kcal, protein, carbs, fat, _ = row
+            atwater = 4 * protein + 4 * carbs + 9 * fat
+            if abs(atwater - kcal) > ENERGY_TOLERANCE * max(kcal, atwater):
+                problems.append(f"{name}: {kcal} kcal but macros add up to {atwater:.0f} kcal "
+                                f"(fields out of order?)")
+        return problems
+
+    def macros(self, pred_idxs, portions):
+        """Top-1 macros for a batch: arrays of protein/carbs/fat (g), GI and sugar rise.
+
+        Matches the original per-response rounding: grams to 2 decimals, and
+        the sugar rise computed from the rounded carbs. np.round can break a
+        tie the other way from round(), so values may differ by 0.01.
+        """
+        pred_idxs = np.asarray(pred_idxs, dtype=np.int64)
+        factor = np.asarray(portions, dtype=np.float64) / 100.0
+        carbs = np.round(self.carbs[pred_idxs] * factor, 2)
+        gi = self.gi[pred_idxs]
+        return {
+            "protein_g": np.round(self.protein[pred_idxs] * factor, 2),
+            "carbs_g": carbs,
+            "fat_g": np.round(self.fat[pred_idxs] * factor, 2),
+            "glycemic_index": gi,
+            "approx_sugar_rise": np.round(carbs * gi / 100.0, 2),
+        }
+
+    def expected_macros(self, probs, portions):
+        """Probability-weighted macros over the full softmax `probs` (n, C).
+
+        Probability mass on classes without an entry is dropped and the rest
+        renormalized. The reported GI is carbohydrate-weighted, i.e. the GI
+        that reproduces the expected sugar rise from the expected carbs.
+        """
+        probs = np.asarray(probs, dtype=np.float64) * self.known
+        probs /= np.maximum(probs.sum(axis=1, keepdims=True), 1e-12)
+        factor = np.asarray(portions, dtype=np.float64) / 100.0
+        per_100g = probs @ np.stack([self.protein, self.carbs, self.fat, self.sugar], axis=1)
+        protein, carbs, fat, sugar = (per_100g * factor[:, None]).T
+        gi = np.divide(sugar * 100.0, carbs, out=np.zeros_like(carbs), where=carbs > 0)
+        return {
+            "protein_g": np.round(protein, 2),
+            "carbs_g": np.round(carbs, 2),
+            "fat_g": np.round(fat, 2),
+            "glycemic_index": np.round(gi, 1),
+            "approx_sugar_rise": np.round(sugar, 2),
+        }
+
+
+def _row_ok(row):
+    try:
+        values = [float(v) for v in row]
+    except (TypeError, ValueError):
+        return False
+    return len(values) == len(FIELDS) and min(values) >= 0 and values[4] <= 100
@@ -0,0 +1,221 @@
+# prediction_cache.py
+# Content-addressed result cache shared by app.py and app2.py.
+#
+# Keys are a SHA-256 of the image bytes plus the request parameters that
+# affect the result. Entries live in an in-memory LRU bounded by size and
+# TTL; with `disk_dir` set, entries are also written as small JSON files so
+# they survive restarts. The disk tier is bounded too: past `disk_max_entries`
+# or `disk_max_bytes` the least recently used files are deleted, and expired
+# files are swept every `sweep_interval_s`. Cached values must be
+# JSON-serializable.
+#
+# Async callers keep the file I/O off their event loop: peek() and
+# put(disk=False) only touch memory; get() and write_disk() do the rest on a
+# worker thread.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    def __init__(self, max_entries=1024, ttl_s=3600.0, disk_dir=None, disk_max_entries=0, disk_max_bytes=0,
+                 sweep_interval_s=300.0):
+        self.max_entries = max(int(max_entries), 1)
+        self.ttl_s = float(ttl_s)
+        self.disk_dir = disk_dir
+        self.disk_max_entries = int(disk_max_entries)   # 0 = unbounded
+        self.disk_max_bytes = int(disk_max_bytes)       # 0 = unbounded
+        self.sweep_interval_s = float(sweep_interval_s)
+        self._entries = OrderedDict()    # key -> (expires_at, value)
+        self._disk = OrderedDict()       # key -> (size, written_at), least recently used first
+        self._disk_bytes = 0
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+            self.sweep()
+            for key in self._over_budget():   # the limits may have shrunk since the last run
+                self._remove(self._disk_path(key))
+
+    @staticmethod
+    def make_key(namespace, data, **params):
+        h = hashlib.sha256()
+        h.update(namespace.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        if params:
+            h.update(b"\0")
+            h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _scan_disk(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".json"):
+                    files.append((st.st_mtime, name[:-len(".json")], st.st_size))
+                elif name.endswith(".tmp") and st.st_mtime < time.time() - 3600:
+                    self._remove(path)   # left behind by a crash mid-write
+        for mtime, key, size in sorted(files):
+            self._disk[key] = (size, mtime)
+            self._disk_bytes += size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _forget_disk(self, key):
+        # Caller holds the lock
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[0]
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("expires_at", 0) < time.time():
+            with self._lock:
+                self._forget_disk(key)
+            self._remove(self._disk_path(key))
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return record
+
+    def _write_disk(self, key, expires_at, value):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so readers never see a half-written entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f)
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            return
+        now = time.time()
+        with self._lock:
+            self._forget_disk(key)
+            self._disk[key] = (os.path.getsize(path), now)
+            self._disk_bytes += self._disk[key][0]
+            victims = self._over_budget()
+            sweep_due = now - self._last_sweep >= self.sweep_interval_s
+        for victim in victims:
+            self._remove(self._disk_path(victim))
+        if sweep_due:
+            self.sweep()
+
+    def _over_budget(self):
+        # Caller holds the lock; returns the least recently used keys to delete
+        victims = []
+        while self._disk and ((self.disk_max_entries and len(self._disk) > self.disk_max_entries)
+                              or (self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes)):
+            key = next(iter(self._disk))
+            self._forget_disk(key)
+            victims.append(key)
+        self.disk_evictions += len(victims)
+        return victims
+
+    def sweep(self):
+        """Delete disk entries older than the TTL; returns how many were removed."""
+        if not self.disk_dir:
+            return 0
+        now = time.time()
+        with self._lock:
+            self._last_sweep = now
+            expired = [key for key, (_, written_at) in self._disk.items() if written_at + self.ttl_s < now]
+            for key in expired:
+                self._forget_disk(key)
+        for key in expired:
+            self._remove(self._disk_path(key))
+        return len(expired)
+
+    def peek(self, key):
+        """In-memory lookup only. A hit is counted, a miss is not: follow it with get() for the disk tier."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        record = self._read_disk(key) if self.disk_dir else None
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, record["expires_at"], record["value"])
+        return record["value"]
+
+    def _store(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, value, disk=True):
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._store(key, expires_at, value)
+        if disk and self.disk_dir:
+            self._write_disk(key, expires_at, value)
+
+    def write_disk(self, key, value):
+        """The disk half of put(); pairs with put(key, value, disk=False)."""
+        if self.disk_dir:
+            self._write_disk(key, time.time() + self.ttl_s, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
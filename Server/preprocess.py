@@ -0,0 +1,92 @@
+# preprocess.py
+# Fast image decode + preprocessing for the classifier.
+#
+# Equivalent to transforms.Resize((224, 224)) -> ToTensor -> Normalize, but:
+#   * JPEGs are decoded at reduced scale (PIL draft mode) instead of full size,
+#   * the resize is a single PIL bilinear resample straight to the model size,
+#   * uint8 -> normalized float happens in one pass into a preallocated,
+#     reusable batch buffer instead of allocating intermediate tensors.
+import io
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+INPUT_SIZE = 224
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def open_image(data, draft_size, max_pixels=None, oversize="downscale"):
+    """PIL image for `data`, JPEGs set up to decode at reduced scale (draft_size), with the pixel cap applied.
+
+    Over max_pixels, "downscale" relies on the reduced-scale JPEG decode (at
+    most 1/8 per side); other formats have no partial decode, so they (and
+    JPEGs still over the cap at 1/8) are rejected like "reject" does.
+    """
+    image = Image.open(io.BytesIO(data))   # reads the header only
+    width, height = image.size
+    over = bool(max_pixels) and width * height > max_pixels
+    if over and (oversize == "reject" or image.format != "JPEG"):
+        raise ImageTooLarge(f"Image is {width}x{height}, limit is {max_pixels} pixels")
+    if image.format == "JPEG":
+        image.draft("RGB", draft_size)
+        if over and image.size[0] * image.size[1] > max_pixels:
+            raise ImageTooLarge(f"Image is {width}x{height}, limit is {max_pixels} pixels")
+    return image
+
+
+class Preprocessor:
+    def __init__(self, size=INPUT_SIZE, mean=MEAN, std=STD, max_pixels=None,
+                 oversize="downscale", draft_factor=2, max_batch=8):
+        if oversize not in ("downscale", "reject"):
+            raise ValueError(f"oversize must be 'downscale' or 'reject', got {oversize!r}")
+        self.size = int(size)
+        self.max_pixels = max_pixels
+        self.oversize = oversize
+        # Decode JPEGs to at least draft_factor * size so the final bilinear
+        # resample still has enough pixels to antialias from
+        self.draft_size = (self.size * draft_factor, self.size * draft_factor)
+        self.max_batch = int(max_batch)
+        # x * scale + bias == (x / 255 - mean) / std
+        std_t = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        mean_t = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std_t)
+        self.bias = -mean_t / std_t
+        self._local = threading.local()
+
+    def decode(self, data):
+        """Decode image bytes to a (size, size, 3) uint8 array."""
+        image = open_image(data, self.draft_size, self.max_pixels, self.oversize).convert("RGB")
+        if image.size != (self.size, self.size):
+            image = image.resize((self.size, self.size), Image.BILINEAR)
+        return np.array(image)
+
+    def _buffer(self, n):
+        # One reusable buffer per worker thread; grown if a batch is larger
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.shape[0] < n:
+            buf = torch.empty(max(n, self.max_batch), 3, self.size, self.size, dtype=torch.float32)
+            self._local.buffer = buf
+        return buf[:n]
+
+    def to_batch(self, images):
+        """Normalize decoded uint8 images into the thread's reusable batch buffer.
+
+        The returned tensor is a view that is overwritten by the next call on
+        the same thread, so it must be consumed before then.
+        """
+        out = self._buffer(len(images))
+        for i, img in enumerate(images):
+            out[i].copy_(torch.from_numpy(img).permute(2, 0, 1))
+        out.mul_(self.scale).add_(self.bias)
+        return out
+
+    def __call__(self, data):
+        """Single image bytes -> freshly allocated (3, size, size) float tensor."""
+        return self.to_batch([self.decode(data)]).clone()[0]
@@ -0,0 +1,114 @@
+# profiler.py
+# Opt-in sampling profiler for the request hot path.
+#
+# Armed for the next N requests, a background thread snapshots every other
+# thread's Python stack (sys._current_frames) every `interval_ms` and counts
+# identical stacks. Threads parked in a wait/select are skipped, so the
+# result shows where request work actually spends time. The output is in the
+# "collapsed" format (frame;frame;frame count), which flamegraph.pl and
+# speedscope read directly.
+#
+# request_done() is called from app2's async middleware, so it only signals
+# the sampler to stop and never joins it. Each run has its own stop event and
+# Counter, and readers copy the Counter under the lock.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf frames in these files mean the thread is idle (lock/queue wait, an
+# executor worker waiting for work, select)
+IDLE_FILES = ("threading.py", "queue.py", "thread.py", "selectors.py", "socketserver.py", "socket.py")
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms=5.0, max_depth=64):
+        self.interval_s = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def arm(self, requests):
+        """Start sampling now and stop after `requests` more calls to request_done()."""
+        with self._lock:
+            if self._thread is not None:
+                raise RuntimeError("profiler is already running")
+            self._remaining = max(int(requests), 1)
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.finished_at = None
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop, self.stacks),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def request_done(self):
+        """Count a finished request; the last one stops the sampler (without waiting for it)."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+            self._thread = None
+            self.finished_at = time.time()
+            self._stop.set()
+
+    def _run(self, stop, stacks):
+        own = threading.get_ident()
+        while not stop.wait(self.interval_s):
+            sample = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                sample.append(";".join(reversed(stack)))
+            with self._lock:
+                if stop.is_set():
+                    break
+                stacks.update(sample)
+                self.samples += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return Counter(self.stacks), self.samples, self.active, self._remaining
+
+    def collapsed(self):
+        stacks = self._snapshot()[0]
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+    def status(self, top=15):
+        """Summary with the hottest leaf frames (self time)."""
+        stacks, samples, active, remaining = self._snapshot()
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "active": active,
+            "remaining_requests": remaining if active else 0,
+            "samples": samples,
+            "interval_ms": self.interval_s * 1000.0,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "top_frames": [{"frame": frame, "samples": n} for frame, n in leaves.most_common(top)],
+        }
@@ -282,17 +282,18 @@ analyzeBtn.addEventListener("click", async () => {
 // ====== DASHBOARD: SHOW HISTORY ======
 async function showDashboard() {
   try {
-    const res = await fetch("/api/history");
-    const history = await res.json();
+    // Daily totals are kept by the server; unchanged data comes back as a 304
+    const res = await fetch("/api/history/summary?bucket=day");
+    const days = await res.json();
 
     const ctx = document.getElementById("calorieChart").getContext("2d");
     new Chart(ctx, {
       type: 'bar',
       data: {
-        labels: history.map(h => new Date(h.timestamp).toLocaleTimeString()),
+        labels: days.map(d => new Date(d.start + "T00:00:00Z").toLocaleDateString(undefined, { timeZone: "UTC" })),
         datasets: [{
           label: 'Calories',
-          data: history.map(h => h.calories),
+          data: days.map(d => d.calories),
           backgroundColor: 'rgba(255, 99, 132, 0.6)',
           borderColor: 'rgba(255, 99, 132, 1)',
           borderWidth: 1
@@ -0,0 +1,228 @@
+# serve.py
+# Multi-process launcher for app2 (the /predict API).
+#
+#   python serve.py                         # one worker per core, 1 torch thread each
+#   python serve.py --workers 4 --threads 2 --pin
+#   SERVE_WORKERS=1 python serve.py         # single process (same as before)
+#
+# A single uvicorn process tops out well before all cores are busy (one
+# event loop, torch's default intra-op threading contending with the
+# executor threads). Here the master process loads and normalizes the models
+# ONCE, binds the listening socket, and forks N workers that all accept on
+# it. Forked workers share the weight pages copy-on-write (the state dicts
+# are also mmapped, see load_state_dict_mmap), so memory per extra worker
+# stays flat.
+#
+# Each worker gets torch.set_num_threads(threads) and one inter-op thread,
+# chosen from the cores available to the process unless given explicitly;
+# with --pin every worker is bound to its own CPU set. The master keeps
+# the loaded models, so a crashed worker is re-forked in milliseconds.
+# The ngrok tunnel (NGROK_ENABLED=1) runs once, in its own child process,
+# so workers (re-)forked from the master never carry ngrok's runtime.
+#
+# Notes: the in-memory prediction cache is per worker (set CACHE_DIR to share
+# the disk tier); the master never runs a parallel torch op before forking,
+# because OpenMP thread pools do not survive fork().
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+
+import app2
+import uvicorn
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:   # not Linux
+        return list(range(os.cpu_count() or 1))
+
+
+def plan(cores, workers=None, threads=None):
+    """(workers, threads per worker) for `cores` CPUs; defaults fill every core."""
+    if workers is None and threads is None:
+        threads = 1
+    if workers is None:
+        workers = max(1, cores // threads)
+    if threads is None:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def memory_kb(pid):
+    """Rss / Pss / private kB of a process from /proc (Linux only; {} elsewhere)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {}
+    return {"rss": fields.get("Rss", 0), "pss": fields.get("Pss", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def run_worker(index, sock, threads, cpus, warmup, log_level):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass   # already fixed by an earlier parallel op
+    if warmup:
+        app2.warmup()
+    print(f"[worker {index}] pid {os.getpid()}, {threads} torch thread(s)"
+          + (f", cpus {sorted(cpus)}" if cpus else ""), flush=True)
+    server = uvicorn.Server(uvicorn.Config(app2.app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def spawn_tunnel():
+    """Fork a process that holds the ngrok tunnel open until it is terminated; returns its pid."""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            print(f"Public URL: {app2.start_tunnel().url()}", flush=True)
+            while True:
+                signal.pause()
+        except BaseException as e:
+            print(f"[tunnel] exited: {e!r}", file=sys.stderr, flush=True)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+class Supervisor:
+    def __init__(self, sock, workers, threads, pin, warmup, log_level):
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.warmup = warmup
+        self.log_level = log_level
+        cpus = available_cpus()
+        self.cpu_sets = [set(cpus[(i * threads) % len(cpus):][:threads]) if pin else None for i in range(workers)]
+        self.children = {}      # pid -> worker index
+        self.started_at = {}    # worker index -> time of the last fork
+        self.stopping = False
+
+    def spawn(self, index):
+        self.started_at[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+                run_worker(index, self.sock, self.threads, self.cpu_sets[index], self.warmup, self.log_level)
+            except BaseException as e:
+                print(f"[worker {index}] exited: {e!r}", file=sys.stderr, flush=True)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report_memory(self, signum=None, frame=None):
+        print(f"{'worker':>6s} {'pid':>7s} {'rss MB':>8s} {'pss MB':>8s} {'private MB':>11s}", flush=True)
+        for pid, index in sorted(self.children.items(), key=lambda kv: kv[1]):
+            mem = memory_kb(pid)
+            if mem:
+                print(f"{index:6d} {pid:7d} {mem['rss'] / 1024:8.1f} {mem['pss'] / 1024:8.1f} "
+                      f"{mem['private'] / 1024:11.1f}", flush=True)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.report_memory)
+        for index in range(self.workers):
+            self.spawn(index)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:   # not a worker (the tunnel), or shutting down
+                continue
+            print(f"[master] worker {index} (pid {pid}) died with status {status}; restarting", flush=True)
+            # Don't spin if a worker dies straight after starting
+            if time.monotonic() - self.started_at[index] < 1.0:
+                time.sleep(1.0)
+            if not self.stopping:
+                self.spawn(index)
+
+
+def main():
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser(description="Serve app2 with N forked workers sharing loaded models")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=app2.PORT)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", "0")) or None,
+                        help=f"default: one per core ({len(cpus)} available) / --threads")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SERVE_THREADS", "0")) or None,
+                        help="torch intra-op threads per worker; default: cores / workers")
+    parser.add_argument("--pin", action="store_true", default=os.getenv("SERVE_PIN", "0") == "1",
+                        help="bind each worker to its own CPUs")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    workers, threads = plan(len(cpus), args.workers, args.threads)
+    print(f"[master] {len(cpus)} cpus -> {workers} worker(s) x {threads} torch thread(s)", flush=True)
+
+    # Load once, before forking, without spinning up torch's thread pool
+    torch.set_num_threads(1)
+    warmup, app2.WARMUP = app2.WARMUP, False
+    if app2.LAZY_LOAD:
+        print("[master] LAZY_LOAD is ignored: models are loaded before forking workers", flush=True)
+        app2.LAZY_LOAD = False
+    t0 = time.perf_counter()
+    app2.load_models()
+    print(f"[master] models loaded in {time.perf_counter() - t0:.2f}s", flush=True)
+
+    sock = bind_socket(args.host, args.port)
+    tunnel, app2.NGROK_ENABLED = app2.NGROK_ENABLED, False   # workers must not open their own tunnels
+    tunnel_pid = spawn_tunnel() if tunnel else None
+
+    print(f"[master] pid {os.getpid()} listening on {args.host}:{args.port}; "
+          f"kill -USR1 {os.getpid()} prints per-worker memory", flush=True)
+    try:
+        Supervisor(sock, workers, threads, args.pin, warmup, args.log_level).run()
+    finally:
+        if tunnel_pid is not None:
+            try:
+                os.kill(tunnel_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+if __name__ == "__main__":
+    main()
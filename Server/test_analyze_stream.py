@@ -0,0 +1,66 @@
+# test_analyze_stream.py
+# /api/analyze/stream against the fake Clarifai + streaming Groq (see conftest.py).
+#
+#   python -m pytest -q test_analyze_stream.py
+import io
+import json
+import time
+
+from fakes import DEFAULT_REPLY
+
+
+def post_stream(client, data, message=""):
+    return client.post("/api/analyze/stream", data={"image": (io.BytesIO(data), "meal.jpg"), "message": message},
+                       buffered=False)
+
+
+def events(response):
+    """(event, payload, seconds since the first read) for each server-sent event."""
+    start, buffer, out = time.perf_counter(), "", []
+    for chunk in response.response:
+        buffer += chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+        while "\n\n" in buffer:
+            raw, buffer = buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in raw.splitlines())
+            out.append((fields["event"], json.loads(fields["data"]), time.perf_counter() - start))
+    return out
+
+
+def test_tokens_then_result(client, image_bytes):
+    data = image_bytes()
+    received = events(post_stream(client, data))
+    names = [name for name, _, _ in received]
+    assert names[-1] == "result" and set(names[:-1]) == {"token"}
+    text = "".join(payload["text"] for name, payload, _ in received if name == "token")
+    assert text == DEFAULT_REPLY
+    assert received[-1][1] == {"detected_food": [], "chatbot_response": DEFAULT_REPLY}
+
+    # The reply is cached: a repeat is a single result event
+    again = events(post_stream(client, data))
+    assert [name for name, _, _ in again] == ["result"] and again[0][1]["chatbot_response"] == DEFAULT_REPLY
+
+
+def test_tokens_do_not_wait_for_clarifai(client, upstreams, image_bytes):
+    upstreams.clarifai_latency_ms = 800
+    received = events(post_stream(client, image_bytes()))
+    first_token = next(t for name, _, t in received if name == "token")
+    assert first_token < 0.5
+    assert received[-1][0] == "result" and received[-1][2] >= 0.7
+
+
+def test_groq_failure_is_an_error_event(client, upstreams, image_bytes):
+    upstreams.fail_next["groq"] = 2   # the first attempt and its retry
+    received = events(post_stream(client, image_bytes()))
+    assert [name for name, _, _ in received] == ["error"]
+    assert "503" in received[0][1]["error"]
+
+
+def test_clarifai_failure_ends_with_error_not_result(client, upstreams, image_bytes):
+    upstreams.fail_next["clarifai"] = 2
+    upstreams.token_interval_ms = 20
+    data = image_bytes()
+    received = events(post_stream(client, data))
+    assert received[-1][0] == "error" and "result" not in [name for name, _, _ in received]
+    # Nothing was cached for the failed analysis
+    upstreams.token_interval_ms = 0
+    assert events(post_stream(client, data))[-1][0] == "result"
@@ -0,0 +1,73 @@
+# test_backends.py
+# backends.agreement and app2's accuracy gate for CLASSIFIER_BACKEND.
+#
+#   python -m pytest -q test_backends.py
+import glob
+import os
+import shutil
+
+import pytest
+import torch
+
+import backends
+from conftest import SERVER_DIR, StubClassifier
+
+
+def test_agreement():
+    baseline = torch.tensor([[3.0, 2.0, 1.0, 0.0], [0.0, 1.0, 2.0, 3.0]])
+    assert backends.agreement(baseline, baseline) == (1.0, 1.0)
+    # Row 0 keeps its top-1; row 1's top-1 drops to second place (still top-3)
+    candidate = torch.tensor([[3.0, 2.0, 1.0, 0.0], [0.0, 1.0, 3.0, 2.0]])
+    assert backends.agreement(baseline, candidate) == (0.5, 1.0)
+    # Row 1's top-1 drops out of the top-3
+    candidate = torch.tensor([[3.0, 2.0, 1.0, 0.0], [3.0, 2.0, 1.0, 0.0]])
+    assert backends.agreement(baseline, candidate) == (0.5, 0.5)
+
+
+@pytest.mark.parametrize("name", ["channels_last", "int8_dynamic", "torchscript"])
+def test_backends_track_eager(name):
+    model = StubClassifier(10)
+    example = torch.randn(4, 3, 32, 32)
+    runner = backends.build_backend(name, model, example)
+    with torch.no_grad():
+        top1, _ = backends.agreement(model(example), runner(example))
+    assert top1 >= 0.75
+
+
+def test_unknown_or_uncalibrated_backends_are_errors():
+    model, example = StubClassifier(10), torch.randn(1, 3, 32, 32)
+    with pytest.raises(ValueError):
+        backends.build_backend("tensorrt", model, example)
+    with pytest.raises(ValueError):
+        backends.build_backend("int8_static", model, example)
+
+
+@pytest.fixture
+def gate_dir(tmp_path):
+    for path in sorted(glob.glob(os.path.join(SERVER_DIR, "uploads", "*.jp*g")))[:3]:
+        shutil.copy(path, tmp_path)
+    return str(tmp_path)
+
+
+def test_lossy_backend_needs_a_gate_dir(app2_module, monkeypatch):
+    monkeypatch.setattr(app2_module, "CLASSIFIER_BACKEND", "int8_dynamic")
+    monkeypatch.setattr(app2_module, "BACKEND_GATE_DIR", None)
+    model = app2_module.classifier
+    assert app2_module.select_backend(model) is model
+
+
+def test_gate_refuses_a_backend_below_the_agreement_floor(app2_module, monkeypatch, gate_dir):
+    monkeypatch.setattr(app2_module, "CLASSIFIER_BACKEND", "int8_dynamic")
+    monkeypatch.setattr(app2_module, "BACKEND_GATE_DIR", gate_dir)
+    model = app2_module.classifier
+    monkeypatch.setattr(app2_module, "BACKEND_MIN_AGREEMENT", 1.01)   # unreachable
+    assert app2_module.select_backend(model) is model
+    monkeypatch.setattr(app2_module, "BACKEND_MIN_AGREEMENT", 0.0)
+    assert app2_module.select_backend(model) is not model
+
+
+def test_lossless_backend_without_a_gate_dir(app2_module, monkeypatch):
+    monkeypatch.setattr(app2_module, "CLASSIFIER_BACKEND", "channels_last")
+    monkeypatch.setattr(app2_module, "BACKEND_GATE_DIR", None)
+    model = app2_module.classifier
+    assert isinstance(app2_module.select_backend(model), backends._ChannelsLast)
@@ -0,0 +1,87 @@
+# test_batching.py
+# Batching and deadlines of batching.MicroBatcher.
+#
+#   python -m pytest -q test_batching.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+from executor import DeadlineExceeded, InferenceExecutor
+
+
+class Recorder:
+    """Batch function that records the batches it was given and doubles every item."""
+
+    def __init__(self):
+        self.batches = []
+        self.threads = []
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.threads.append(threading.current_thread().name)
+        return [item * 2 for item in items]
+
+
+def submit_all(batcher, items, deadline=None):
+    async def main():
+        return await asyncio.gather(*(batcher.submit(item, deadline) for item in items), return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_share_a_batch():
+    run = Recorder()
+    assert submit_all(MicroBatcher(run, max_batch_size=8, max_wait_ms=50), [1, 2, 3]) == [2, 4, 6]
+    assert run.batches == [[1, 2, 3]]
+
+
+def test_batches_are_capped_and_keep_order():
+    run = Recorder()
+    assert submit_all(MicroBatcher(run, max_batch_size=4, max_wait_ms=50), list(range(10))) == \
+        [i * 2 for i in range(10)]
+    assert [len(b) for b in run.batches] == [4, 4, 2]
+    assert sum(run.batches, []) == list(range(10))
+
+
+def test_full_batch_does_not_wait():
+    run = Recorder()
+    start = time.perf_counter()
+    submit_all(MicroBatcher(run, max_batch_size=4, max_wait_ms=5000), [1, 2, 3, 4])
+    assert time.perf_counter() - start < 1.0
+
+
+def test_partial_batch_waits_at_most_max_wait():
+    run = Recorder()
+    start = time.perf_counter()
+    submit_all(MicroBatcher(run, max_batch_size=8, max_wait_ms=100), [1])
+    assert 0.09 <= time.perf_counter() - start < 1.0
+
+
+def test_expired_items_are_not_run():
+    run = Recorder()
+    results = submit_all(MicroBatcher(run, max_batch_size=8, max_wait_ms=1), [1, 2], deadline=time.monotonic() - 1)
+    assert all(isinstance(r, DeadlineExceeded) for r in results)
+    assert run.batches == []
+
+
+def test_batch_failure_reaches_every_caller():
+    def fail(items):
+        raise RuntimeError("forward failed")
+    results = submit_all(MicroBatcher(fail, max_batch_size=8, max_wait_ms=1), [1, 2])
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_executor_runs_batches_off_the_event_loop():
+    run, executor = Recorder(), InferenceExecutor(max_workers=1)
+    try:
+        assert submit_all(MicroBatcher(run, max_batch_size=2, max_wait_ms=1, executor=executor), [1, 2]) == [2, 4]
+    finally:
+        executor.shutdown()
+    assert run.threads[0].startswith("inference")
+
+
+def test_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(Recorder(), max_batch_size=0)
@@ -0,0 +1,33 @@
+# test_bulk_infer.py
+# bulk_infer.py resuming and --retry-errors bookkeeping.
+#
+#   python -m pytest -q test_bulk_infer.py
+import json
+
+import pytest
+
+
+@pytest.fixture
+def bulk_infer(app2_module):
+    import bulk_infer
+    return bulk_infer
+
+
+def write_lines(path, records, tail=""):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records) + tail)
+
+
+def test_resume_skips_done_and_drops_a_partial_line(bulk_infer, tmp_path):
+    out = tmp_path / "predictions.jsonl"
+    write_lines(out, [{"path": "a.jpg", "food": "sushi"}, {"path": "b.jpg", "error": "broken"}], '{"path": "c.j')
+    assert bulk_infer.load_done(str(out)) == {"a.jpg", "b.jpg"}
+    assert bulk_infer.load_done(str(out), retry_errors=True) == {"a.jpg"}
+    assert out.read_text().endswith('"broken"}\n')
+
+
+def test_retried_paths_keep_only_the_newest_line(bulk_infer, tmp_path):
+    out = tmp_path / "predictions.jsonl"
+    write_lines(out, [{"path": "a.jpg", "food": "sushi"}, {"path": "b.jpg", "error": "broken"},
+                      {"path": "b.jpg", "food": "tacos"}])
+    assert bulk_infer.latest_records(str(out)) == [{"path": "a.jpg", "food": "sushi"},
+                                                   {"path": "b.jpg", "food": "tacos"}]
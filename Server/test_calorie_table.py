@@ -0,0 +1,67 @@
+# test_calorie_table.py
+# calorie_table.CalorieTable reproduces the calorie MLP exactly.
+#
+#   python -m pytest -q test_calorie_table.py
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from calorie_table import CalorieTable
+
+NUM_CLASSES = 7
+
+
+@pytest.fixture
+def mlp():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Linear(NUM_CLASSES + 1, 32), nn.ReLU(), nn.Linear(32, 16), nn.ReLU(),
+                         nn.Linear(16, 1)).eval()
+
+
+def model_calories(module, classes, portions):
+    x = torch.zeros(len(classes), NUM_CLASSES + 1)
+    x[torch.arange(len(classes)), torch.as_tensor(classes)] = 1.0
+    x[:, NUM_CLASSES] = torch.as_tensor(portions, dtype=torch.float32)
+    with torch.no_grad():
+        return module(x).reshape(-1).double().numpy()
+
+
+def test_matches_the_model_everywhere(mlp):
+    table = CalorieTable.compile(mlp, NUM_CLASSES)
+    assert table.verify(mlp) < 1e-3
+    # Including portions off the verification grid and outside it
+    rng = np.random.default_rng(0)
+    classes = rng.integers(0, NUM_CLASSES, 500)
+    portions = rng.uniform(-200.0, 3000.0, 500)
+    np.testing.assert_allclose(table.evaluate(classes, portions), model_calories(mlp, classes, portions),
+                               rtol=1e-4, atol=1e-3)
+    assert table(3, 150.0) == pytest.approx(float(model_calories(mlp, [3], [150.0])[0]), rel=1e-4, abs=1e-3)
+
+
+def test_verify_catches_a_wrong_table(mlp):
+    table = CalorieTable.compile(mlp, NUM_CLASSES)
+    table.intercepts[2] += 1.0
+    with pytest.raises(ValueError, match="class 2"):
+        table.verify(mlp)
+
+
+def test_save_and_load(mlp, tmp_path):
+    table = CalorieTable.compile(mlp, NUM_CLASSES)
+    table.save(tmp_path / "table.npz")
+    loaded = CalorieTable.load(tmp_path / "table.npz")
+    portions = np.linspace(0.0, 1000.0, 11)
+    np.testing.assert_array_equal(loaded.evaluate(np.zeros(11, dtype=np.int64), portions),
+                                  table.evaluate(np.zeros(11, dtype=np.int64), portions))
+
+
+def test_rejects_models_it_cannot_compile():
+    with pytest.raises(ValueError):
+        CalorieTable.compile(nn.Sequential(nn.Linear(NUM_CLASSES + 1, 4), nn.Tanh(), nn.Linear(4, 1)), NUM_CLASSES)
+    with pytest.raises(ValueError):
+        CalorieTable.compile(nn.Sequential(nn.Linear(NUM_CLASSES, 4), nn.ReLU(), nn.Linear(4, 1)), NUM_CLASSES)
+
+
+def test_shipped_calorie_model(app2_module):
+    assert app2_module.calorie_table is not None
+    assert app2_module.calorie_table.verify(app2_module.calorie_model) < 1e-2
@@ -0,0 +1,71 @@
+# test_cascade.py
+# cascade.py's confidence gate, threshold sweep and pick, and app2's
+# classify_cascade with the stub classifier.
+#
+#   python -m pytest -q test_cascade.py
+import pytest
+import torch
+
+import cascade
+
+# Reference labels [0, 1, 2, 3]; the cheap pass gets rows 0-1 right (confidently)
+# and rows 2-3 wrong (unsure), the full pass gets everything right
+CHEAP = torch.tensor([[0.95, 0.03, 0.02], [0.02, 0.9, 0.08], [0.5, 0.4, 0.1], [0.6, 0.3, 0.1]])
+FULL = torch.tensor([[0.9, 0.05, 0.05], [0.1, 0.8, 0.1], [0.1, 0.1, 0.8], [0.1, 0.8, 0.1]])
+LABELS = [0, 1, 2, 1]
+
+
+def test_confident_needs_both_thresholds():
+    assert cascade.confident(CHEAP, 0.85, 0.5).tolist() == [True, True, False, False]
+    assert cascade.confident(CHEAP, 0.55, 0.0).tolist() == [True, True, False, True]
+    assert cascade.confident(CHEAP, 0.55, 0.35).tolist() == [True, True, False, False]
+
+
+def test_sweep():
+    results = cascade.sweep(CHEAP, FULL, LABELS, [0.0, 0.85, 1.01], [0.0])
+    assert [(r["min_confidence"], r["accuracy"], r["escalation_rate"]) for r in results] == [
+        (0.0, 0.5, 0.0),    # cheap pass only
+        (0.85, 1.0, 0.5),   # the two unsure rows escalate
+        (1.01, 1.0, 1.0),   # full pass only
+    ]
+
+
+def test_pick_is_the_cheapest_entry_on_target():
+    results = cascade.sweep(CHEAP, FULL, LABELS, [0.0, 0.55, 0.85, 0.9, 1.01], [0.0, 0.5])
+    cheap_cost, full_cost = cascade.relative_cost(128)
+    best = cascade.pick(results, 1.0, cheap_cost, full_cost)
+    assert best["accuracy"] == 1.0 and best["escalation_rate"] == 0.5
+    # Ties go to the strictest thresholds
+    assert (best["min_confidence"], best["min_margin"]) == (0.9, 0.5)
+    assert cascade.pick(results, 0.5, cheap_cost, full_cost)["escalation_rate"] == 0.0
+    assert cascade.pick(cascade.sweep(CHEAP, CHEAP, LABELS, [0.0], [0.0]), 1.0, cheap_cost, full_cost) is None
+
+
+def test_views():
+    batch = torch.randn(2, 3, 16, 16)
+    views = cascade.tta_views(batch, ("flip", "zoom"))
+    assert views.shape == (6, 3, 16, 16)
+    torch.testing.assert_close(views[2:4], batch.flip(3))
+    assert cascade.average_views(torch.ones(6, 5), 2).shape == (2, 5)
+    assert cascade.downscale(batch, 8).shape == (2, 3, 8, 8)
+    with pytest.raises(ValueError):
+        cascade.check_views(["rotate"])
+
+
+@pytest.fixture
+def images(app2_module, image_bytes):
+    return [app2_module.decode_image(image_bytes()) for _ in range(3)]
+
+
+def test_classify_cascade_escalates_only_unsure_images(app2_module, monkeypatch, images):
+    full = app2_module.classify_batch(images)
+    monkeypatch.setattr(app2_module, "CASCADE_MIN_MARGIN", 0.0)
+
+    # Thresholds nothing clears: every image takes the full pass
+    monkeypatch.setattr(app2_module, "CASCADE_MIN_CONFIDENCE", 1.01)
+    torch.testing.assert_close(app2_module.classify_cascade(images), full)
+
+    # Thresholds everything clears: the cheap pass answers alone
+    monkeypatch.setattr(app2_module, "CASCADE_MIN_CONFIDENCE", 0.0)
+    batch = app2_module.collate_images(images)
+    torch.testing.assert_close(app2_module.classify_cascade(images), app2_module.cheap_probs(batch))
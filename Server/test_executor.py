@@ -0,0 +1,81 @@
+# test_executor.py
+# Admission control of executor.InferenceExecutor and app2's /predict on top
+# of it (503 + Retry-After when full), with conftest's stub classifier.
+#
+#   python -m pytest -q test_executor.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from executor import DeadlineExceeded, InferenceExecutor, QueueFull
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor(max_workers=1, max_queue=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_slots_are_bounded_and_released(executor):
+    with executor.slot(), executor.slot():
+        assert executor.in_flight == 2
+        with pytest.raises(QueueFull):
+            with executor.slot():
+                pass
+    assert executor.in_flight == 0
+    with executor.slot():
+        assert executor.in_flight == 1
+
+
+def test_slot_is_released_on_error(executor):
+    with pytest.raises(RuntimeError):
+        with executor.slot():
+            raise RuntimeError("inference failed")
+    assert executor.in_flight == 0
+
+
+def test_run_uses_the_worker_pool(executor):
+    name = asyncio.run(executor.run(lambda: threading.current_thread().name))
+    assert name.startswith("inference")
+
+
+def test_work_queued_past_its_deadline_is_skipped(executor):
+    ran = []
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(executor.run(ran.append, 1, deadline=time.monotonic() - 1))
+    assert ran == []
+
+
+def post_image(client2, data, **headers):
+    return client2.post("/predict", files={"file": ("meal.jpg", data)}, headers=headers)
+
+
+def test_predict(client2, app2_module, image_bytes):
+    data = image_bytes()
+    response = post_image(client2, data)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["food"] in app2_module.class_names and body["portion_used_g"] == 100.0
+    assert len(body["top_predictions"]) == 3 and body["calories"] > 0
+    assert "forward" in response.headers["Server-Timing"]
+
+    # The repeat is answered from the prediction cache, with the same result
+    hits = app2_module.prediction_cache.stats()["hits"]
+    assert post_image(client2, data).json() == body
+    assert app2_module.prediction_cache.stats()["hits"] == hits + 1
+
+
+def test_full_queue_is_503(client2, app2_module, monkeypatch, image_bytes):
+    monkeypatch.setattr(app2_module.inference_executor, "max_queue", 1)
+    with app2_module.inference_executor.slot():
+        response = post_image(client2, image_bytes())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app2_module.RETRY_AFTER_S)
+    assert post_image(client2, image_bytes()).status_code == 200
+
+
+def test_unreadable_image_is_400(client2):
+    assert post_image(client2, b"not an image").status_code == 400
@@ -0,0 +1,100 @@
+# test_hedge.py
+# The local-model hedge of /api/analyze and /api/analyze/stream against
+# fakes.FakeUpstreams standing in for Clarifai, Groq and app2's /predict.
+#
+#   python -m pytest -q test_hedge.py
+import io
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from fakes import DEFAULT_PREDICTION, DEFAULT_REPLY
+from test_analyze_stream import events, post_stream
+
+BUDGET_S = 0.3
+
+
+@pytest.fixture
+def hedged(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "HEDGE_BUDGET_S", BUDGET_S)
+
+
+def analyze(client, data):
+    start = time.perf_counter()
+    response = client.post("/api/analyze", data={"image": (io.BytesIO(data), "meal.jpg"), "message": ""})
+    return response, time.perf_counter() - start
+
+
+def test_fast_upstreams_are_not_hedged(hedged, client, image_bytes):
+    response, _ = analyze(client, image_bytes())
+    assert response.status_code == 200
+    assert response.get_json()["chatbot_response"] == DEFAULT_REPLY and "degraded" not in response.get_json()
+
+
+def test_slow_upstreams_get_the_local_prediction(hedged, client, upstreams, image_bytes):
+    upstreams.groq_latency_ms = 1000
+    data = image_bytes()
+    response, elapsed = analyze(client, data)
+    body = response.get_json()
+    assert elapsed < BUDGET_S + 0.2
+    assert body["degraded"] and body["local_prediction"] == DEFAULT_PREDICTION
+    assert "chicken curry" in body["chatbot_response"]
+
+    # The upstream reply arrives behind the follow-up token and is cached
+    follow_up = client.get(f"/api/analyze/result/{body['follow_up']}")
+    assert follow_up.status_code == 202
+    time.sleep(1.0)
+    follow_up = client.get(f"/api/analyze/result/{body['follow_up']}")
+    assert follow_up.status_code == 200 and follow_up.get_json()["chatbot_response"] == DEFAULT_REPLY
+    response, _ = analyze(client, data)
+    assert response.get_json()["chatbot_response"] == DEFAULT_REPLY
+
+
+@pytest.mark.parametrize("local", ["slow", "failing"])
+def test_budget_is_a_hard_cap(hedged, app_module, client, upstreams, local):
+    """A local model that can't answer within the budget is not waited for."""
+    if local == "slow":
+        upstreams.local_latency_ms = 2000
+    else:
+        upstreams.fail_next["local"] = 1
+    pending = Future()   # upstreams that never answer
+    start = time.perf_counter()
+    hedge_at = time.monotonic() + BUDGET_S
+    local_future = app_module.upstream_pool.submit(app_module.local_predict, b"image", hedge_at)
+    assert app_module.hedge(pending, pending, local_future, hedge_at) is None
+    assert time.perf_counter() - start < BUDGET_S + 0.1
+
+
+def test_slow_near_duplicate_lookup_does_not_delay_the_hedge(hedged, app_module, monkeypatch, client, upstreams,
+                                                             image_bytes):
+    """The budget counts from arrival; the embedding lookup runs alongside the upstreams."""
+    monkeypatch.setattr(app_module, "embed", lambda data: time.sleep(1.0))
+    upstreams.groq_latency_ms = 1000
+    response, elapsed = analyze(client, image_bytes())
+    assert response.get_json()["degraded"] and elapsed < BUDGET_S + 0.2
+    time.sleep(1.0)   # let the follow-up finish before the next test
+
+
+def test_slow_local_model_falls_back_to_upstreams(hedged, client, upstreams, image_bytes):
+    upstreams.groq_latency_ms = 600
+    upstreams.local_latency_ms = 2000
+    response, elapsed = analyze(client, image_bytes())
+    assert response.get_json()["chatbot_response"] == DEFAULT_REPLY
+    assert elapsed < 1.2
+
+
+def test_stream_sends_local_estimate_then_tokens(hedged, client, upstreams, image_bytes):
+    upstreams.groq_latency_ms = 800
+    received = events(post_stream(client, image_bytes()))
+    names = [name for name, _, _ in received]
+    assert names[0] == "degraded" and received[0][2] < BUDGET_S + 0.2
+    assert received[0][1]["local_prediction"] == DEFAULT_PREDICTION and "follow_up" not in received[0][1]
+    assert set(names[1:-1]) == {"token"} and names[-1] == "result"
+    assert received[-1][1]["chatbot_response"] == DEFAULT_REPLY
+
+
+def test_stream_with_prompt_tokens_is_not_hedged(hedged, client, image_bytes):
+    received = events(post_stream(client, image_bytes()))
+    assert "degraded" not in [name for name, _, _ in received]
+    assert received[-1][0] == "result"
@@ -0,0 +1,58 @@
+# test_history.py
+# /api/save and /api/history input validation, and HistoryStore's duplicate
+# handling for meals without an image.
+#
+#   python -m pytest -q test_history.py
+import sqlite3
+
+from history_store import HistoryStore
+
+
+def test_bad_cursor_is_400(client):
+    response = client.get("/api/history?cursor=2026-01-01T00:00:00,notanid")
+    assert response.status_code == 400 and "cursor" in response.get_json()["error"]
+
+
+def test_bad_data_url_is_400(client):
+    response = client.post("/api/save", json={"calories": 100, "image": "data:image/jpeg;base64,@@not base64@@"})
+    assert response.status_code == 400 and "base64" in response.get_json()["error"]
+
+
+def test_imageless_meals_are_deduplicated(tmp_path):
+    db = tmp_path / "history.db"
+    # A database created with the first unique index, on the bare image column
+    con = sqlite3.connect(db)
+    con.executescript("""
+        CREATE TABLE meals (id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, timestamp TEXT NOT NULL,
+                            calories REAL, foods TEXT, image TEXT, extra TEXT);
+        CREATE UNIQUE INDEX meals_dedup ON meals (user, timestamp, image);
+    """)
+    for _ in range(2):
+        con.execute("INSERT INTO meals (user, timestamp, calories) VALUES ('alice', '2026-01-01T12:00:00', 300)")
+    con.commit()
+    con.close()
+
+    store = HistoryStore(str(db), str(tmp_path / "blobs"))
+    rows, _ = store.history(user="alice")
+    assert len(rows) == 1
+    assert store.summary(user="alice")[0][0]["calories"] == 300
+    # Re-running a migration of the same record is a no-op
+    assert store.save({"timestamp": "2026-01-01T12:00:00", "calories": 300}, user="alice") is None
+    assert len(store.history(user="alice")[0]) == 1
+
+
+def test_timestamps_that_are_not_strings_are_400(client):
+    for timestamp in (1767268800, None, ["2026-01-01"]):
+        response = client.post("/api/save", json={"calories": 100, "timestamp": timestamp})
+        assert response.status_code == 400, timestamp
+
+
+def test_unparseable_timestamps_are_kept_but_not_summarized(client, tmp_path):
+    response = client.post("/api/save?user=odd-timestamps", json={"calories": 100, "timestamp": "yesterday"})
+    assert response.status_code == 201
+    summary = client.get("/api/history/summary?user=odd-timestamps")
+    assert summary.status_code == 200 and summary.get_json() == []
+    # Rows written before validation existed (e.g. a numeric timestamp) don't break the rollups either
+    store = HistoryStore(str(tmp_path / "history.db"), str(tmp_path / "blobs"))
+    assert store.save({"timestamp": 1767268800, "calories": 100}) is not None
+    assert store.rebuild_rollups() == 1 and store.summary()[0] == []
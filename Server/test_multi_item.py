@@ -0,0 +1,77 @@
+# test_multi_item.py
+# multi_item crop grids and merge_detections, and app2's /predict/items.
+#
+#   python -m pytest -q test_multi_item.py
+import numpy as np
+import pytest
+
+from multi_item import MultiCropper, crop_boxes, merge_detections
+
+# Whole image, then four 0.6 tiles: top-left, top-right, bottom-left, bottom-right
+BOXES, LEVELS = crop_boxes((1.0, 0.6), overlap=0.25)
+
+
+def probs_for(*rows, num_classes=4):
+    """Softmax-like rows from (class, confidence) pairs; the rest of the mass is spread evenly."""
+    out = []
+    for cls, conf in rows:
+        row = np.full(num_classes, (1.0 - conf) / (num_classes - 1))
+        row[cls] = conf
+        out.append(row)
+    return np.array(out)
+
+
+def test_crop_grid():
+    assert len(BOXES) == 5 and list(LEVELS) == [0, 1, 1, 1, 1]
+    assert tuple(BOXES[0]) == (0.0, 0.0, 1.0, 1.0)
+    assert (BOXES >= 0).all() and (BOXES <= 1).all()
+    # Neighbouring tiles overlap by at least the requested fraction of a tile
+    assert BOXES[1][2] - BOXES[2][0] >= 0.25 * 0.6
+
+
+def test_same_class_tiles_merge_into_one_item():
+    probs = probs_for((0, 0.4), (1, 0.9), (1, 0.8), (2, 0.7), (2, 0.6))
+    items = merge_detections(BOXES, LEVELS, probs, min_confidence=0.5)
+    assert [item.class_idx for item in items] == [1, 2]
+    assert items[0].crops == 2 and items[0].confidence == pytest.approx(0.9)
+    assert items[0].box == pytest.approx((0.0, 0.0, 1.0, 0.6))   # union of the two top tiles
+    assert sum(item.share for item in items) == pytest.approx(1.0)
+
+
+def test_whole_image_is_the_fallback():
+    probs = probs_for((3, 0.45), (0, 0.3), (1, 0.3), (2, 0.3), (0, 0.3))
+    items = merge_detections(BOXES, LEVELS, probs, min_confidence=0.5)
+    assert len(items) == 1
+    assert items[0].class_idx == 3 and items[0].share == 1.0 and items[0].box == (0.0, 0.0, 1.0, 1.0)
+
+
+def test_max_items_keeps_the_most_confident():
+    # Diagonal tiles don't touch, so nothing merges
+    boxes = np.array([(0.0, 0.0, 0.3, 0.3), (0.35, 0.35, 0.65, 0.65), (0.7, 0.7, 1.0, 1.0)])
+    probs = probs_for((0, 0.6), (1, 0.9), (2, 0.7))
+    items = merge_detections(boxes, np.array([1, 1, 1]), probs, min_confidence=0.5, max_items=2)
+    assert [item.class_idx for item in items] == [1, 2]
+
+
+def test_cropper_returns_one_crop_per_box(image_bytes):
+    crops = MultiCropper(size=64)(image_bytes())
+    assert len(crops) == 5 and all(crop.size == (64, 64) for crop in crops)
+
+
+def test_predict_items(client2, app2_module, image_bytes):
+    response = client2.post("/predict/items", files={"file": ("meal.jpg", image_bytes())}, data={"portion": "300"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["crops"] == len(app2_module.cropper)
+    assert 1 <= len(body["items"]) <= app2_module.MULTI_MAX_ITEMS
+    for item in body["items"]:
+        assert item["food"] in app2_module.class_names and len(item["box"]) == 4
+    # The plate's weight is split between its items
+    assert body["total"]["portion_used_g"] == pytest.approx(300.0, abs=0.05)
+    assert body["total"]["calories"] == pytest.approx(sum(i["calories"] for i in body["items"]), abs=0.05)
+
+
+def test_predict_items_rejects_unknown_nutrition_mode(client2, image_bytes):
+    response = client2.post("/predict/items", files={"file": ("meal.jpg", image_bytes())},
+                            data={"nutrition_mode": "median"})
+    assert response.status_code == 422
@@ -0,0 +1,34 @@
+# test_near_duplicate.py
+# Near-duplicate answers from saved meals (app.find_near_duplicate) only come
+# from the requesting user's own history.
+#
+#   python -m pytest -q test_near_duplicate.py
+import base64
+
+import numpy as np
+
+
+def save_meal(app_module, data, user, reply, vector):
+    record = {"timestamp": f"2026-01-01T12:00:0{len(app_module.meal_index)}+00:00", "foods": ["curry"],
+              "calories": 500, "image": "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii"),
+              "analysis": {"message": "", "result": {"detected_food": [], "chatbot_response": reply}}}
+    meal_id = app_module.history_store.save(record, user=user)
+    app_module.meal_index.add([meal_id], [vector])
+    return meal_id
+
+
+def test_only_the_users_own_meals_answer(app_module, image_bytes):
+    data = image_bytes()
+    vector = np.random.default_rng(0).standard_normal(app_module.meal_index.dim).astype(np.float32)
+    alice = save_meal(app_module, data, "alice", "alice's analysis", vector)
+
+    assert app_module.find_near_duplicate(data, vector, "", "bob") is None
+    assert app_module.find_near_duplicate(data, vector, "", None) is None
+    hit = app_module.find_near_duplicate(data, vector, "", "alice")
+    assert hit["near_duplicate_of"] == alice and hit["chatbot_response"] == "alice's analysis"
+
+    # Another user's identical meal, indexed later, does not crowd out or replace bob's own
+    bob = save_meal(app_module, data, "bob", "bob's analysis", vector)
+    hit = app_module.find_near_duplicate(data, vector, "", "bob")
+    assert hit["near_duplicate_of"] == bob and hit["chatbot_response"] == "bob's analysis"
+    assert app_module.find_near_duplicate(data, vector, "a different question", "bob") is None
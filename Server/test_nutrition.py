@@ -0,0 +1,76 @@
+# test_nutrition.py
+# nutrition.NutritionTable: validation against the class list and the
+# vectorized top-1 / expected macros.
+#
+#   python -m pytest -q test_nutrition.py
+import os
+
+import numpy as np
+import pytest
+
+from conftest import SERVER_DIR
+from nutrition import FOOD_NUTRITION, NutritionError, NutritionTable
+
+TABLE = {
+    "curry": (250, 25.0, 15.0, 10.0, 50),
+    "salad": (100, 3.0, 10.0, 5.0, 20),
+    "steak": (300, 30.0, 0.0, 20.0, 0),
+}
+
+
+def reference_macros(row, portion):
+    """The per-response arithmetic NutritionTable.macros replaced."""
+    _, protein, carbs, fat, gi = row
+    factor = portion / 100.0
+    carb = round(carbs * factor, 2)
+    return {"protein_g": round(protein * factor, 2), "carbs_g": carb, "fat_g": round(fat * factor, 2),
+            "glycemic_index": gi, "approx_sugar_rise": round(carb * (gi / 100), 2)}
+
+
+def test_shipped_table_covers_every_class():
+    with open(os.path.join(SERVER_DIR, "classes.txt")) as f:
+        class_names = [ln.strip() for ln in f]
+    table = NutritionTable(class_names, strict=True)
+    assert table.known.all()
+    assert table.unused == sorted(set(FOOD_NUTRITION) - set(class_names))
+
+
+def test_macros_match_the_per_item_formula():
+    names = list(TABLE)
+    table = NutritionTable(names, TABLE)
+    idxs, portions = [0, 2, 1, 0], [100.0, 250.0, 37.5, 333.3]
+    macros = table.macros(idxs, portions)
+    for i, (idx, portion) in enumerate(zip(idxs, portions)):
+        expected = reference_macros(TABLE[names[idx]], portion)
+        # np.round and round() may break a tie differently (83.325 -> 83.32 vs 83.33)
+        assert {k: float(v[i]) for k, v in macros.items()} == pytest.approx(expected, abs=0.0101)
+
+
+def test_expected_macros():
+    table = NutritionTable(list(TABLE), TABLE)
+    # A one-hot softmax is the top-1 answer
+    one_hot = table.expected_macros(np.eye(3)[[1]], [200.0])
+    top1 = table.macros([1], [200.0])
+    for key in ("protein_g", "carbs_g", "fat_g", "approx_sugar_rise"):
+        assert one_hot[key][0] == pytest.approx(top1[key][0])
+    # An even split averages the grams; GI is carbohydrate-weighted
+    mixed = table.expected_macros([[0.5, 0.5, 0.0]], [100.0])
+    assert mixed["protein_g"][0] == pytest.approx(14.0)
+    assert mixed["glycemic_index"][0] == pytest.approx((15.0 * 50 + 10.0 * 20) / 25.0, abs=0.05)
+
+
+def test_mass_on_unknown_classes_is_dropped():
+    table = NutritionTable(["curry", "mystery"], {"curry": TABLE["curry"]})
+    assert table.problems == ["mystery: no nutrition entry (macros will be 0)"]
+    macros = table.expected_macros([[0.5, 0.5]], [100.0])
+    assert macros["protein_g"][0] == pytest.approx(25.0)
+
+
+def test_problems_are_reported_or_raised():
+    table = {"curry": TABLE["curry"], "salad": (100, 3.0, 10.0), "steak": (20, 30.0, 0.0, 20.0, 0),
+             "soup": (50, 2.0, 8.0, 1.0, 40)}
+    nutrition = NutritionTable(["curry", "salad", "steak"], table)
+    assert len(nutrition.problems) == 2 and nutrition.unused == ["soup"]
+    assert not nutrition.known[1] and nutrition.known[2]   # implausible but well-formed rows are still used
+    with pytest.raises(NutritionError):
+        NutritionTable(["curry", "salad", "steak"], table, strict=True)
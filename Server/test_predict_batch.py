@@ -0,0 +1,82 @@
+# test_predict_batch.py
+# app2's /predict/batch: NDJSON results in input order, zip archives and the
+# request limits.
+#
+#   python -m pytest -q test_predict_batch.py
+import io
+import json
+import zipfile
+
+import pytest
+
+from preprocess import ImageTooLarge
+
+
+def lines(response):
+    assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def zip_of(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_files_stream_back_in_order(client2, app2_module, monkeypatch, image_bytes):
+    monkeypatch.setattr(app2_module, "BATCH_CHUNK_SIZE", 2)   # several chunks, decoded ahead
+    names = ["a.jpg", "b.jpg", "broken.jpg", "c.jpg", "d.jpg"]
+    files = [("files", (name, b"not an image" if name == "broken.jpg" else image_bytes())) for name in names]
+    results = lines(client2.post("/predict/batch", files=files, data={"portion": "250"}))
+    assert [r["index"] for r in results] == list(range(5)) and [r["name"] for r in results] == names
+    assert "error" in results[2] and "food" not in results[2]
+    assert all(r["portion_used_g"] == 250.0 for i, r in enumerate(results) if i != 2)
+
+
+def test_archive_with_portions(client2, image_bytes):
+    archive = zip_of({"x.jpg": image_bytes(), "dir/y.jpg": image_bytes(), "notes.txt": b"skipped",
+                      "__MACOSX/._x.jpg": b"skipped", "portions.json": json.dumps({"x.jpg": 50})})
+    results = lines(client2.post("/predict/batch", files={"archive": ("meals.zip", archive)}))
+    assert [(r["name"], r["portion_used_g"]) for r in results] == [("x.jpg", 50.0), ("dir/y.jpg", 100.0)]
+
+
+def test_too_many_files_is_413(client2, app2_module, monkeypatch, image_bytes):
+    monkeypatch.setattr(app2_module, "BATCH_MAX_FILES", 2)
+    files = [("files", (f"{i}.jpg", image_bytes())) for i in range(3)]
+    assert client2.post("/predict/batch", files=files).status_code == 413
+
+
+def test_too_many_images_is_413(client2, app2_module, monkeypatch, image_bytes):
+    monkeypatch.setattr(app2_module, "BATCH_MAX_IMAGES", 2)
+    archive = zip_of({f"{i}.jpg": image_bytes() for i in range(3)})
+    assert client2.post("/predict/batch", files={"archive": ("meals.zip", archive)}).status_code == 413
+
+
+@pytest.mark.parametrize("files, data", [
+    ([], {}),                                                           # nothing to classify
+    ([("files", ("a.jpg", b"x")), ("archive", ("a.zip", b"x"))], {}),   # both kinds
+    ([("files", ("a.jpg", b"x"))] * 3, {"portion": ["1", "2"]}),        # portions don't line up
+    ([("archive", ("a.zip", b"not a zip"))], {}),
+    ([("files", ("a.jpg", b"x"))], {"portion": "lots"}),
+    ([("files", ("a.jpg", b"x"))], {"nutrition_mode": "median"}),
+])
+def test_bad_requests_are_422(client2, files, data):
+    assert client2.post("/predict/batch", files=files, data=data).status_code == 422
+
+
+def test_reads_are_bounded(app2_module):
+    assert app2_module.read_limited(io.BytesIO(b"x" * 10), limit=10) == b"x" * 10
+    with pytest.raises(ImageTooLarge):
+        app2_module.read_limited(io.BytesIO(b"x" * 11), limit=10)
+
+
+def test_full_queue_is_503(client2, app2_module, monkeypatch, image_bytes):
+    monkeypatch.setattr(app2_module.inference_executor, "max_queue", 1)
+    with app2_module.inference_executor.slot():
+        response = client2.post("/predict/batch", files=[("files", ("a.jpg", image_bytes()))])
+    assert response.status_code == 503
+    # The slot is held for the whole stream and released when it ends
+    assert lines(client2.post("/predict/batch", files=[("files", ("a.jpg", image_bytes()))]))
+    assert app2_module.inference_executor.in_flight == 0
@@ -0,0 +1,133 @@
+# test_prediction_cache.py
+# prediction_cache.PredictionCache: key namespaces, the in-memory LRU and the
+# bounded disk tier; app2's model fingerprint in the cache namespace.
+#
+#   python -m pytest -q test_prediction_cache.py
+import os
+import time
+
+import pytest
+
+from prediction_cache import PredictionCache
+
+
+def disk_files(cache):
+    return sorted(name for _, _, names in os.walk(cache.disk_dir) for name in names if name.endswith(".json"))
+
+
+def test_keys_depend_on_namespace_and_params():
+    key = PredictionCache.make_key("classifier:a", b"image")
+    assert key == PredictionCache.make_key("classifier:a", b"image")
+    assert key != PredictionCache.make_key("classifier:b", b"image")
+    assert key != PredictionCache.make_key("classifier:a", b"image", portion=100)
+    assert PredictionCache.make_key("analyze", b"image", message="a") != \
+        PredictionCache.make_key("analyze", b"image", message="b")
+
+
+def test_memory_lru_and_ttl():
+    cache = PredictionCache(max_entries=2, ttl_s=0.2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)   # evicts "b", the least recently used
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    time.sleep(0.25)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    PredictionCache(disk_dir=str(tmp_path)).put("k" * 64, [0.25, 0.75])
+    cache = PredictionCache(disk_dir=str(tmp_path))
+    assert cache.get("k" * 64) == [0.25, 0.75]
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_is_bounded_by_entries(tmp_path):
+    cache = PredictionCache(max_entries=100, disk_dir=str(tmp_path), disk_max_entries=3)
+    keys = [f"{i:064x}" for i in range(6)]
+    for key in keys:
+        cache.put(key, [0.5])
+    assert disk_files(cache) == [key + ".json" for key in keys[3:]]
+    assert cache.stats()["disk_entries"] == 3 and cache.stats()["disk_evictions"] == 3
+
+
+def test_disk_tier_is_bounded_by_bytes(tmp_path):
+    cache = PredictionCache(disk_dir=str(tmp_path), disk_max_bytes=2000)
+    for i in range(20):
+        cache.put(f"{i:064x}", [0.1] * 20)
+    stats = cache.stats()
+    assert 0 < stats["disk_bytes"] <= 2000 and stats["disk_evictions"] > 0
+    assert stats["disk_bytes"] == sum(os.path.getsize(os.path.join(root, name))
+                                      for root, _, names in os.walk(tmp_path) for name in names)
+
+
+def test_smaller_limits_trim_the_disk_tier_on_start(tmp_path):
+    cache = PredictionCache(disk_dir=str(tmp_path))
+    for i in range(5):
+        cache.put(f"{i:064x}", [0.5])
+    assert len(disk_files(PredictionCache(disk_dir=str(tmp_path), disk_max_entries=2))) == 2
+
+
+def test_expired_disk_entries_are_swept(tmp_path):
+    cache = PredictionCache(ttl_s=0.1, disk_dir=str(tmp_path))
+    cache.put("e" * 64, [0.5])
+    time.sleep(0.15)
+    assert cache.sweep() == 1 and disk_files(cache) == []
+
+
+@pytest.fixture
+def fingerprint(app2_module):
+    with open(app2_module.CLASSIFIER_STATE, "wb") as f:
+        f.write(b"weights")
+    return app2_module.model_fingerprint
+
+
+def test_fingerprint_tracks_what_changes_the_probabilities(app2_module, fingerprint, monkeypatch):
+    base = fingerprint()
+    assert fingerprint() == base
+
+    # A backend only counts if it was actually selected (not refused in favour of eager)
+    monkeypatch.setattr(app2_module, "CLASSIFIER_BACKEND", "channels_last")
+    assert fingerprint() == base
+    monkeypatch.setattr(app2_module, "classifier_runner", object())
+    assert fingerprint() != base
+    monkeypatch.undo()
+
+    monkeypatch.setattr(app2_module, "FAST_PREPROCESS", not app2_module.FAST_PREPROCESS)
+    assert fingerprint() != base
+    monkeypatch.undo()
+
+    monkeypatch.setattr(app2_module, "CASCADE_ENABLED", True)
+    cascaded = fingerprint()
+    assert cascaded != base
+    monkeypatch.setattr(app2_module, "CASCADE_MIN_CONFIDENCE", 0.5)
+    assert fingerprint() != cascaded
+    monkeypatch.undo()
+
+    with open(app2_module.CLASSIFIER_STATE, "wb") as f:
+        f.write(b"new weights")
+    assert fingerprint() != base
+
+
+def test_peek_is_memory_only(tmp_path):
+    PredictionCache(disk_dir=str(tmp_path)).put("p" * 64, [0.5])
+    cache = PredictionCache(disk_dir=str(tmp_path))
+    assert cache.peek("p" * 64) is None and cache.stats()["misses"] == 0
+    assert cache.get("p" * 64) == [0.5] and cache.peek("p" * 64) == [0.5]
+    cache.put("q" * 64, [0.5], disk=False)
+    assert "q" * 64 + ".json" not in disk_files(cache)
+    cache.write_disk("q" * 64, [0.5])
+    assert "q" * 64 + ".json" in disk_files(cache)
+
+
+def test_predict_uses_the_disk_tier(client2, app2_module, monkeypatch, tmp_path, image_bytes):
+    monkeypatch.setattr(app2_module, "prediction_cache", PredictionCache(disk_dir=str(tmp_path)))
+    data = image_bytes()
+    body = client2.post("/predict", files={"file": ("meal.jpg", data)}).json()
+    assert len(disk_files(app2_module.prediction_cache)) == 1
+
+    # A restarted server answers the repeat from disk
+    monkeypatch.setattr(app2_module, "prediction_cache", PredictionCache(disk_dir=str(tmp_path)))
+    assert client2.post("/predict", files={"file": ("meal.jpg", data)}).json() == body
+    assert app2_module.prediction_cache.stats()["disk_hits"] == 1
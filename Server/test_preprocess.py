@@ -0,0 +1,82 @@
+# test_preprocess.py
+# preprocess.Preprocessor against the torchvision reference transform, and
+# the pixel cap (Preprocessor and app2's /predict).
+#
+#   python -m pytest -q test_preprocess.py
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocess import MEAN, STD, ImageTooLarge, Preprocessor, open_image
+
+reference = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(list(MEAN), list(STD))
+])
+
+
+def encode(width, height, fmt="JPEG", seed=0):
+    """A smooth random image (noise would make the reduced-scale decode look worse than real photos)."""
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8))
+    buf = io.BytesIO()
+    small.resize((width, height), Image.BILINEAR).save(buf, fmt)
+    return buf.getvalue()
+
+
+def expected(data):
+    return reference(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "JPEG"])
+def test_matches_the_reference_without_draft(fmt):
+    # A JPEG this small decodes at full scale, so the fast path is the same computation
+    data = encode(400, 300, fmt)
+    torch.testing.assert_close(Preprocessor()(data), expected(data), atol=1e-5, rtol=0)
+
+
+def test_reduced_scale_jpeg_decode_stays_close():
+    data = encode(1200, 900)
+    assert (Preprocessor()(data) - expected(data)).abs().mean().item() < 0.05
+
+
+def test_batch_matches_single_images():
+    pre = Preprocessor(max_batch=2)
+    datas = [encode(300, 200, seed=i) for i in range(3)]   # more than max_batch: the buffer grows
+    batch = pre.to_batch([pre.decode(d) for d in datas])
+    for i, data in enumerate(datas):
+        torch.testing.assert_close(batch[i], pre(data))
+
+
+def test_pixel_cap_other_formats_are_rejected():
+    with pytest.raises(ImageTooLarge):
+        Preprocessor(max_pixels=100_000).decode(encode(400, 400, "PNG"))
+
+
+def test_pixel_cap_jpegs_are_downscaled_or_rejected():
+    data = encode(2000, 2000)
+    # Decoded at reduced scale (at most 1/8 per side) under "downscale"
+    assert Preprocessor(max_pixels=1_000_000).decode(data).shape == (224, 224, 3)
+    with pytest.raises(ImageTooLarge):
+        Preprocessor(max_pixels=1_000_000, oversize="reject").decode(data)
+    # Still over the cap at 1/8
+    with pytest.raises(ImageTooLarge):
+        open_image(data, (448, 448), max_pixels=50_000)
+
+
+def test_oversize_policy_is_checked():
+    with pytest.raises(ValueError):
+        Preprocessor(oversize="crop")
+
+
+def test_predict_rejects_oversized_images(client2, app2_module, monkeypatch):
+    monkeypatch.setattr(app2_module.preprocessor, "max_pixels", 100_000)
+    response = client2.post("/predict", files={"file": ("meal.png", encode(400, 400, "PNG"))})
+    assert response.status_code == 413
+    response = client2.post("/predict", files={"file": ("meal.png", encode(300, 300, "PNG"))})
+    assert response.status_code == 200
@@ -0,0 +1,45 @@
+# test_upload_pipeline.py
+# upload_pipeline.prepare_image and the pixel cap on /api/analyze(/stream).
+#
+#   python -m pytest -q test_upload_pipeline.py
+import io
+
+import pytest
+from PIL import Image
+
+from test_analyze_stream import post_stream
+from upload_pipeline import ImageTooLarge, prepare_image
+
+
+def encode(width, height, fmt="JPEG"):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(buf, fmt)
+    return buf.getvalue()
+
+
+def test_large_images_are_downscaled():
+    image = prepare_image(encode(3000, 2000, "PNG"), max_edge=1024)
+    assert image.size == (1024, 683) and image.mime == "image/jpeg" and image.data[:2] == b"\xff\xd8"
+
+
+def test_small_and_unreadable_images_pass_through():
+    data = encode(640, 480)
+    assert prepare_image(data, max_edge=1024).data is data
+    assert prepare_image(b"not an image").data == b"not an image"
+
+
+def test_pixel_cap():
+    with pytest.raises(ImageTooLarge):
+        prepare_image(encode(1000, 1000), max_pixels=500_000)
+    assert prepare_image(encode(500, 500), max_pixels=500_000).size == (500, 500)
+
+
+@pytest.mark.parametrize("endpoint", ["analyze", "stream"])
+def test_oversized_upload_is_413(app_module, client, monkeypatch, endpoint):
+    monkeypatch.setattr(app_module, "MAX_IMAGE_PIXELS", 500_000)
+    data = encode(1000, 1000)
+    if endpoint == "stream":
+        response = post_stream(client, data)
+    else:
+        response = client.post("/api/analyze", data={"image": (io.BytesIO(data), "meal.jpg"), "message": ""})
+    assert response.status_code == 413 and "limit" in response.get_json()["error"]
@@ -0,0 +1,48 @@
+# test_upload_store.py
+# UploadStore's byte budget covers originals and variants; an evicted upload
+# answers 404 from /uploads/<name>.
+#
+#   python -m pytest -q test_upload_store.py
+import io
+import os
+
+from PIL import Image
+
+from upload_store import UploadStore
+
+
+def noise_jpeg(seed, size=(800, 600)):
+    out = io.BytesIO()
+    Image.effect_noise(size, 40 + seed).convert("RGB").save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def test_budget_bounds_originals_and_variants(tmp_path):
+    images = [noise_jpeg(i) for i in range(6)]
+    budget = sum(len(data) for data in images) // 2
+    store = UploadStore(str(tmp_path), max_bytes=budget)
+    names = [store.put(data, background=False) for data in images]
+    store.flush()
+    assert disk_bytes(tmp_path) <= budget and store.stats()["bytes"] == disk_bytes(tmp_path)
+    # Least recently used first: the newest upload survives, the oldest does not
+    assert os.path.exists(store.path(names[-1])) and not os.path.exists(store.path(names[0]))
+    # A restart re-indexes what is left
+    assert UploadStore(str(tmp_path), max_bytes=budget).stats()["bytes"] == disk_bytes(tmp_path)
+
+
+def test_evicted_upload_is_404(app_module, client, monkeypatch, tmp_path):
+    store = UploadStore(str(tmp_path))
+    monkeypatch.setattr(app_module, "upload_store", store)
+    url = client.post("/upload", data={"file": (io.BytesIO(noise_jpeg(0)), "meal.jpg")}).get_json()["url"]
+    path = "/uploads/" + url.rsplit("/", 1)[1]
+    store.flush()
+    assert client.get(path).status_code == 200
+
+    store.max_bytes = 1
+    store._evict()
+    assert client.get(path).status_code == 404
+    assert client.get(path + "?size=thumb").status_code == 404
@@ -0,0 +1,123 @@
+# test_upstream.py
+# Retries, circuit breaker and deadlines of upstream.py against fakes.FakeUpstreams.
+#
+#   python -m pytest -q test_upstream.py
+import time
+
+import pytest
+
+import upstream
+from fakes import FakeUpstreams
+from upstream import CircuitBreaker, CircuitOpen, UpstreamError, call_with_retries, make_session, post_json
+
+
+@pytest.fixture
+def fake():
+    with FakeUpstreams() as fake:
+        yield fake
+
+
+@pytest.fixture
+def clarifai(fake):
+    session = make_session()
+    url = f"{fake.url}/v2/models/food-item-recognition/outputs"
+    return lambda: post_json(session, url, {}, timeout=(1.0, 2.0))
+
+
+def test_retries_transient_failures(fake, clarifai):
+    fake.fail_next["clarifai"] = 2
+    errors = []
+    result = call_with_retries(clarifai, retries=2, backoff_s=0.01, on_error=errors.append)
+    assert result["outputs"]
+    assert fake.calls["clarifai"] == 3
+    assert len(errors) == 2 and all(e.retryable for e in errors)
+
+
+def test_gives_up_after_retries(fake, clarifai):
+    fake.fail_next["clarifai"] = 5
+    with pytest.raises(UpstreamError) as exc:
+        call_with_retries(clarifai, retries=1, backoff_s=0.01)
+    assert exc.value.retryable
+    assert fake.calls["clarifai"] == 2
+
+
+def test_breaker_open_half_open_close(fake, clarifai):
+    breaker = CircuitBreaker("clarifai", failure_threshold=2, reset_timeout_s=0.2)
+    fake.fail_next["clarifai"] = 2
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            call_with_retries(clarifai, breaker, retries=0)
+    assert breaker.state == "open"
+
+    # Open: refused without reaching the provider
+    with pytest.raises(CircuitOpen):
+        call_with_retries(clarifai, breaker, retries=0)
+    assert fake.calls["clarifai"] == 2 and breaker.rejected == 1
+
+    time.sleep(0.25)
+    assert breaker.state == "half_open"
+    assert call_with_retries(clarifai, breaker, retries=0)["outputs"]
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens(fake, clarifai):
+    breaker = CircuitBreaker("clarifai", failure_threshold=1, reset_timeout_s=0.1)
+    fake.fail_next["clarifai"] = 2
+    with pytest.raises(UpstreamError):
+        call_with_retries(clarifai, breaker, retries=0)
+    time.sleep(0.15)
+    with pytest.raises(UpstreamError):
+        call_with_retries(clarifai, breaker, retries=0)
+    assert breaker.state == "open"
+
+
+def test_unexpected_exception_settles_trial():
+    breaker = CircuitBreaker("groq", failure_threshold=1, reset_timeout_s=0.1)
+
+    def broken():
+        raise RuntimeError("SDK bug")
+
+    errors = []
+    with pytest.raises(UpstreamError) as exc:
+        call_with_retries(broken, breaker, retries=3, on_error=errors.append)
+    assert not exc.value.retryable and isinstance(exc.value.__cause__, RuntimeError)
+    assert len(errors) == 1 and breaker.state == "open"
+
+    # The half-open trial also fails with a non-UpstreamError; the breaker must not stay stuck
+    time.sleep(0.15)
+    with pytest.raises(UpstreamError):
+        call_with_retries(broken, breaker, retries=0)
+    assert breaker.state == "open"
+    time.sleep(0.15)
+    assert call_with_retries(lambda: "ok", breaker, retries=0) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_invalid_url_is_not_retried():
+    calls = []
+
+    def call():
+        calls.append(1)
+        return post_json(make_session(), "http://", {})
+
+    with pytest.raises(UpstreamError) as exc:
+        call_with_retries(call, retries=3, backoff_s=0.01)
+    assert not exc.value.retryable and len(calls) == 1
+
+
+def test_no_retry_past_deadline(fake, clarifai, monkeypatch):
+    monkeypatch.setattr(upstream.random, "uniform", lambda low, high: high)
+    fake.fail_next["clarifai"] = 5
+    start = time.monotonic()
+    with pytest.raises(UpstreamError):
+        call_with_retries(clarifai, retries=5, backoff_s=1.0, deadline=start + 0.5)
+    assert fake.calls["clarifai"] == 1
+    assert time.monotonic() - start < 0.5
+
+
+def test_read_timeout_is_retryable(fake):
+    fake.clarifai_latency_ms = 300
+    url = f"{fake.url}/v2/models/food-item-recognition/outputs"
+    with pytest.raises(UpstreamError) as exc:
+        post_json(make_session(), url, {}, timeout=(1.0, 0.05))
+    assert exc.value.retryable
@@ -0,0 +1,81 @@
+# upload_pipeline.py
+# In-memory handling of uploaded images before they go to the remote vision
+# APIs (Clarifai, Groq).
+#
+#   * the upload is read once into memory (Werkzeug already spools large
+#     bodies to a temp file; we never write it and read it back),
+#   * images whose long edge exceeds `max_edge` are downscaled and re-encoded
+#     as JPEG before sending: the vision models work at well under 1024 px, so
+#     full-resolution phone photos mostly cost upload bandwidth,
+#   * the payload is base64-encoded once and shared by every upstream call,
+#   * images over `max_pixels` are refused (ImageTooLarge) rather than
+#     decoded or forwarded, like app2's preprocess.open_image.
+#
+# Originals are kept by upload_store.UploadStore.
+import base64
+import io
+
+from PIL import Image, ImageOps
+
+FORMAT_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class PreparedImage:
+    """Bytes to send upstream, plus their base64 form (computed once, on first use)."""
+
+    def __init__(self, data, mime, size, original_bytes):
+        self.data = data
+        self.mime = mime
+        self.size = size                        # (width, height) of `data`
+        self.original_bytes = original_bytes
+        self._b64 = None
+
+    @property
+    def b64(self):
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode("ascii")
+        return self._b64
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime};base64,{self.b64}"
+
+
+def prepare_image(data, max_edge=1024, quality=85, max_pixels=None):
+    """Downscale/recompress `data` for upstream APIs.
+
+    Returns the original bytes untouched when the image is already within
+    `max_edge` (or max_edge is 0), or when re-encoding would not make it
+    smaller. Unreadable data is passed through as-is and left to the
+    provider to reject. Raises ImageTooLarge past `max_pixels` (or PIL's own
+    decompression bomb limit).
+    """
+    try:
+        image = Image.open(io.BytesIO(data))   # reads the header only
+        width, height = image.size
+        fmt = image.format
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        return PreparedImage(data, "image/jpeg", None, len(data))
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height}, limit is {max_pixels} pixels")
+    mime = FORMAT_MIME.get(fmt, "image/jpeg")
+    if not max_edge or max(width, height) <= max_edge:
+        return PreparedImage(data, mime, (width, height), len(data))
+
+    if fmt == "JPEG":
+        # Decode at reduced scale; draft never goes below the requested size
+        image.draft("RGB", (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.BILINEAR)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    if out.tell() >= len(data):
+        return PreparedImage(data, mime, (width, height), len(data))
+    return PreparedImage(out.getvalue(), "image/jpeg", image.size, len(data))
+
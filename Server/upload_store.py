@@ -0,0 +1,224 @@
+# upload_store.py
+# Content-addressed storage for uploaded images, with resized variants and a
+# size budget.
+#
+#   * originals are stored once under the SHA-256 of their bytes
+#     (uploads/<sha256>.<ext>), so re-uploads of the same photo dedupe instead
+#     of overwriting each other or piling up as "images (2).jpeg",
+#   * "thumb" and "display" JPEG variants are generated on a background
+#     thread after each upload (and on demand if one is asked for first),
+#     under uploads/variants/<size>/<sha256>.jpg,
+#   * a name never changes meaning, so what is served under it gets a strong
+#     ETag and long-lived caching (see app.py),
+#   * when the store grows past `max_bytes`, the least recently used images
+#     (an original together with its variants; using any of them counts)
+#     are deleted down to `low_water` of the budget. A name is therefore not
+#     guaranteed to stay servable: an evicted upload answers 404. Variants of
+#     history blobs are evicted the same way and regenerated on demand.
+#     Saved meals keep their own copy in the history store, so eviction
+#     never loses a meal's photo.
+#
+# Files with other names in the folder (pre-existing uploads, sample images)
+# are left alone: they are neither counted nor evicted.
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+VARIANTS = {"thumb": 256, "display": 1024}   # long edge in pixels
+VARIANT_QUALITY = 82
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif", "BMP": ".bmp"}
+NAME_RE = re.compile(r"^(?P<digest>[0-9a-f]{64})(\.[a-z0-9]+)?$")
+
+
+def make_variant(data, max_edge, quality=VARIANT_QUALITY):
+    """JPEG bytes of `data` scaled to fit max_edge (never upscaled)."""
+    image = Image.open(io.BytesIO(data))
+    if image.format == "JPEG":
+        image.draft("RGB", (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.BILINEAR)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True, progressive=max_edge > 512)
+    return out.getvalue()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class UploadStore:
+    def __init__(self, root, max_bytes=0, low_water=0.9, workers=1):
+        self.root = root
+        self.max_bytes = int(max_bytes)   # 0 = unbounded
+        self.low_water = low_water
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._files = {}   # path -> [size, last used]; originals and variants (size None while being written)
+        self._bytes = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-store")
+        self.evicted = 0
+        self._scan()
+
+    def _scan(self):
+        paths = [os.path.join(self.root, n) for n in os.listdir(self.root) if NAME_RE.match(n)]
+        for size in VARIANTS:
+            folder = os.path.join(self.root, "variants", size)
+            if os.path.isdir(folder):
+                paths += [os.path.join(folder, n) for n in os.listdir(folder) if NAME_RE.match(n)]
+        for path in paths:
+            st = os.stat(path)
+            self._files[path] = [st.st_size, st.st_mtime]
+            self._bytes += st.st_size
+
+    @staticmethod
+    def is_stored_name(name):
+        return NAME_RE.match(name) is not None
+
+    def path(self, name):
+        if not NAME_RE.match(name):
+            raise ValueError(f"Invalid upload name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def variant_path(self, digest, size):
+        return os.path.join(self.root, "variants", size, digest + ".jpg")
+
+    def put(self, data, background=True):
+        """Store `data`; returns its name (<sha256>.<ext>).
+
+        With background=True the write, variants and eviction happen on the
+        store's thread and the name may not be servable for a moment.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        try:
+            ext = FORMAT_EXTENSIONS.get(Image.open(io.BytesIO(data)).format, "")
+        except Exception:
+            ext = ""
+        name = digest + ext
+        if background:
+            self._pool.submit(self._store, name, digest, data)
+        else:
+            self._store(name, digest, data, variants=False)
+            self._pool.submit(self._make_variants, digest, data)
+        return name
+
+    def _store(self, name, digest, data, variants=True):
+        path = os.path.join(self.root, name)
+        # Claim the name under the lock so concurrent puts of one image write it once
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None:
+                entry[1] = time.time()
+            else:
+                self._files[path] = [None, time.time()]
+        if entry is None:
+            try:
+                _write_atomic(path, data)
+            except BaseException:
+                with self._lock:
+                    del self._files[path]
+                raise
+            self._account(path, len(data))
+        if variants:
+            self._make_variants(digest, data)
+        return path
+
+    def _make_variants(self, digest, data=None, source_path=None):
+        if data is not None and self._last_used(digest) is None:
+            return   # the upload was evicted before its variants were made
+        try:
+            for size in VARIANTS:
+                self.variant(digest, size, data, source_path, touch=False)
+        except Exception as e:   # not an image PIL can read (or its source was evicted)
+            print(f"Could not make variants of {digest}: {e}")
+        self._evict()
+
+    def variant(self, digest, size, data=None, source_path=None, touch=True):
+        """Path of a resized variant, generating it from `data` or `source_path` if it doesn't exist yet.
+
+        touch=False (background generation) leaves the image's recency as it was.
+        """
+        if size not in VARIANTS:
+            raise ValueError(f"Unknown size {size!r}; expected one of {', '.join(VARIANTS)}")
+        path = self.variant_path(digest, size)
+        if os.path.exists(path):
+            if touch:
+                self.touch(path)
+            return path
+        if data is None:
+            with open(source_path, "rb") as f:
+                data = f.read()
+        variant = make_variant(data, VARIANTS[size])
+        _write_atomic(path, variant)
+        self._account(path, len(variant), None if touch else self._last_used(digest))
+        return path
+
+    def _last_used(self, digest):
+        """Most recent use of any stored file of an image, or None if none is stored."""
+        paths = [os.path.join(self.root, digest + ext) for ext in ("", *FORMAT_EXTENSIONS.values())]
+        paths += [self.variant_path(digest, size) for size in VARIANTS]
+        with self._lock:
+            used = [self._files[p][1] for p in paths if p in self._files]
+        return max(used, default=None)
+
+    def prepare_variants(self, digest, source_path):
+        """Generate every variant of an image stored elsewhere (e.g. a history blob) in the background."""
+        return self._pool.submit(self._make_variants, digest, None, source_path)
+
+    def touch(self, path):
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None:
+                entry[1] = time.time()
+
+    def _account(self, path, size, used=None):
+        with self._lock:
+            entry = self._files.get(path)
+            self._bytes += size - ((entry[0] or 0) if entry is not None else 0)
+            self._files[path] = [size, used or time.time()]
+
+    def _evict(self):
+        if not self.max_bytes or self._bytes <= self.max_bytes:
+            return
+        with self._lock:
+            target = self.max_bytes * self.low_water
+            images = {}   # digest -> [last used by any file, paths, busy]
+            for path, (size, used) in self._files.items():
+                image = images.setdefault(os.path.basename(path)[:64], [0.0, [], False])
+                image[0] = max(image[0], used)
+                image[1].append(path)
+                image[2] = image[2] or size is None   # an original still being written
+            victims = []
+            for _, paths, busy in sorted(images.values(), key=lambda image: image[0]):
+                if self._bytes <= target:
+                    break
+                if busy:
+                    continue
+                for path in paths:
+                    self._bytes -= self._files.pop(path)[0]
+                    victims.append(path)
+        for path in victims:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.evicted += len(victims)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._files), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "evicted": self.evicted}
+
+    def flush(self):
+        """Wait for queued writes (used by tests and benchmarks)."""
+        self._pool.submit(lambda: None).result()
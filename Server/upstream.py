@@ -0,0 +1,157 @@
+# upstream.py
+# Resilient calls to remote APIs (Clarifai, Groq).
+#
+#   * one pooled requests.Session per process (keep-alive, no per-call TLS handshake)
+#   * explicit connect/read timeouts on every call
+#   * bounded retries with full-jitter exponential backoff, for transient
+#     failures only (connection errors, timeouts, 429 and 5xx)
+#   * a circuit breaker per provider, so a degraded provider fails fast
+#     instead of tying up every worker for the full timeout
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamError(Exception):
+    """A provider call failed; `retryable` marks transient failures."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures;
+    open -> half-open after `reset_timeout_s`, letting one trial call through."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout_s=30.0):
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout_s = float(reset_timeout_s)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout_s:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit is open", retryable=False)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def call_with_retries(fn, breaker=None, retries=2, backoff_s=0.2, max_backoff_s=2.0, deadline=None,
+                      on_error=None):
+    """Call fn() with retries on retryable UpstreamErrors.
+
+    Each attempt passes through `breaker`; any other exception from fn() is
+    recorded as a breaker failure and re-raised as a non-retryable
+    UpstreamError (so a half-open trial is always settled). Backoff is full jitter,
+    uniform(0, min(max_backoff_s, backoff_s * 2**attempt)), and no retry is
+    started past `deadline` (time.monotonic()). `on_error(exc)` is called for
+    every failed attempt, including calls refused by an open breaker.
+    """
+    attempt = 0
+    while True:
+        try:
+            if breaker is not None:
+                breaker.before_call()
+        except CircuitOpen as e:
+            if on_error is not None:
+                on_error(e)
+            raise
+        try:
+            result = fn()
+        except UpstreamError as e:
+            if on_error is not None:
+                on_error(e)
+            if breaker is not None:
+                if e.retryable:
+                    breaker.record_failure()
+                else:
+                    # The provider answered (e.g. 4xx); it's healthy even if the call failed
+                    breaker.record_success()
+            if not e.retryable or attempt >= retries:
+                raise
+            delay = random.uniform(0, min(max_backoff_s, backoff_s * (2 ** attempt)))
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure()
+            error = UpstreamError(f"{type(e).__name__}: {e}", retryable=False)
+            if on_error is not None:
+                on_error(error)
+            raise error from e
+        except BaseException:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def make_session(pool_size=20):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def post_json(session, url, payload, headers=None, timeout=(3.0, 15.0)):
+    """POST JSON and return the decoded body, mapping failures to UpstreamError."""
+    try:
+        response = session.post(url, json=payload, headers=headers, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+        raise UpstreamError(f"{url}: {e}", retryable=True) from e
+    except requests.RequestException as e:   # e.g. InvalidURL: retrying won't help
+        raise UpstreamError(f"{url}: {e}") from e
+    if response.status_code == 429 or response.status_code >= 500:
+        raise UpstreamError(f"{url}: HTTP {response.status_code}", retryable=True)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise UpstreamError(f"{url}: invalid JSON (HTTP {response.status_code})") from e